@@ -1,10 +1,12 @@
 """
-Celery setup. Note that we don't store results.
+Celery setup. Note that we don't store results, except for voter import
+progress.
 """
 
 from __future__ import absolute_import
 
 import os
+from datetime import timedelta
 
 from celery import Celery
 
@@ -28,4 +30,23 @@ app.conf.update(
     # Use JSON to serialize task arguments to avoid issues with pickle
     CELERY_ACCEPT_CONTENT=['json'],
     CELERY_TASK_SERIALIZER='json',
+
+    # Voter file imports can take hours, so they get their own queue and
+    # worker (see the Procfile) and never starve validate_voter.
+    CELERY_ROUTES={
+        'voter_validation.tasks.import_voter_file': {'queue': 'imports'},
+    },
 )
+
+if settings.VALIDATION_BATCHING:
+    app.conf.update(
+        CELERYBEAT_SCHEDULE={
+            'drain-validations': {
+                'task': 'voter_validation.tasks.drain_validations',
+                'schedule': timedelta(
+                    seconds=settings.VALIDATION_BATCH_INTERVAL),
+                # A run that is missed is made up by the next one.
+                'options': {'expires': settings.VALIDATION_BATCH_INTERVAL},
+            },
+        },
+    )
@@ -175,6 +175,45 @@ else:
     # dynos we can spin up.
     DATABASES['default']['CONN_MAX_AGE'] = 500
 
+# Voter search settings. See voter_validation/search.py for the backends and
+# strategies. Use 'voter_validation.memory_search.MemorySearchBackend' to rank
+# voters in memory instead of in Postgres.
+VOTER_SEARCH_BACKEND = os.environ.get(
+    'VOTER_SEARCH_BACKEND', 'voter_validation.search.PostgresSearchBackend')
+VOTER_SEARCH_STRATEGY = os.environ.get('VOTER_SEARCH_STRATEGY',
+                                       'trigram_knn')
+# Max age (in seconds) of the in-memory search index before it is rebuilt.
+MEMORY_SEARCH_MAX_AGE = int(os.environ.get('MEMORY_SEARCH_MAX_AGE', '3600'))
+# Search result cache: 'locmem' (per web worker), 'redis' (shared), or empty
+# to disable it. See voter_validation/search_cache.py.
+SEARCH_CACHE = os.environ.get('SEARCH_CACHE', 'locmem')
+# Max number of cached searches, and seconds before a cached search expires.
+SEARCH_CACHE_MAX_ENTRIES = int(
+    os.environ.get('SEARCH_CACHE_MAX_ENTRIES', '10000'))
+SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', '600'))
+# Answer searches typed exactly (voter ID, or full name and ZIP) by index
+# lookup, skipping the fuzzy ranking.
+SEARCH_EXACT_MATCH = bool(int(os.environ.get('SEARCH_EXACT_MATCH', '1')))
+# Number of threads that rank the ZIP partitions of searches without a ZIP in
+# parallel (see PostgresSearchBackend). Each thread keeps its own DB
+# connection, so this adds up to this many connections per web process. Set
+# to 0 to rank all partitions in one query.
+SEARCH_FANOUT_WORKERS = int(os.environ.get('SEARCH_FANOUT_WORKERS', '4'))
+# Time budget (in milliseconds) of each search query. A search that runs out of
+# time is retried once with fewer candidates, and its results are marked
+# partial, so a search takes at most about twice this. Set to 0 for no budget.
+SEARCH_TIMEOUT_MS = int(os.environ.get('SEARCH_TIMEOUT_MS', '1000'))
+
+# Validation batching. If enabled, validations are queued in Redis and applied
+# in batches by a periodic Celery task, instead of one task per validation.
+# See voter_validation/validation_queue.py.
+VALIDATION_BATCHING = bool(int(os.environ.get('VALIDATION_BATCHING', '0')))
+# Max number of queued validations applied at a time.
+VALIDATION_BATCH_SIZE = int(os.environ.get('VALIDATION_BATCH_SIZE', '500'))
+# Seconds between runs of the task that drains the validation queue.
+VALIDATION_BATCH_INTERVAL = float(
+    os.environ.get('VALIDATION_BATCH_INTERVAL', '2'))
+
 # Logging support
 LOGGING = {
     'version': 1,
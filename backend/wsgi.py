@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
 application = Cling(get_wsgi_application())
+
+# Load search state (e.g. the in-memory search index) before serving requests.
+from voter_validation.search import warm_up_search_backend  # noqa
+warm_up_search_backend()
@@ -0,0 +1,175 @@
+"""
+Maintains the ActiveVoter search projection: a narrow copy of the Active
+Voters with only the fields searches need (see models.ActiveVoter).
+
+Voter file imports refresh it once they are done (see voter_import.py), in a
+separate transaction. Rows are only rewritten for Voters that were added,
+changed (by content_hash) or whose registration status changed, so a refresh
+costs one pass comparing the two tables plus the import's changes. Until the
+refresh commits, searches keep seeing the Voters from before the import.
+
+The projection is range-partitioned by ZIP (see partition_active_voters), so
+searches with a ZIP only read one partition, and searches without one can rank
+each partition in parallel (see search.PostgresSearchBackend).
+"""
+import logging
+import re
+
+from django.db import connection
+
+from voter_validation.ddl import table_indexes, suffixed_name, \
+    INDEX_DEF_REGEX
+from voter_validation.models import ActiveVoter, Voter, RegStatus
+
+logger = logging.getLogger(__name__)
+
+NEW_SUFFIX = '_new'
+PARTITION_SUFFIX = '_p%d'
+PARTITION_BOUND_REGEX = re.compile(r"FROM \((.+)\) TO \((.+)\)")
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+def refresh_active_voters(cursor, full=False):
+    """
+    Syncs ActiveVoter with the Active Voters in the Voter table.
+    :param full: if True, rewrite every row, e.g. after the Voter search
+    columns were recomputed without changing content_hash
+    :return: dict with the number of rows "deleted" and "inserted"
+    """
+    active_table = qn(ActiveVoter._meta.db_table)
+    voter_table = qn(Voter._meta.db_table)
+    columns = ', '.join(qn(f.column) for f in ActiveVoter._meta.fields)
+    active = RegStatus.ACTIVE.value
+
+    if full:
+        cursor.execute("DELETE FROM %s" % active_table)
+    else:
+        cursor.execute(
+            "DELETE FROM %s a WHERE NOT EXISTS ("
+            "SELECT 1 FROM %s v WHERE v.voter_id = a.voter_id "
+            "AND v.reg_status = %%s AND v.content_hash = a.content_hash)" %
+            (active_table, voter_table), [active])
+    deleted = cursor.rowcount
+    cursor.execute(
+        "INSERT INTO %s (%s) SELECT %s FROM %s v WHERE v.reg_status = %%s "
+        "AND NOT EXISTS (SELECT 1 FROM %s a WHERE a.voter_id = v.voter_id)" %
+        (active_table, columns, columns, voter_table, active_table),
+        [active])
+    inserted = cursor.rowcount
+    logger.info("Refreshed active voters: %d deleted, %d inserted", deleted,
+                inserted)
+    return {'deleted': deleted, 'inserted': inserted}
+
+
+def zip_partition_bounds(cursor, partitions):
+    """
+    Splits the Active Voters into about equally sized groups of ZIPs.
+    :param partitions: number of groups
+    :return: sorted list of the ZIPs that start each group after the first
+    """
+    if partitions < 2:
+        return []
+    # The first fraction (0) gives the lowest ZIP, which can't start a group.
+    fractions = [i / float(partitions) for i in range(partitions)]
+    cursor.execute(
+        "SELECT percentile_disc(%%s::float8[]) WITHIN GROUP "
+        "(ORDER BY res_addr_zip) FROM %s" % qn(ActiveVoter._meta.db_table),
+        [fractions])
+    bounds = cursor.fetchone()[0]
+    if not bounds:
+        return []
+    return sorted(set(b for b in bounds[1:] if b > bounds[0]))
+
+
+def partition_active_voters(cursor, partitions):
+    """
+    Rebuilds ActiveVoter as a table range-partitioned by res_addr_zip, with
+    partitions holding about the same number of Active Voters. Rebalance it
+    after importing Voters in other ZIPs, e.g. from another county. The new
+    table gets the old table's indexes, and is swapped in with a few renames.
+    Must be called inside a transaction. Searches keep reading the old table
+    until the transaction commits.
+    :param partitions: number of partitions. 1 for a table that isn't
+    partitioned.
+    :return: list of (first ZIP, ZIP after the last) of each partition, with
+    None for no bound
+    """
+    table = ActiveVoter._meta.db_table
+    new_table = table + NEW_SUFFIX
+    # Block refreshes, but not searches, while copying.
+    cursor.execute("LOCK TABLE %s IN SHARE MODE" % qn(table))
+    indexes = table_indexes(cursor, table)
+    old_partitions = [name for name, _ in active_voter_partitions(cursor)]
+
+    bounds = zip_partition_bounds(cursor, partitions)
+    ranges = list(zip([None] + bounds, bounds + [None]))
+    cursor.execute("DROP TABLE IF EXISTS %s" % qn(new_table))
+    if partitions > 1:
+        cursor.execute(
+            "CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (res_addr_zip)" % (qn(new_table), qn(table)))
+        for i, (zip_from, zip_to) in enumerate(ranges):
+            cursor.execute(
+                "CREATE TABLE %s PARTITION OF %s FOR VALUES FROM (%s) TO (%s)"
+                % (qn(new_table + PARTITION_SUFFIX % i), qn(new_table),
+                   '%s' if zip_from else 'MINVALUE',
+                   '%s' if zip_to else 'MAXVALUE'),
+                [b for b in (zip_from, zip_to) if b])
+    else:
+        ranges = [(None, None)]
+        cursor.execute("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)" %
+                       (qn(new_table), qn(table)))
+    cursor.execute("INSERT INTO %s SELECT * FROM %s" %
+                   (qn(new_table), qn(table)))
+
+    # The primary key of a partitioned table has to include the partition
+    # key, so it is (voter_id, res_addr_zip).
+    for name, definition, contype in indexes:
+        new_name = suffixed_name(name, NEW_SUFFIX)
+        if contype == 'p':
+            cursor.execute(
+                "ALTER TABLE %s ADD CONSTRAINT %s PRIMARY KEY (voter_id%s)" %
+                (qn(new_table), qn(new_name),
+                 ', res_addr_zip' if partitions > 1 else ''))
+        else:
+            cursor.execute(INDEX_DEF_REGEX.sub(
+                r'\1 %s ON %s ' % (qn(new_name), qn(new_table)), definition))
+    cursor.execute("ANALYZE %s" % qn(new_table))
+
+    cursor.execute("DROP TABLE %s" % qn(table))
+    cursor.execute("ALTER TABLE %s RENAME TO %s" % (qn(new_table), qn(table)))
+    for name, _, _ in indexes:
+        cursor.execute("ALTER INDEX %s RENAME TO %s" %
+                       (qn(suffixed_name(name, NEW_SUFFIX)), qn(name)))
+    if partitions > 1:
+        for i in range(len(ranges)):
+            cursor.execute("ALTER TABLE %s RENAME TO %s" % (
+                qn(new_table + PARTITION_SUFFIX % i),
+                qn(table + PARTITION_SUFFIX % i)))
+    logger.info("Partitioned active voters into %d partitions (was %d)",
+                len(ranges), max(len(old_partitions), 1))
+    return ranges
+
+
+def active_voter_partitions(cursor):
+    """
+    :return: list of (partition name, (first ZIP, ZIP after the last)) of the
+    ActiveVoter partitions, ordered by ZIP, with None for no bound. Empty if
+    the table isn't partitioned.
+    """
+    cursor.execute(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass", [ActiveVoter._meta.db_table])
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = PARTITION_BOUND_REGEX.search(bound)
+        partitions.append((name, tuple(
+            None if value.endswith('VALUE') else value.strip("'")
+            for value in match.groups())))
+    # None sorts first, as the lowest bound.
+    partitions.sort(key=lambda p: (p[1][0] is not None, p[1][0] or ''))
+    return partitions
@@ -1,7 +1,10 @@
 from django.contrib import admin
-from .models import Voter, Campaign, UserProfile, ValidationRecord
+from .models import Voter, Campaign, UserProfile, ValidationRecord, \
+    CampaignCounter, ValidatorHourlyCounter
 
 admin.site.register(Voter)
 admin.site.register(Campaign)
 admin.site.register(UserProfile)
 admin.site.register(ValidationRecord)
+admin.site.register(CampaignCounter)
+admin.site.register(ValidatorHourlyCounter)
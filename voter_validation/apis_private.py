@@ -1,11 +1,17 @@
 """
 Private APIs (as linked to by urls.py)
 """
+import json
+
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 
 from voter_validation.common import create_json_response, bad_request
 from voter_validation.models import Voter
-from voter_validation.tasks import validate_voter
+from voter_validation.search import voter_search, make_cursor, parse_cursor
+from voter_validation.tasks import validate_voter, validate_voters, \
+    import_progress
+from voter_validation.validation_queue import enqueue_validations
 
 
 @csrf_exempt
@@ -38,13 +44,155 @@ def validation_api(request):
     if voter.count() == 0:
         return bad_request("Invalid request: invalid Voter ID specified.")
 
-    # Asynchronously validate/invalidate voter.
+    # Asynchronously validate/invalidate voter, either in a batch or in its
+    # own task.
     val = request.POST.get("val", "false").lower() == "true"
-    validate_voter.delay(voter_id=voter_id,
-                         campaign_id=campaign_id,
-                         val=val,
-                         validator_username=request.user.username)
+    validation = dict(voter_id=voter_id,
+                      campaign_id=campaign_id,
+                      val=val,
+                      validator_username=request.user.username)
+    if settings.VALIDATION_BATCHING:
+        enqueue_validations([validation])
+    else:
+        validate_voter.delay(**validation)
     return create_json_response({
         "result": "success",
         "message": "Voter asynchronously saved",
     })
+
+
+# Max number of validations accepted by bulk_validation_api at a time.
+MAX_BULK_VALIDATIONS = 200
+
+
+@csrf_exempt
+def bulk_validation_api(request):
+    """
+    An API to validate/invalidate several Voters for a Campaign at once. Only
+    responds to POSTs, with a JSON body containing:
+        * campaign_id: the Campaign to validate for
+        * validations: list of [voter_id, val] pairs, where val is the JSON
+          boolean true to validate and false to invalidate.
+
+    The validations are checked with one query and queued as a single unit.
+    Unknown voter IDs are skipped, and listed in the response's
+    invalid_voter_ids.
+    """
+    if request.method != 'POST':
+        return bad_request("Invalid request: not POST.")
+
+    if not request.user.is_authenticated():
+        return bad_request("Invalid request: not authenticated.")
+
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+        campaign_id = int(data['campaign_id'])
+        pairs = [(str(voter_id), val)
+                 for voter_id, val in data['validations']]
+    except (ValueError, KeyError, TypeError):
+        return bad_request("Invalid request: malformed JSON body.")
+    # Strings like "false" would be truthy, so only accept booleans.
+    if not all(isinstance(val, bool) for _, val in pairs):
+        return bad_request("Invalid request: val must be true or false.")
+    if len(pairs) > MAX_BULK_VALIDATIONS:
+        return bad_request("Invalid request: more than %d validations." %
+                           MAX_BULK_VALIDATIONS)
+
+    if not request.user.userprofile.in_campaign(campaign_id):
+        return bad_request(
+            "Invalid request: user not authenticated for Campaign.")
+
+    requested_ids = set(voter_id for voter_id, _ in pairs)
+    voter_ids = set(Voter.objects.filter(voter_id__in=requested_ids)
+                    .values_list('voter_id', flat=True))
+    validations = [dict(voter_id=voter_id,
+                        campaign_id=campaign_id,
+                        val=val,
+                        validator_username=request.user.username)
+                   for voter_id, val in pairs if voter_id in voter_ids]
+
+    # Asynchronously validate/invalidate voters as one unit.
+    if validations:
+        if settings.VALIDATION_BATCHING:
+            enqueue_validations(validations)
+        else:
+            validate_voters.delay(validations)
+    return create_json_response({
+        "result": "success",
+        "message": "%d voters asynchronously saved" % len(validations),
+        "invalid_voter_ids": sorted(requested_ids - voter_ids),
+    })
+
+
+# Default and max number of results per page returned by search_api.
+SEARCH_PAGE_SIZE = 5
+MAX_SEARCH_PAGE_SIZE = 60
+
+
+@csrf_exempt
+def search_api(request):
+    """
+    An API to search for Voters, one page at a time. Only responds to POSTs,
+    so the search fields stay out of request logs, with a JSON body
+    containing:
+        * campaign_id: the Campaign being validated for
+        * name, address, zip: the search fields (see views.validate)
+        * page_size: optional number of results to return
+        * cursor: optional next_cursor from the previous page's response
+
+    Responds with the page's results (see VoterSerializer), next_cursor,
+    which is null on the last page, and partial, which is true if the search
+    ran out of time and some matches may be missing.
+    """
+    if request.method != 'POST':
+        return bad_request("Invalid request: not POST.")
+
+    if not request.user.is_authenticated():
+        return bad_request("Invalid request: not authenticated.")
+
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+        campaign_id = int(data['campaign_id'])
+        name = str(data.get("name", ""))
+        address = str(data.get("address", ""))
+        res_zip = str(data.get("zip", ""))
+        page_size = int(data.get("page_size", SEARCH_PAGE_SIZE))
+        cursor = data.get("cursor")
+        after = parse_cursor(str(cursor)) if cursor else None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return bad_request("Invalid request: malformed JSON body.")
+    if not 0 < page_size <= MAX_SEARCH_PAGE_SIZE:
+        return bad_request("Invalid request: page_size must be 1 to %d." %
+                           MAX_SEARCH_PAGE_SIZE)
+
+    if not request.user.userprofile.in_campaign(campaign_id):
+        return bad_request(
+            "Invalid request: user not authenticated for Campaign.")
+
+    # Fetch one extra result to tell if there is another page. Voters that
+    # are no longer Active are left out of the results, so the page and
+    # cursor are taken from the ranked hits.
+    results = voter_search(name, address, res_zip, campaign_id=campaign_id,
+                           limit=page_size + 1, after=after)
+    partial = results.partial
+    next_cursor = None
+    if len(results.hits) > page_size:
+        next_cursor = make_cursor(results.hits[page_size - 1])
+        page_ids = set(hit.voter_id for hit in results.hits[:page_size])
+        results = [result for result in results if result['id'] in page_ids]
+
+    return create_json_response({
+        "results": results,
+        "next_cursor": next_cursor,
+        "partial": partial,
+    })
+
+
+def import_status_api(request, task_id):
+    """
+    An API to poll the progress of a background voter file import, for staff
+    only. Responds with the dict from tasks.import_progress.
+    """
+    if not request.user.is_authenticated() or not request.user.is_staff:
+        return bad_request("Invalid request: not authenticated as staff.")
+    return create_json_response(import_progress(task_id))
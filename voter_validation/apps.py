@@ -3,8 +3,21 @@ File for handling app configuration.
 """
 
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+
+def init_connection(sender, connection, **kwargs):
+    """
+    Per-connection setup, run whenever Django opens a new DB connection.
+    """
+    from voter_validation.search import set_similarity_threshold
+    if connection.vendor == 'postgresql':
+        set_similarity_threshold(connection)
 
 
 class VoterValidationConfig(AppConfig):
     name = 'voter_validation'
     verbose_name = "Voter Validation"
+
+    def ready(self):
+        connection_created.connect(init_connection)
@@ -0,0 +1,340 @@
+"""
+Bulk voter file import using PostgreSQL COPY. The Master Voter File is
+streamed into an unlogged staging table, and then merged into the Voter table
+with a handful of set-based statements, instead of several queries per row.
+
+This must be run inside a transaction (see the update_voters command).
+"""
+import csv
+import logging
+
+from django.db import connection
+from psycopg2.extras import execute_values
+
+from voter_validation.common import VOTER_FILE_MAPPING, ADD_CHANGES_SQL, \
+    voter_content_hash_sql, voter_search_columns
+from voter_validation.counters import status_changes_sql, \
+    add_status_change_counts, create_status_changes_table
+from voter_validation.models import Voter, ValidationRecord, RegStatus
+
+logger = logging.getLogger(__name__)
+
+STAGING_TABLE = 'voter_validation_voter_staging'
+NEW_VOTERS_TABLE = 'voter_validation_voter_new'
+VOTER_FILE_ENCODING = 'latin1'
+
+# reg_status_reason for voters marked Inactive because they are no longer in
+# the voter file.
+MISSING_VOTER_REASON = 'Not in voter file'
+
+# Voter fields that are combined into Voter.full_name (see Voter.save).
+FULL_NAME_FIELDS = ['first_name', 'middle_name', 'last_name', 'suffix']
+
+# Voter search columns, which are computed in Python (see
+# add_search_columns).
+SEARCH_FIELDS = ['search_name', 'search_addr', 'first_name_phonetic',
+                 'last_name_phonetic']
+# Number of voters whose search columns are computed at a time.
+SEARCH_COLUMNS_BATCH_SIZE = 10000
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+def read_header(fileobj):
+    """
+    Reads the header line of a voter file TSV.
+    :param fileobj: binary file-like object positioned at the start of the file
+    :return: list of column names
+    """
+    line = fileobj.readline().decode(VOTER_FILE_ENCODING).rstrip('\r\n')
+    header = next(csv.reader([line], delimiter='\t'))
+    missing = (set(VOTER_FILE_MAPPING) | set(ADD_CHANGES_SQL)) - set(header)
+    if missing:
+        raise ValueError("Voter file is missing columns: %s" %
+                         ', '.join(sorted(missing)))
+    return header
+
+
+def copy_to_staging(cursor, fileobj, header):
+    """
+    Creates the staging table with one text column per voter file column, and
+    COPYs the rest of the file into it. staging_id records file order.
+    :return: number of rows copied
+    """
+    cursor.execute("DROP TABLE IF EXISTS %s" % qn(STAGING_TABLE))
+    columns = ', '.join('%s text' % qn(c) for c in header)
+    cursor.execute("CREATE UNLOGGED TABLE %s (staging_id bigserial, %s)" %
+                   (qn(STAGING_TABLE), columns))
+    cursor.copy_expert(
+        "COPY %s (%s) FROM STDIN WITH (FORMAT csv, DELIMITER E'\\t', "
+        "ENCODING '%s')" % (qn(STAGING_TABLE),
+                            ', '.join(qn(c) for c in header),
+                            VOTER_FILE_ENCODING),
+        fileobj)
+    return cursor.rowcount
+
+
+def voter_field_expressions():
+    """
+    Returns an ordered list of (Voter field, SQL expression over the staging
+    table) pairs, applying the same transformations as a row-by-row import.
+    """
+    exprs = []
+    for vf_name, field_name in sorted(VOTER_FILE_MAPPING.items()):
+        exprs.append((field_name, "COALESCE(s.%s, '')" % qn(vf_name)))
+    for vf_name, (transf, field_name) in sorted(ADD_CHANGES_SQL.items()):
+        exprs.append(
+            (field_name, transf % ("COALESCE(s.%s, '')" % qn(vf_name))))
+    return exprs
+
+
+def build_new_voters(cursor):
+    """
+    Creates a temporary table of Voters as they appear in the staging table,
+    along with their content_hash. If a voter ID appears more than once, the
+    last row in the file wins.
+    :return: list of Voter fields set by the voter file
+    """
+    exprs = voter_field_expressions()
+    cursor.execute("DROP TABLE IF EXISTS %s" % qn(NEW_VOTERS_TABLE))
+    cursor.execute(
+        "CREATE TEMPORARY TABLE %s AS "
+        "SELECT DISTINCT ON (voter_id) *, %s AS content_hash FROM "
+        "(SELECT s.staging_id, %s FROM %s s) t "
+        "ORDER BY voter_id, staging_id DESC" %
+        (qn(NEW_VOTERS_TABLE), voter_content_hash_sql('t'),
+         ', '.join('%s AS %s' % (expr, qn(field)) for field, expr in exprs),
+         qn(STAGING_TABLE)))
+    return [field for field, _ in exprs]
+
+
+def full_name_sql(alias):
+    """
+    SQL equivalent of how Voter.save combines names into full_name.
+    """
+    return "concat_ws(' ', %s)" % ', '.join(
+        "NULLIF(%s.%s, '')" % (alias, qn(f)) for f in FULL_NAME_FIELDS)
+
+
+def load_new_voters(cursor, fileobj):
+    """
+    COPYs the voter file into the staging table and builds the new Voters
+    table from it.
+    :return: list of Voter fields set by the voter file
+    """
+    header = read_header(fileobj)
+    rows = copy_to_staging(cursor, fileobj, header)
+    logger.info("Copied %d voter file rows to staging table", rows)
+    return build_new_voters(cursor)
+
+
+def add_search_columns(cursor):
+    """
+    Adds the Voter search columns to the new Voters table. Unchanged voters
+    keep the values in the live Voter table. Accent folding and phonetic keys
+    need Python, so for new and changed voters the values are computed in
+    batches with common.voter_search_columns, like Voter.save does.
+    :return: SEARCH_FIELDS, the fields added to the new Voters table
+    """
+    new_table = qn(NEW_VOTERS_TABLE)
+    db_types = [Voter._meta.get_field(f).db_type(connection)
+                for f in SEARCH_FIELDS]
+    cursor.execute("ALTER TABLE %s %s" % (new_table, ', '.join(
+        'ADD COLUMN %s %s' % (qn(f), db_type)
+        for f, db_type in zip(SEARCH_FIELDS, db_types))))
+    cursor.execute(
+        "UPDATE %s n SET %s FROM %s v "
+        "WHERE v.voter_id = n.voter_id AND v.content_hash = n.content_hash" %
+        (new_table, ', '.join('%s = v.%s' % (qn(f), qn(f))
+                              for f in SEARCH_FIELDS),
+         qn(Voter._meta.db_table)))
+
+    # Read through a server-side cursor, so that all changed voters don't
+    # have to fit in memory at once.
+    computed = 0
+    with connection.chunked_cursor() as changed:
+        changed.execute("SELECT voter_id, first_name, last_name, %s, res_addr "
+                        "FROM %s n WHERE search_name IS NULL" %
+                        (full_name_sql('n'), new_table))
+        while True:
+            rows = changed.fetchmany(SEARCH_COLUMNS_BATCH_SIZE)
+            if not rows:
+                break
+            # Empty arrays have no type in VALUES, so cast every column.
+            execute_values(
+                cursor,
+                "UPDATE %s n SET %s FROM (VALUES %%s) AS s (voter_id, %s) "
+                "WHERE n.voter_id = s.voter_id" % (
+                    new_table,
+                    ', '.join('%s = s.%s::%s' % (qn(f), qn(f), db_type)
+                              for f, db_type in zip(SEARCH_FIELDS, db_types)),
+                    ', '.join(qn(f) for f in SEARCH_FIELDS)),
+                [(row[0],) + voter_search_columns(*row[1:]) for row in rows],
+                page_size=len(rows))
+            computed += len(rows)
+    logger.info("Computed search columns for %d new or changed voters",
+                computed)
+    return list(SEARCH_FIELDS)
+
+
+def drop_new_voters(cursor):
+    cursor.execute("DROP TABLE IF EXISTS %s" % qn(NEW_VOTERS_TABLE))
+    cursor.execute("DROP TABLE IF EXISTS %s" % qn(STAGING_TABLE))
+
+
+def invalidate_validation_records(cursor, voter_table=None):
+    """
+    Unsets the Voter on ValidationRecords for voters that are Inactive, in one
+    statement. This is equivalent to setting vr.voter = None and saving each
+    record, which keeps the denormalized voter fields.
+    :param voter_table: Voter table to check reg_status in (default: the live
+    Voter table)
+    :return: number of ValidationRecords invalidated
+    """
+    cursor.execute(
+        "UPDATE %s vr SET voter_id = NULL, last_updated = now() FROM %s v "
+        "WHERE vr.voter_id = v.voter_id AND v.reg_status = %%s" %
+        (qn(ValidationRecord._meta.db_table),
+         qn(voter_table or Voter._meta.db_table)),
+        [RegStatus.INACTIVE.value])
+    return cursor.rowcount
+
+
+def not_in_new_voters_sql():
+    """
+    Anti-join condition (over Voter alias v) for voters that are missing from
+    the new Voters table.
+    """
+    return "NOT EXISTS (SELECT 1 FROM %s n WHERE n.voter_id = v.voter_id)" % \
+        qn(NEW_VOTERS_TABLE)
+
+
+def missing_voters(cursor, condition, params=(), voter_table=None,
+                   inactivate=False):
+    """
+    Finds voters that are no longer in the voter file and aren't Inactive yet.
+    :param condition: SQL condition over Voter alias v that selects voters
+    missing from the voter file (e.g. not_in_new_voters_sql())
+    :param voter_table: Voter table to check (default: the live Voter table)
+    :param inactivate: if True, mark the missing voters as Inactive (and
+    update their content_hash to match). Otherwise just count them. Voters
+    inactivated in the live Voter table are recorded for the campaign
+    counters (see counters.status_changes_sql).
+    :return: number of missing voters
+    """
+    live = voter_table is None
+    voter_table = qn(voter_table or Voter._meta.db_table)
+    where = "v.reg_status <> %%s AND %s" % condition
+    params = [RegStatus.INACTIVE.value] + list(params)
+    if not inactivate:
+        cursor.execute("SELECT count(*) FROM %s v WHERE %s" %
+                       (voter_table, where), params)
+        return cursor.fetchone()[0]
+
+    overrides = {'reg_status': '%s', 'reg_status_reason': '%s'}
+    update = "UPDATE %s v SET reg_status = %%s, reg_status_reason = %%s, " \
+        "content_hash = %s" % (voter_table,
+                               voter_content_hash_sql('v', overrides))
+    params = [RegStatus.INACTIVE.value, MISSING_VOTER_REASON] * 2 + params
+    if not live:
+        cursor.execute("%s WHERE %s" % (update, where), params)
+        return cursor.rowcount
+
+    # Join the table again for each voter's old reg_status.
+    create_status_changes_table(cursor)
+    cursor.execute(status_changes_sql(
+        "%s FROM %s o WHERE o.voter_id = v.voter_id AND %s RETURNING "
+        "v.voter_id, o.reg_status AS old_status, v.reg_status AS new_status"
+        % (update, voter_table, where)), params)
+    return cursor.fetchone()[0]
+
+
+def merge_new_voters(cursor, fields, inactivate_missing=False):
+    """
+    Merges the new Voters table into the Voter table, updates the campaign
+    counters for voters whose Active status changed, and invalidates
+    ValidationRecords of voters that are now Inactive.
+    :param fields: Voter fields to copy from the new Voters table
+    :param inactivate_missing: if True, voters that are not in the new Voters
+    table are marked Inactive (see missing_voters)
+    :return: dict with voters_add, voters_unmod, voters_mod, voters_missing
+    and vrs_invalidated counts, as reported by update_voters.
+    """
+    voter_table = qn(Voter._meta.db_table)
+    new_table = qn(NEW_VOTERS_TABLE)
+
+    cursor.execute("SELECT count(*) FROM %s n JOIN %s v USING (voter_id)" %
+                   (new_table, voter_table))
+    voters_existing = cursor.fetchone()[0]
+
+    # Update existing voters where any field from the voter file changed, i.e.
+    # where the content hash changed.
+    full_name = full_name_sql('n')
+    assignments = ['%s = n.%s' % (qn(f), qn(f)) for f in fields
+                   if f != 'voter_id']
+    assignments.append('full_name = %s' % full_name)
+    assignments.append('content_hash = n.content_hash')
+    # Join the Voter table again for each voter's old reg_status, so that
+    # changes to it are recorded for the campaign counters.
+    create_status_changes_table(cursor)
+    cursor.execute(status_changes_sql(
+        "UPDATE %s v SET %s FROM %s n JOIN %s o USING (voter_id) "
+        "WHERE v.voter_id = n.voter_id "
+        "AND v.content_hash IS DISTINCT FROM n.content_hash RETURNING "
+        "v.voter_id, o.reg_status AS old_status, v.reg_status AS new_status" %
+        (voter_table, ', '.join(assignments), new_table, voter_table)))
+    voters_mod = cursor.fetchone()[0]
+
+    # Add new voters.
+    columns = [qn(f) for f in fields] + ['full_name', 'content_hash']
+    cursor.execute(
+        "INSERT INTO %s (%s) SELECT %s FROM %s n "
+        "ON CONFLICT (voter_id) DO NOTHING" %
+        (voter_table, ', '.join(columns),
+         ', '.join(['n.%s' % qn(f) for f in fields] +
+                   [full_name, 'n.content_hash']),
+         new_table))
+    voters_add = cursor.rowcount
+
+    voters_missing = missing_voters(cursor, not_in_new_voters_sql(),
+                                    inactivate=inactivate_missing)
+    add_status_change_counts(cursor)
+
+    return {
+        'voters_add': voters_add,
+        'voters_unmod': voters_existing - voters_mod,
+        'voters_mod': voters_mod,
+        'voters_missing': voters_missing,
+        'vrs_invalidated': invalidate_validation_records(cursor),
+    }
+
+
+def bulk_merge(load, inactivate_missing=False):
+    """
+    Builds the new Voters table and merges it into the Voter table. Must be
+    called inside a transaction.
+    :param load: function taking a cursor, which creates the new Voters table
+    and returns the Voter fields set by the voter file (e.g. load_new_voters).
+    :param inactivate_missing: see merge_new_voters
+    :return: dict of counts (see merge_new_voters)
+    """
+    with connection.cursor() as cursor:
+        fields = load(cursor)
+        fields += add_search_columns(cursor)
+        counts = merge_new_voters(cursor, fields, inactivate_missing)
+        drop_new_voters(cursor)
+    return counts
+
+
+def bulk_import(fileobj, inactivate_missing=False):
+    """
+    Imports a voter file TSV into the Voter table using COPY and set-based
+    updates. Must be called inside a transaction.
+    :param fileobj: binary file-like object for the voter file
+    :param inactivate_missing: see merge_new_voters
+    :return: dict of counts (see merge_new_voters)
+    """
+    return bulk_merge(lambda cursor: load_new_voters(cursor, fileobj),
+                      inactivate_missing)
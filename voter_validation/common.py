@@ -2,15 +2,163 @@
 Common functions and constants that are shared across multiple files.
 """
 
+import hashlib
 import inspect
-import json
 import logging
+import re
 from enum import Enum
 
+import orjson
 from django.http import HttpResponse
-
+from metaphone import doublemetaphone
+from unidecode import unidecode
 
 # Mapping between Master Voter File field name and Voter fields.
+VOTER_FILE_MAPPING = {
+    'lVoterUniqueID': 'voter_id',
+    'szNameFirst': 'first_name',
+    'szNameMiddle': 'middle_name',
+    'szNameLast': 'last_name',
+    'sNameSuffix': 'suffix',
+
+    'szSitusAddress': 'res_addr',
+    'szSitusCity': 'res_addr_city',
+    'sSitusState': 'res_addr_state',
+    'sHouseNum': 'res_addr_house_num',
+    'szStreetName': 'res_addr_street_name',
+    'sStreetSuffix': 'res_addr_street_suff',
+    'sUnitNum': 'res_addr_unit_num',
+
+    'szPhone': 'phone',
+    'szEmailAddress': 'email',
+
+    'dtRegDate': 'curr_reg_date',
+    'dtOrigRegDate': 'orig_reg_date',
+    'sStatusCode': 'reg_status',
+    'szStatusReasonDesc': 'reg_status_reason',
+
+    'sGender': 'gender',
+    'szPartyName': 'party',
+    'szLanguageName': 'language',
+}
+
+
+def transf_zip(raw_zip):
+    return raw_zip[:5]
+
+
+# Some fields need additional changes. Values are functions taking raw parameter
+# and transforming it into an acceptable format for the database.
+ADD_CHANGES_FIELDS = {
+    'sSitusZip': (transf_zip, 'res_addr_zip'),
+}
+
+# SQL equivalents of the ADD_CHANGES_FIELDS functions, for bulk imports. "%s"
+# is replaced by the raw column.
+ADD_CHANGES_SQL = {
+    'sSitusZip': ('left(%s, 5)', 'res_addr_zip'),
+}
+
+
+def voter_file_values(row):
+    """
+    Gets Voter field values from a voter file row.
+    :param row: dict from voter file field name to raw value
+    :return: dict from Voter field name to value
+    """
+    values = {}
+    for vf_name, field_name in VOTER_FILE_MAPPING.items():
+        values[field_name] = row[vf_name]
+    for vf_name, (transf, field_name) in ADD_CHANGES_FIELDS.items():
+        values[field_name] = transf(row[vf_name])
+    return values
+
+
+# Voter fields set from the voter file, in the order they are hashed.
+VOTER_HASH_FIELDS = sorted(
+    set(VOTER_FILE_MAPPING.values()) |
+    set(field_name for _, field_name in ADD_CHANGES_FIELDS.values()))
+VOTER_HASH_SEPARATOR = '\x1f'
+
+
+def voter_content_hash(values):
+    """
+    Computes a hash of a Voter's voter file fields, which is used to skip
+    voters that haven't changed when importing a new voter file. This must
+    match voter_content_hash_sql.
+    :param values: dict from Voter field name to value
+    :return: hex MD5 digest
+    """
+    content = VOTER_HASH_SEPARATOR.join(
+        values[field_name] for field_name in VOTER_HASH_FIELDS)
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+def voter_content_hash_sql(alias, overrides=None):
+    """
+    SQL equivalent of voter_content_hash, over the given table alias.
+    :param overrides: optional dict from Voter field name to a SQL expression
+    to hash instead of the column, e.g. for a value being set by an UPDATE.
+    """
+    overrides = overrides or {}
+    return "md5(concat_ws(chr(31), %s))" % ', '.join(
+        overrides.get(field_name, '%s."%s"' % (alias, field_name))
+        for field_name in VOTER_HASH_FIELDS)
+
+
+NON_ALPHANUMERIC_REGEX = re.compile(r'\W+', re.UNICODE)
+
+# Max lengths of the Voter search columns. Accent folding can make text
+# longer (e.g. "ß" becomes "ss"), so these are longer than full_name and
+# res_addr.
+SEARCH_NAME_LENGTH = 160
+SEARCH_ADDR_LENGTH = 100
+# Max length of a phonetic key. Double Metaphone keys are at most 4 long.
+PHONETIC_KEY_LENGTH = 8
+
+
+def normalize_search_text(text):
+    """
+    Accent-folds (e.g. "Zoë" becomes "zoe") and lower-cases text, and
+    replaces runs of non-alphanumeric characters with single spaces. Search
+    queries and the Voter search columns are normalized the same way.
+    """
+    if text is None:
+        return text
+    words = NON_ALPHANUMERIC_REGEX.split(unidecode(text).lower())
+    return ' '.join(word for word in words if word)
+
+
+def phonetic_keys(name):
+    """
+    Gets the Double Metaphone keys (primary and alternate) of each word of a
+    name, e.g. "Katherine" and "Cathryn" both have the keys K0RN and KTRN.
+    The words are also keyed run together, since names like "O'Brien" are
+    typed both ways. Initials are skipped.
+    :return: sorted list of keys
+    """
+    words = (normalize_search_text(name) or '').split()
+    if len(words) > 1:
+        words.append(''.join(words))
+    words = [word for word in words if len(word) > 1]
+    keys = set()
+    for word in words:
+        keys.update(key[:PHONETIC_KEY_LENGTH]
+                    for key in doublemetaphone(word) if key)
+    return sorted(keys)
+
+
+def voter_search_columns(first_name, last_name, full_name, res_addr):
+    """
+    :return: (search_name, search_addr, first_name_phonetic,
+    last_name_phonetic) for a Voter, i.e. its full_name and res_addr
+    normalized with normalize_search_text, and the phonetic_keys of its first
+    and last name
+    """
+    return (normalize_search_text(full_name)[:SEARCH_NAME_LENGTH],
+            normalize_search_text(res_addr)[:SEARCH_ADDR_LENGTH],
+            phonetic_keys(first_name),
+            phonetic_keys(last_name))
 
 
 logger = logging.getLogger(__name__)
@@ -35,6 +183,15 @@ class ChoiceEnum(Enum):
         return choices
 
 
+def json_dumps(data):
+    """
+    Encodes data as compact JSON with orjson, which is much faster than json
+    at encoding large responses (e.g. search results).
+    :return: bytes
+    """
+    return orjson.dumps(data)
+
+
 def create_json_response(data, status=200):
     """
     Creates an HTTPResponse that represents a JSONified dict.
@@ -43,7 +200,7 @@ def create_json_response(data, status=200):
     :return: HTTPResponse
     """
     return HttpResponse(
-        json.dumps(data),
+        json_dumps(data),
         status=status,
         content_type="application/json")
 
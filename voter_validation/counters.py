@@ -0,0 +1,219 @@
+"""
+Incrementally maintained validation counters, so that pages don't count
+ValidationRecords on every load:
+ - CampaignCounter: a Campaign's validation_count, i.e. its ValidationRecords
+   for non-null Voters with ACTIVE registration status.
+ - ValidatorHourlyCounter: ValidationRecords a validator created for a
+   Campaign, bucketed by the hour of validated_at.
+
+Counters are adjusted in the same transaction as the ValidationRecords they
+count (see validation_queue.apply_validations). Voter file imports record the
+voters whose Active status they change in STATUS_CHANGES_TABLE, and adjust
+the campaign counts for those voters' ValidationRecords in the import
+transaction (see add_status_change_counts). The reconcile_counters command
+recomputes everything from scratch.
+"""
+from datetime import datetime, timedelta
+
+from django.db import connection
+from django.db.models import Sum
+from django.utils.timezone import utc
+from psycopg2.extras import execute_values
+
+from backend.settings import SERVER_TIME_ZONE
+from voter_validation.models import CampaignCounter, ValidatorHourlyCounter, \
+    ValidationRecord, Voter, Campaign, RegStatus
+
+
+# Temporary table of voters whose Active status a voter file import changed,
+# and whether they are Active now.
+STATUS_CHANGES_TABLE = 'voter_status_changes'
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+def hour_of(dt):
+    """
+    :return: the start of dt's hour in UTC (like date_trunc('hour', ...) in
+    the database), i.e. its ValidatorHourlyCounter bucket
+    """
+    return dt.astimezone(utc).replace(minute=0, second=0, microsecond=0)
+
+
+def add_counts(cursor, campaign_deltas, validator_deltas):
+    """
+    Adds deltas to the counters in bulk, creating missing counter rows. Rows
+    are upserted in key order, so that concurrent transactions lock them in
+    the same order and can't deadlock.
+    :param campaign_deltas: dict of campaign ID -> delta
+    :param validator_deltas: dict of (validator ID, campaign ID, hour) ->
+    delta, with hour from hour_of
+    """
+    campaign_rows = sorted(
+        (k, d) for k, d in campaign_deltas.items() if d != 0)
+    if campaign_rows:
+        execute_values(
+            cursor,
+            "INSERT INTO {table} (campaign_id, validation_count) VALUES %s "
+            "ON CONFLICT (campaign_id) DO UPDATE SET validation_count = "
+            "{table}.validation_count + EXCLUDED.validation_count".format(
+                table=qn(CampaignCounter._meta.db_table)),
+            campaign_rows, page_size=len(campaign_rows))
+
+    validator_rows = sorted(
+        k + (d,) for k, d in validator_deltas.items() if d != 0)
+    if validator_rows:
+        execute_values(
+            cursor,
+            "INSERT INTO {table} (validator_id, campaign_id, hour, "
+            "validation_count) VALUES %s "
+            "ON CONFLICT (validator_id, campaign_id, hour) DO UPDATE SET "
+            "validation_count = "
+            "{table}.validation_count + EXCLUDED.validation_count".format(
+                table=qn(ValidatorHourlyCounter._meta.db_table)),
+            validator_rows, page_size=len(validator_rows))
+
+
+def create_status_changes_table(cursor):
+    """
+    Creates STATUS_CHANGES_TABLE for this transaction, if it doesn't exist.
+    """
+    cursor.execute(
+        "CREATE TEMPORARY TABLE IF NOT EXISTS %s (voter_id varchar(60) "
+        "PRIMARY KEY, active boolean NOT NULL) ON COMMIT DROP" %
+        qn(STATUS_CHANGES_TABLE))
+
+
+def record_status_changes(cursor, changes):
+    """
+    Records voters whose Active status changed, e.g. while importing voter
+    file rows one at a time.
+    :param changes: list of (voter ID, whether the voter is Active now)
+    """
+    create_status_changes_table(cursor)
+    if changes:
+        execute_values(
+            cursor,
+            "INSERT INTO %s (voter_id, active) VALUES %%s "
+            "ON CONFLICT (voter_id) DO UPDATE SET active = EXCLUDED.active" %
+            qn(STATUS_CHANGES_TABLE), changes, page_size=1000)
+
+
+def status_changes_sql(returning_sql):
+    """
+    Wraps an UPDATE of Voters so that it also records the voters whose Active
+    status it changes.
+    :param returning_sql: the UPDATE, ending in RETURNING voter_id,
+    old_status, new_status (e.g. by joining the Voter table again for the old
+    reg_status)
+    :return: SQL for a statement that returns the number of rows updated
+    """
+    return (
+        "WITH updated AS (%s), changes AS ("
+        "INSERT INTO %s (voter_id, active) "
+        "SELECT voter_id, new_status = '%s' FROM updated "
+        "WHERE (old_status = '%s') <> (new_status = '%s') "
+        "ON CONFLICT (voter_id) DO UPDATE SET active = EXCLUDED.active) "
+        "SELECT count(*) FROM updated" %
+        ((returning_sql, qn(STATUS_CHANGES_TABLE)) +
+         (RegStatus.ACTIVE.value,) * 3))
+
+
+def add_status_change_counts(cursor):
+    """
+    Adjusts the campaign counts for the ValidationRecords of the voters in
+    STATUS_CHANGES_TABLE, then drops it. Must be called before those
+    ValidationRecords are invalidated (see
+    bulk_import.invalidate_validation_records), while they still point at
+    their voters.
+    :return: dict of campaign ID -> delta
+    """
+    create_status_changes_table(cursor)
+    cursor.execute(
+        "SELECT vr.campaign_id, sum(CASE WHEN c.active THEN 1 ELSE -1 END) "
+        "FROM {vr} vr JOIN {changes} c ON c.voter_id = vr.voter_id "
+        "WHERE vr.campaign_id IS NOT NULL GROUP BY 1".format(
+            vr=qn(ValidationRecord._meta.db_table),
+            changes=qn(STATUS_CHANGES_TABLE)))
+    campaign_deltas = dict(cursor.fetchall())
+    add_counts(cursor, campaign_deltas, {})
+    cursor.execute("DROP TABLE %s" % qn(STATUS_CHANGES_TABLE))
+    return campaign_deltas
+
+
+def reconcile_campaign_counts(cursor):
+    """
+    Recomputes every CampaignCounter from the ValidationRecords, e.g. if they
+    were changed outside of the validation queue and voter file imports.
+    :return: number of counters that were changed
+    """
+    cursor.execute("""
+        INSERT INTO {counter} AS cc (campaign_id, validation_count)
+        SELECT c.id, count(v.voter_id)
+        FROM {campaign} c
+        LEFT JOIN {vr} vr ON vr.campaign_id = c.id
+        LEFT JOIN {voter} v ON v.voter_id = vr.voter_id AND v.reg_status = %s
+        GROUP BY c.id
+        ORDER BY c.id
+        ON CONFLICT (campaign_id) DO UPDATE
+        SET validation_count = EXCLUDED.validation_count
+        WHERE cc.validation_count <> EXCLUDED.validation_count
+    """.format(counter=qn(CampaignCounter._meta.db_table),
+               campaign=qn(Campaign._meta.db_table),
+               vr=qn(ValidationRecord._meta.db_table),
+               voter=qn(Voter._meta.db_table)),
+        [RegStatus.ACTIVE.value])
+    return cursor.rowcount
+
+
+def reconcile_validator_counts(cursor):
+    """
+    Recomputes every ValidatorHourlyCounter from the ValidationRecords.
+    :return: number of counters that were changed or deleted
+    """
+    counter = qn(ValidatorHourlyCounter._meta.db_table)
+    cursor.execute("""
+        CREATE TEMP TABLE counts ON COMMIT DROP AS
+        SELECT validator_id, campaign_id,
+               date_trunc('hour', validated_at) AS hour, count(*) AS n
+        FROM {vr}
+        WHERE validator_id IS NOT NULL AND campaign_id IS NOT NULL
+        GROUP BY 1, 2, 3
+    """.format(vr=qn(ValidationRecord._meta.db_table)))
+    cursor.execute("""
+        DELETE FROM {counter} vc
+        WHERE NOT EXISTS (
+            SELECT 1 FROM counts c
+            WHERE c.validator_id = vc.validator_id
+            AND c.campaign_id = vc.campaign_id AND c.hour = vc.hour)
+    """.format(counter=counter))
+    deleted = cursor.rowcount
+    cursor.execute("""
+        INSERT INTO {counter} AS vc
+            (validator_id, campaign_id, hour, validation_count)
+        SELECT validator_id, campaign_id, hour, n FROM counts
+        ORDER BY 1, 2, 3
+        ON CONFLICT (validator_id, campaign_id, hour) DO UPDATE
+        SET validation_count = EXCLUDED.validation_count
+        WHERE vc.validation_count <> EXCLUDED.validation_count
+    """.format(counter=counter))
+    changed = cursor.rowcount
+    cursor.execute("DROP TABLE counts")
+    return deleted + changed
+
+
+def validator_counts(validator, campaign):
+    """
+    Gets the number of Voters a validator validated for a Campaign, in total
+    and in the past 24 hours (rounded out to whole hours).
+    :return: tuple of (total, last 24 hours)
+    """
+    counters = ValidatorHourlyCounter.objects.filter(
+        validator=validator, campaign=campaign)
+    since = hour_of(datetime.now(SERVER_TIME_ZONE) - timedelta(hours=24))
+    total = counters.aggregate(n=Sum('validation_count'))['n']
+    recent = counters.filter(hour__gte=since)\
+        .aggregate(n=Sum('validation_count'))['n']
+    return total or 0, recent or 0
@@ -0,0 +1,31 @@
+"""
+Helpers for copying a table's indexes, shared by the shadow voter import (see
+shadow_import.py) and the ActiveVoter projection (see active_voters.py).
+"""
+import re
+
+MAX_IDENTIFIER_LENGTH = 63
+
+INDEX_DEF_REGEX = re.compile(
+    r'^(CREATE (?:UNIQUE )?INDEX) (\S+) ON (?:ONLY )?(\S+) ')
+
+
+def suffixed_name(name, suffix):
+    """
+    Appends a suffix to an index name, keeping it within Postgres' limit.
+    """
+    return name[:MAX_IDENTIFIER_LENGTH - len(suffix)] + suffix
+
+
+def table_indexes(cursor, table):
+    """
+    Returns (index name, index definition, constraint type) for each index on
+    the given table. Constraint type is e.g. 'p' for a primary key, or None.
+    """
+    cursor.execute(
+        "SELECT i.relname, pg_get_indexdef(i.oid), c.contype "
+        "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+        "LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid "
+        "AND c.conrelid = x.indrelid "
+        "WHERE x.indrelid = %s::regclass", [table])
+    return cursor.fetchall()
@@ -0,0 +1,50 @@
+"""
+Shows the progress of a voter file import queued with update_voters
+--background (see tasks.import_voter_file).
+
+Usage:
+   python manage.py import_status <task_id> [--follow] [--interval <seconds>]
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from voter_validation.tasks import import_progress, IMPORT_PROGRESS_STATE
+
+
+class Command(BaseCommand):
+    help = 'Shows the progress of a background voter file import'
+
+    def add_arguments(self, parser):
+        parser.add_argument('task_id', type=str)
+        parser.add_argument("--follow", action="store_true", default=False,
+                            help="Keep polling until the import finishes.")
+        parser.add_argument("--interval", type=float, default=5,
+                            help="Seconds between polls with --follow.")
+
+    def print_status(self, status):
+        if status['state'] == 'FAILURE':
+            self.stderr.write(self.style.ERROR(
+                "Import failed: %s" % status['error']))
+        elif 'stage' not in status:
+            self.stdout.write("Import is %s." % status['state'].lower())
+        else:
+            self.stdout.write(
+                "[%s] %s: %d rows (%.0f rows/sec). Voters added: %d, "
+                "modified: %d, missing: %d. Validation records "
+                "invalidated: %d." %
+                (status['state'], status['stage'], status['rows'],
+                 status['rows_per_sec'], status['voters_add'],
+                 status['voters_mod'], status['voters_missing'],
+                 status['vrs_invalidated']))
+            if 'message' in status:
+                self.stdout.write(status['message'])
+
+    def handle(self, *args, **options):
+        while True:
+            status = import_progress(options['task_id'])
+            self.print_status(status)
+            if not options['follow'] or \
+                    status['state'] not in ('PENDING', IMPORT_PROGRESS_STATE):
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,54 @@
+"""
+Matches a CSV of digitized petition rows against the voter file, and writes
+the top candidates for each row (see petition_matching.py). The petition CSV
+needs a header row with name, address and zip columns.
+
+Usage:
+   python manage.py match_petitions <petition_csv> <output_csv> \
+       [--campaign_id <id>] [--processes <n>] [--top <n>] \
+       [--min_score <score>] [--min_margin <margin>]
+
+Review the "flagged" column of the output, then validate the flagged matches
+with the validate_matches command.
+"""
+from django.core.management.base import BaseCommand
+
+from voter_validation.petition_matching import match_petition, \
+    DEFAULT_TOP_CANDIDATES, MIN_FLAG_SCORE, MIN_FLAG_MARGIN
+
+
+class Command(BaseCommand):
+    help = 'Matches petition rows from a CSV against the voter file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('petition_csv', type=str)
+        parser.add_argument('output_csv', type=str)
+        parser.add_argument("--campaign_id", type=int, default=None,
+                            help="Campaign to check for already validated "
+                                 "voters.")
+        parser.add_argument("--processes", type=int, default=None,
+                            help="Number of worker processes. Defaults to the "
+                                 "number of CPUs.")
+        parser.add_argument("--top", type=int, default=DEFAULT_TOP_CANDIDATES,
+                            help="Number of candidates written per row.")
+        parser.add_argument("--min_score", type=float, default=MIN_FLAG_SCORE,
+                            help="Min search score of a flagged match.")
+        parser.add_argument("--min_margin", type=float,
+                            default=MIN_FLAG_MARGIN,
+                            help="Min score lead of a flagged match over the "
+                                 "next candidate.")
+
+    def print_progress(self, rows, rows_per_sec, total):
+        self.stdout.write("Matched %d of %d rows (%.0f rows/min)" %
+                          (rows, total, rows_per_sec * 60))
+
+    def handle(self, *args, **options):
+        counts = match_petition(
+            options['petition_csv'], options['output_csv'],
+            campaign_id=options['campaign_id'],
+            processes=options['processes'], top=options['top'],
+            min_score=options['min_score'], min_margin=options['min_margin'],
+            progress=self.print_progress)
+        self.stdout.write(self.style.SUCCESS(
+            "Matched %d rows, and flagged %d high-confidence matches in %s." %
+            (counts['rows'], counts['flagged'], options['output_csv'])))
@@ -0,0 +1,32 @@
+"""
+Rebuilds the ActiveVoter search projection as a table range-partitioned by
+ZIP, with partitions holding about the same number of Active Voters (see
+active_voters.py). Run this again after importing Voters in new ZIPs, e.g.
+from another county, to rebalance the partitions.
+
+Usage:
+   python manage.py partition_active_voters [--partitions <n>]
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from voter_validation.active_voters import partition_active_voters
+
+
+class Command(BaseCommand):
+    help = 'Range-partitions the active voter search projection by ZIP'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--partitions", type=int, default=8,
+                            help="Number of partitions. 1 for a table that "
+                                 "isn't partitioned.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), connection.cursor() as cursor:
+            ranges = partition_active_voters(
+                cursor, max(options['partitions'], 1))
+        for zip_from, zip_to in ranges:
+            self.stdout.write("%s <= ZIP < %s" % (zip_from or 'MIN',
+                                                  zip_to or 'MAX'))
+        self.stdout.write(self.style.SUCCESS(
+            "Partitioned active voters into %d partitions." % len(ranges)))
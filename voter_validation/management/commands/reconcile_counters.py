@@ -0,0 +1,25 @@
+"""
+Recomputes the validation counters (see counters.py) from the
+ValidationRecords, in case they drifted, e.g. after ValidationRecords were
+edited in the admin.
+
+Usage:
+   python manage.py reconcile_counters
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from voter_validation.counters import reconcile_campaign_counts, \
+    reconcile_validator_counts
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the campaign and validator validation counters'
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), connection.cursor() as cursor:
+            campaigns = reconcile_campaign_counts(cursor)
+            validators = reconcile_validator_counts(cursor)
+        self.stdout.write(self.style.SUCCESS(
+            "Fixed %d campaign counters and %d validator hourly counters." %
+            (campaigns, validators)))
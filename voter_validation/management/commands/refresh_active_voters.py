@@ -0,0 +1,30 @@
+"""
+Refreshes the ActiveVoter search projection from the Voter table (see
+active_voters.py). Voter file imports do this automatically, so this is only
+needed after changing Voters some other way, e.g. in the admin.
+
+Usage:
+   python manage.py refresh_active_voters [--full]
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from voter_validation.active_voters import refresh_active_voters
+from voter_validation.search_cache import invalidate_search_cache
+
+
+class Command(BaseCommand):
+    help = 'Refreshes the active voter search projection'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true", default=False,
+                            help="Rewrite every row, not just changed "
+                                 "voters.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), connection.cursor() as cursor:
+            counts = refresh_active_voters(cursor, full=options['full'])
+        invalidate_search_cache()
+        self.stdout.write(self.style.SUCCESS(
+            "Deleted %d and inserted %d active voters." %
+            (counts['deleted'], counts['inserted'])))
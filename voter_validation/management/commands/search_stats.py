@@ -0,0 +1,28 @@
+"""
+Shows how often voter searches were answered by the exact-match fast path
+(see search_stats.py).
+
+Usage:
+   python manage.py search_stats [--reset]
+"""
+from django.core.management.base import BaseCommand
+
+from voter_validation.search_stats import search_stats, reset_search_stats
+
+
+class Command(BaseCommand):
+    help = 'Shows the exact-match search fast path hit rate'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", action="store_true", default=False,
+                            help="Reset the counters after showing them.")
+
+    def handle(self, *args, **options):
+        stats = search_stats()
+        self.stdout.write(
+            "Searches: %d. Exact-match fast path hits: %d (%.1f%%)." %
+            (stats['searches'], stats['exact_matches'],
+             100.0 * stats['exact_match_rate']))
+        if options['reset']:
+            reset_search_stats()
+            self.stdout.write("Counters reset.")
@@ -4,7 +4,10 @@ searches are supported for full name and residential address.
 
 Usage:
     python manage.py test_search -n "<name>" -a "<address>" -z <ZIP> \
-        [-s <num_searches>]
+        [-s <num_searches>] \
+        [--strategy <full_scan|trigram_index|trigram_knn>] \
+        [--backend <dotted path of search backend>] [--cache] \
+        [--no_exact_match]
 
 To get more stable results for timing average search latency, it's recommended
 to use -s 250 or so.
@@ -13,7 +16,8 @@ import time
 
 from django.core.management import BaseCommand, CommandError
 
-from voter_validation.search import voter_search
+from voter_validation.search import voter_search, get_search_backend, \
+    SearchStrategy
 
 
 class Command(BaseCommand):
@@ -35,6 +39,29 @@ class Command(BaseCommand):
                             type=int,
                             default=1,
                             help='Number of times to search the given query.')
+        parser.add_argument('--strategy',
+                            dest='strategy',
+                            choices=[s.value for s in SearchStrategy],
+                            default=None,
+                            help='Candidate generation strategy. Defaults to '
+                                 'settings.VOTER_SEARCH_STRATEGY.')
+        parser.add_argument('--backend',
+                            dest='backend',
+                            default=None,
+                            help='Dotted path of the search backend. Defaults '
+                                 'to settings.VOTER_SEARCH_BACKEND.')
+        parser.add_argument('--cache',
+                            dest='cache',
+                            action='store_true',
+                            default=False,
+                            help='Use the search cache (settings.SEARCH_CACHE)'
+                                 ', so repeated searches are cache hits.')
+        parser.add_argument('--no_exact_match',
+                            dest='exact_match',
+                            action='store_false',
+                            default=None,
+                            help='Skip the exact-match fast path, so the '
+                                 'fuzzy ranking always runs.')
 
     def print_results(self, results):
         for result in results:
@@ -52,18 +79,30 @@ class Command(BaseCommand):
         address = options['address']
         res_zip = options['zip']
         num_searches = int(options['num_searches'])
+        strategy = options['strategy']
+        backend = options['backend']
+        if strategy is not None:
+            strategy = SearchStrategy(strategy)
 
         self.stdout.write("Name: %s" % name)
         self.stdout.write("Address: %s" % address)
         self.stdout.write("ZIP: %s" % res_zip)
         self.stdout.write("Num searches: %d" % num_searches)
+        self.stdout.write("Backend: %s" % (backend or "default"))
+        self.stdout.write("Strategy: %s" % (strategy.value if strategy
+                                            else "default"))
 
         self.stdout.write("\nIssuing same search %d times..." % num_searches)
+        # Load any backend state (e.g. in-memory index) before timing.
+        get_search_backend(backend).warm_up()
         search_times = []
         results = None
         for i in range(num_searches):
             start_time = time.time()
-            new_results = voter_search(name, address, res_zip, debug=True)
+            new_results = voter_search(name, address, res_zip, debug=True,
+                                       strategy=strategy, backend=backend,
+                                       use_cache=options['cache'],
+                                       exact_match=options['exact_match'])
             end_time = time.time()
 
             # Results shouldn't change
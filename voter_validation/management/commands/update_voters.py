@@ -1,172 +1,143 @@
 """
 Updates Voters in database based on an input voter file. This function:
  - Adds new voters that don't previously have a voter ID in the database
- - Updates information for existing voters, using the specified fields. If the
-   voter is now inactive, unset the foreign key in connected ValidationRecords.
-
-TODO: Add support for voters no longer in voter file, or address changing?
-Very rare case for most campaigns, and elections officials seem to set them
-to Inactive first.
+ - Updates information for existing voters, using the specified fields.
+ - Counts voters that are no longer in the voter file. Elections officials
+   usually set them to Inactive first, but with --inactivate_missing they are
+   marked Inactive by the import.
+ - Unsets the foreign key in ValidationRecords for Inactive voters, in one
+   bulk update after the voter file is loaded.
 
 Usage:
-   python manage.py update_voters <mvf_tsv_url> [--dry_run]
+   python manage.py update_voters <mvf_tsv_url> [--dry_run] [--bulk | --swap]
+       [--parallel [--processes <n>] [--chunk_size <MB>]] [--work_dir <dir>]
+       [--inactivate_missing] [--background]
 
 mvf_tsv_url is a URL pointing to where the Master Voter File is stored as a
-TSV, e.g. on S3 or Cloudfront.
-"""
-import codecs
-import csv
-
-from contextlib import closing
-
-import requests
-from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
-
-from voter_validation.models import Voter, RegStatus
-
-# Map from voter file field name to the appropriate Voter field in models.py.
-VOTER_FILE_MAPPING = {
-    'lVoterUniqueID': 'voter_id',
-    'szNameFirst': 'first_name',
-    'szNameMiddle': 'middle_name',
-    'szNameLast': 'last_name',
-    'sNameSuffix': 'suffix',
-
-    'szSitusAddress': 'res_addr',
-    'szSitusCity': 'res_addr_city',
-    'sSitusState': 'res_addr_state',
-    'sHouseNum': 'res_addr_house_num',
-    'szStreetName': 'res_addr_street_name',
-    'sStreetSuffix': 'res_addr_street_suff',
-    'sUnitNum': 'res_addr_unit_num',
+TSV, e.g. on S3 or Cloudfront, or a local path. The TSV may be gzip or zstd
+compressed. Remote files are downloaded to the work directory first, and an
+interrupted download is resumed by the next run (see voter_file.py).
 
-    'szPhone': 'phone',
-    'szEmailAddress': 'email',
+Each voter's voter file fields are hashed (see Voter.content_hash), so voters
+that haven't changed since the last import are skipped without any queries.
 
-    'dtRegDate': 'curr_reg_date',
-    'dtOrigRegDate': 'orig_reg_date',
-    'sStatusCode': 'reg_status',
-    'szStatusReasonDesc': 'reg_status_reason',
+With --bulk, the file is loaded with PostgreSQL COPY and merged with set-based
+SQL (see bulk_import.py), which is much faster than checking voters one row at
+a time.
 
-    'sGender': 'gender',
-    'szPartyName': 'party',
-    'szLanguageName': 'language',
-}
+With --swap, the file is loaded into a fully indexed shadow table instead, and
+swapped in atomically at the end (see shadow_import.py). Searches are not
+blocked by the import.
 
+With --parallel, the file is split into chunks that are parsed in a process
+pool (see parallel_import.py). Each loaded chunk is checkpointed in the work
+directory, so re-running an interrupted import resumes where it left off.
 
-def transf_zip(raw_zip):
-    return raw_zip[:5]
-
+With --background, the import is queued as a Celery task instead (see
+tasks.import_voter_file), which doesn't ask for confirmation. Use the
+import_status command or the imports staff page to follow its progress.
+"""
+from django.core.management.base import BaseCommand
 
-# Some fields need additional changes. Values are functions taking raw parameter
-# and transforming it into an acceptable format for the database.
-ADD_CHANGES_FIELDS = {
-    'sSitusZip': (transf_zip, 'res_addr_zip'),
-}
+from voter_validation.tasks import import_voter_file
+from voter_validation.voter_import import VoterFileImport, ImportAborted, \
+    DEFAULT_OPTIONS
 
 
 class Command(BaseCommand):
     help = 'Updates Voters based on a new master voter file'
 
-    def __init__(self):
-        super(Command, self).__init__()
-        # Count voters added or modified, and number of validation records
-        # invalidated.
-        self.voters_add = 0
-        self.voters_unmod = 0  # fields listed at top of file are unmodified
-        self.voters_mod = 0
-        self.vrs_invalidated = 0
-
     def add_arguments(self, parser):
         parser.add_argument('mvf_tsv_url', type=str)
         parser.add_argument("--dry_run", action="store_true",
                             default=False, help="Dry run doesn't change DB.")
-
-    def print_counts(self, style=None):
+        parser.add_argument("--bulk", action="store_true", default=False,
+                            help="Use COPY and set-based SQL to import.")
+        parser.add_argument("--swap", action="store_true", default=False,
+                            help="Load into a shadow table and swap it in, "
+                                 "without locking the live Voter table.")
+        parser.add_argument("--parallel", action="store_true", default=False,
+                            help="Parse the file in parallel chunks, with "
+                                 "checkpoints to resume interrupted imports. "
+                                 "Implies --bulk.")
+        parser.add_argument("--processes", type=int,
+                            default=DEFAULT_OPTIONS['processes'],
+                            help="Number of parsing processes for --parallel "
+                                 "(default: CPU count).")
+        parser.add_argument("--chunk_size", type=int,
+                            default=DEFAULT_OPTIONS['chunk_size'],
+                            help="Chunk size in MB for --parallel.")
+        parser.add_argument("--work_dir", type=str,
+                            default=DEFAULT_OPTIONS['work_dir'],
+                            help="Directory for downloaded or decompressed "
+                                 "voter files, and --parallel checkpoints.")
+        parser.add_argument("--inactivate_missing", action="store_true",
+                            default=False,
+                            help="Mark voters that are no longer in the voter "
+                                 "file as Inactive.")
+        parser.add_argument("--background", action="store_true",
+                            default=False,
+                            help="Queue the import as a Celery task, without "
+                                 "confirmation.")
+
+    def print_counts(self, progress, style=None):
         print_str = "Voters added: %d.\nVoters unmodified: %d." \
-                    "\nVoters modified: %d.\nValidation records " \
-                    "invalidated: %d.\n\n" %\
-                    (self.voters_add, self.voters_unmod, self.voters_mod,
-                     self.vrs_invalidated)
+                    "\nVoters modified: %d.\nVoters missing from voter " \
+                    "file: %d.\nValidation records invalidated: %d.\n\n" %\
+                    (progress['voters_add'], progress['voters_unmod'],
+                     progress['voters_mod'], progress['voters_missing'],
+                     progress['vrs_invalidated'])
         if style:
             print_str = style(print_str)
         self.stdout.write(print_str)
 
+    def print_progress(self, progress):
+        if progress['stage'] == 'parsing' and 'num_chunks' in progress:
+            self.stdout.write(
+                "Loaded %d/%d chunks: %d rows (%.0f rows/sec)" %
+                (progress['chunks_done'], progress['num_chunks'],
+                 progress['rows'], progress['rows_per_sec']))
+        elif progress['stage'] == 'loading' and progress['rows']:
+            self.stdout.write("Processed %d rows (%.0f rows/sec)" %
+                              (progress['rows'], progress['rows_per_sec']))
+
+    def confirm(self, progress, swap):
+        self.stdout.write("\n\nFinal results:")
+        if swap:
+            self.stdout.write(self.style.WARNING("Shadow table is ready!"))
+            question = "Confirm whether to swap in new voters [y/N]: "
+        else:
+            self.stdout.write(self.style.WARNING(
+                "Transaction almost successful!"))
+            question = "Confirm whether to update database [y/N]: "
+        self.print_counts(progress, self.style.WARNING)
+        return input("\n" + question).lower() == "y"
+
     def handle(self, *args, **options):
-        dry_run = options['dry_run']
         url = options['mvf_tsv_url']
+        import_options = dict((name, options[name]) for name in DEFAULT_OPTIONS)
+        if options['background']:
+            task = import_voter_file.delay(url, import_options)
+            self.stdout.write("Queued import task %s. Follow it with:\n"
+                              "   python manage.py import_status %s" %
+                              (task.id, task.id))
+            return
+
+        swap = options['swap']
+        voter_import = VoterFileImport(
+            url, import_options, progress=self.print_progress,
+            confirm=lambda progress: self.confirm(progress, swap))
         try:
-            with transaction.atomic():
-                with closing(requests.get(url, stream=True)) as r:
-                    tsv_reader = csv.DictReader(
-                        codecs.iterdecode(r.iter_lines(), 'latin1'),
-                        delimiter='\t')
-                    count = 0
-                    for row in tsv_reader:
-                        # Create Voter based on row fields
-                        voter = Voter()
-                        for vf_name, field_name in VOTER_FILE_MAPPING.items():
-                            setattr(voter, field_name, row[vf_name])
-                        for vf_name, (transf, field_name) \
-                                in ADD_CHANGES_FIELDS.items():
-                            setattr(voter, field_name, transf(row[vf_name]))
-
-                        # Check if voter exists.
-                        existing_voter = Voter.objects.filter(
-                            voter_id=voter.voter_id)
-                        if existing_voter.count() > 0:
-                            # Voter already exists in voter file.
-                            existing_voter = existing_voter.get()
-                            is_modified = False
-
-                            # Check and change modified fields.
-                            fields = list(VOTER_FILE_MAPPING.values())
-                            fields.extend([f[1] for f in
-                                           ADD_CHANGES_FIELDS.values()])
-                            for field_name in fields:
-                                if getattr(existing_voter, field_name) == \
-                                        getattr(voter, field_name):
-                                    continue
-                                setattr(existing_voter, field_name,
-                                        getattr(voter, field_name))
-                                is_modified = True
-
-                            # Invalidate validation records if voter is inactive
-                            if existing_voter.reg_status == \
-                                    RegStatus.INACTIVE.value:
-                                for vr in existing_voter\
-                                        .validationrecord_set.all():
-                                    vr.voter = None
-                                    vr.save()
-                                    self.vrs_invalidated += 1
-                            if is_modified:
-                                self.voters_mod += 1
-                                existing_voter.save()
-                            else:
-                                self.voters_unmod += 1
-                        else:
-                            # New voter
-                            voter.save()
-                            self.voters_add += 1
-
-                        count += 1
-                        if count % 1000 == 0:
-                            self.print_counts()
-
+            progress = voter_import.run()
+            if swap:
+                self.print_counts(progress)
+                self.stderr.write(self.style.SUCCESS("Swap successful!"))
+            else:
+                self.stderr.write(self.style.SUCCESS("Transaction successful!"))
+        except ImportAborted as e:
+            if options['dry_run']:
                 self.stdout.write("\n\nFinal results:")
-                # Do nothing for dry run
-                if dry_run:
-                    self.print_counts()
-                    raise CommandError("Not saving because this is a dry run")
-
-                self.stdout.write(self.style.WARNING(
-                    "Transaction almost successful!"))
-                self.print_counts(self.style.WARNING)
-
-                confirm = input("\nConfirm whether to update database [y/N]: ")
-                if confirm.lower() != "y":
-                    raise CommandError("You cancelled the transaction")
-            self.stderr.write(self.style.SUCCESS("Transaction successful!"))
+                self.print_counts(voter_import.progress)
+            self.stderr.write(self.style.ERROR("Exception: %s" % e))
         except Exception as e:
             self.stderr.write(self.style.ERROR("Exception: %s" % e))
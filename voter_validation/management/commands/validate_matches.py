@@ -0,0 +1,27 @@
+"""
+Validates every flagged match in a CSV written by the match_petitions
+command, for a Campaign. Clear the "flagged" column of any match that
+shouldn't be validated first.
+
+Usage:
+   python manage.py validate_matches <match_csv> <campaign_id> <username>
+"""
+from django.core.management.base import BaseCommand
+
+from voter_validation.petition_matching import validate_flagged_matches
+
+
+class Command(BaseCommand):
+    help = 'Validates the flagged matches from match_petitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('match_csv', type=str)
+        parser.add_argument('campaign_id', type=int)
+        parser.add_argument('username', type=str,
+                            help="Validator to record the validations for.")
+
+    def handle(self, *args, **options):
+        counts = validate_flagged_matches(
+            options['match_csv'], options['campaign_id'], options['username'])
+        self.stdout.write(self.style.SUCCESS(
+            "Validated %d voters." % counts['created']))
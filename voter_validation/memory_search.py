@@ -0,0 +1,332 @@
+"""
+In-process trigram search engine, which can be used instead of ranking Voters
+in Postgres (see settings.VOTER_SEARCH_BACKEND).
+
+An inverted index from trigrams to Active Voters is built from the database
+when a web worker starts. Postings are stored as NumPy arrays, with Voters
+sorted by ZIP so that a ZIP search only looks at a contiguous range of each
+posting list. Trigrams are extracted the same way pg_trgm does it, so scores
+match the ones computed by PostgresSearchBackend.
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+from array import array
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from .models import ActiveVoter
+from .search import SearchBackend, SearchHit, \
+    FULL_NAME_WEIGHT, RES_ADDR_WEIGHT, EXACT_ADDR_WEIGHT, MIN_SIMILARITY
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before retrying a failed index rebuild.
+REBUILD_RETRY_INTERVAL = 60
+
+# pg_trgm treats anything that isn't alphanumeric as a word separator.
+WORD_REGEX = re.compile(r'[^\W_]+', re.UNICODE)
+
+# Number of candidates checked for exact address matches at a time.
+EXACT_MATCH_BATCH_SIZE = 256
+
+
+def trigrams(text):
+    """
+    Returns the set of trigrams in the given text, like pg_trgm's show_trgm():
+    each lower-cased word is padded with two spaces in front and one behind.
+    """
+    result = set()
+    if not text:
+        return result
+    for word in WORD_REGEX.findall(text.lower()):
+        padded = '  %s ' % word
+        for i in range(len(padded) - 2):
+            result.add(padded[i:i + 3])
+    return result
+
+
+class FieldIndex(object):
+    """
+    Inverted index for one text field. Postings are stored in compressed
+    sparse row form: the sorted doc IDs for trigram t are
+    docs[offsets[t]:offsets[t + 1]].
+    """
+    def __init__(self):
+        # Parallel (trigram ID, doc ID) arrays, only used while building.
+        self._trigram_ids = array('i')
+        self._doc_ids = array('i')
+        self._lengths = array('i')
+
+        self.offsets = None
+        self.docs = None
+        self.lengths = None
+
+    def add(self, doc_id, trigram_ids):
+        """
+        Adds a document. Documents must be added in increasing doc_id order.
+        """
+        self._trigram_ids.extend(trigram_ids)
+        self._doc_ids.extend([doc_id] * len(trigram_ids))
+        self._lengths.append(len(trigram_ids))
+
+    def finalize(self, num_trigrams):
+        trigram_ids = np.frombuffer(self._trigram_ids, dtype=np.int32)
+        doc_ids = np.frombuffer(self._doc_ids, dtype=np.int32)
+        # A stable sort keeps the doc IDs sorted within each posting list.
+        order = np.argsort(trigram_ids, kind='stable')
+        self.docs = doc_ids[order]
+        self.offsets = np.zeros(num_trigrams + 1, dtype=np.int64)
+        np.cumsum(np.bincount(trigram_ids, minlength=num_trigrams),
+                  out=self.offsets[1:])
+        self.lengths = np.frombuffer(self._lengths, dtype=np.int32).copy()
+        self._trigram_ids = self._doc_ids = self._lengths = None
+
+    def similarity(self, query_ids, query_len, start, end):
+        """
+        Computes pg_trgm similarity between the query and docs [start, end).
+        :param query_ids: IDs of query trigrams that appear in the index
+        :param query_len: total number of query trigrams
+        :return: float32 array of length end - start
+        """
+        size = end - start
+        if query_len == 0 or size == 0:
+            return np.zeros(size, dtype=np.float32)
+
+        postings = []
+        for trigram_id in query_ids:
+            docs = self.docs[self.offsets[trigram_id]:
+                             self.offsets[trigram_id + 1]]
+            lo, hi = np.searchsorted(docs, [start, end])
+            postings.append(docs[lo:hi])
+        if postings:
+            common = np.bincount(np.concatenate(postings) - start,
+                                 minlength=size)
+        else:
+            common = np.zeros(size, dtype=np.int64)
+
+        # Same formula as pg_trgm: shared / (len1 + len2 - shared)
+        union = query_len + self.lengths[start:end] - common
+        return common.astype(np.float32) / \
+            np.maximum(union, 1).astype(np.float32)
+
+
+class TrigramIndex(object):
+    """
+    Trigram index over the search_name and search_addr of Active Voters.
+    """
+    def __init__(self, rows):
+        """
+        :param rows: iterable of (voter_id, search_name, search_addr,
+        res_addr_zip) tuples, sorted by res_addr_zip.
+        """
+        self.voter_ids = []
+        self.addresses = []  # normalized, for exact address matches
+        self.zip_ranges = {}  # ZIP -> (start, end) doc ID range
+        self.trigram_ids = {}
+        self.names = FieldIndex()
+        self.addrs = FieldIndex()
+
+        for doc_id, (voter_id, search_name, search_addr, res_zip) \
+                in enumerate(rows):
+            self.voter_ids.append(voter_id)
+            self.addresses.append(search_addr)
+            start, _ = self.zip_ranges.get(res_zip, (doc_id, doc_id))
+            self.zip_ranges[res_zip] = (start, doc_id + 1)
+            self.names.add(doc_id, self._intern(trigrams(search_name)))
+            self.addrs.add(doc_id, self._intern(trigrams(search_addr)))
+
+        self.names.finalize(len(self.trigram_ids))
+        self.addrs.finalize(len(self.trigram_ids))
+        # Position of each doc's voter_id in sorted order, to break ties by
+        # voter_id like PostgresSearchBackend.
+        self.sorted_voter_ids = sorted(self.voter_ids)
+        self.id_ranks = np.empty(len(self.voter_ids), dtype=np.int32)
+        self.id_ranks[sorted(range(len(self.voter_ids)),
+                             key=self.voter_ids.__getitem__)] = \
+            np.arange(len(self.voter_ids), dtype=np.int32)
+        self.built_at = time.time()
+
+    def __len__(self):
+        return len(self.voter_ids)
+
+    def _intern(self, trigram_set):
+        ids = []
+        for trigram in trigram_set:
+            trigram_id = self.trigram_ids.get(trigram)
+            if trigram_id is None:
+                trigram_id = len(self.trigram_ids)
+                self.trigram_ids[trigram] = trigram_id
+            ids.append(trigram_id)
+        return ids
+
+    @classmethod
+    def load(cls):
+        """
+        Builds an index over all Active Voters in the database.
+        """
+        start_time = time.time()
+        rows = ActiveVoter.objects\
+            .order_by('res_addr_zip', 'voter_id')\
+            .values_list('voter_id', 'search_name', 'search_addr',
+                         'res_addr_zip')\
+            .iterator()
+        index = cls(rows)
+        logger.info("Built in-memory search index of %d voters in %.1f s",
+                    len(index), time.time() - start_time)
+        return index
+
+    def _query_trigrams(self, query):
+        query_trigrams = trigrams(query)
+        query_ids = [self.trigram_ids[t] for t in query_trigrams
+                     if t in self.trigram_ids]
+        return query_ids, len(query_trigrams)
+
+    def rank(self, name, address, res_zip, limit=60, after=None):
+        """
+        Ranks Voters against the given normalized query, using the same scoring
+        and order as PostgresSearchBackend.
+        :param after: see voter_search
+        :return: list of SearchHits ranked in order
+        """
+        if res_zip:
+            start, end = self.zip_ranges.get(res_zip, (0, 0))
+        else:
+            start, end = 0, len(self)
+
+        def ranked_after(doc_ids, scores):
+            """
+            :return: mask of the docs ranked after the "after" Voter
+            """
+            after_score, after_id = after
+            after_rank = bisect.bisect_right(self.sorted_voter_ids, after_id)
+            return (scores < after_score) | (
+                (scores == after_score) &
+                (self.id_ranks[start + doc_ids] >= after_rank))
+
+        name_sim = self.names.similarity(
+            *self._query_trigrams(name), start=start, end=end)
+        addr_sim = self.addrs.similarity(
+            *self._query_trigrams(address), start=start, end=end)
+
+        mask = np.ones(end - start, dtype=bool)
+        if name:
+            mask &= name_sim >= MIN_SIMILARITY
+        if address:
+            mask &= addr_sim >= MIN_SIMILARITY
+        candidates = np.flatnonzero(mask)
+        base_scores = np.float32(FULL_NAME_WEIGHT) * name_sim[candidates] \
+            + np.float32(RES_ADDR_WEIGHT) * addr_sim[candidates]
+
+        # Exact address matches need a string comparison, so only check
+        # candidates (best first) until the rest can't make it into the top
+        # "limit" even with the exact match bonus.
+        order = np.argsort(-base_scores, kind='stable')
+        exact = np.zeros(len(order), dtype=np.float32)
+        address = address or ''
+        checked = 0
+        while checked < len(order):
+            batch = order[checked:checked + EXACT_MATCH_BATCH_SIZE]
+            exact[checked:checked + len(batch)] = [
+                address in self.addresses[start + c]
+                for c in candidates[batch]]
+            checked += len(batch)
+            if 0 < limit <= checked < len(order):
+                scores = base_scores[order[:checked]] \
+                    + np.float32(EXACT_ADDR_WEIGHT) * exact[:checked]
+                if after is not None:
+                    scores[~ranked_after(candidates[order[:checked]],
+                                         scores)] = -np.inf
+                kth_score = np.partition(scores, checked - limit)[
+                    checked - limit]
+                next_score = base_scores[order[checked]] \
+                    + np.float32(EXACT_ADDR_WEIGHT)
+                if next_score < kth_score:
+                    break
+
+        order = order[:checked]
+        exact = exact[:checked]
+        scores = base_scores[order] + np.float32(EXACT_ADDR_WEIGHT) * exact
+        # Sort by score descending, breaking ties by voter_id.
+        ranking = np.lexsort((self.id_ranks[start + candidates[order]],
+                              -scores))
+        if after is not None:
+            ranking = ranking[ranked_after(candidates[order], scores)[ranking]]
+        if limit > 0:
+            ranking = ranking[:limit]
+
+        hits = []
+        for i in ranking:
+            doc_id = candidates[order[i]]
+            hits.append(SearchHit(
+                voter_id=self.voter_ids[start + doc_id],
+                search_score=float(scores[i]),
+                name_similarity=float(name_sim[doc_id]),
+                addr_similarity=float(addr_sim[doc_id]),
+                addr_exact_match=float(exact[i])))
+        return hits
+
+
+class MemorySearchBackend(SearchBackend):
+    """
+    Ranks Voters with an in-memory TrigramIndex, then loads the top results
+    from the database. The index is rebuilt once it is older than
+    settings.MEMORY_SEARCH_MAX_AGE seconds, so it picks up voter file updates.
+    """
+    def __init__(self):
+        self.index = None
+        self.lock = threading.Lock()
+        self.rebuilding = False
+        self.next_rebuild = 0
+
+    def get_index(self):
+        """
+        Returns the current index, building it if this is the first search.
+        A stale index keeps serving searches while a background thread builds
+        its replacement.
+        """
+        index = self.index
+        if index is None:
+            with self.lock:
+                # Another thread may have built the index already.
+                if self.index is None:
+                    self.index = TrigramIndex.load()
+            return self.index
+        max_age = settings.MEMORY_SEARCH_MAX_AGE
+        now = time.time()
+        if max_age > 0 and now - index.built_at > max_age and \
+                now >= self.next_rebuild:
+            with self.lock:
+                if self.rebuilding:
+                    return index
+                self.rebuilding = True
+            threading.Thread(target=self.rebuild, daemon=True,
+                             name='memory-search-rebuild').start()
+        return index
+
+    def rebuild(self):
+        """
+        Builds a new index and swaps it in. If the build fails, the old index
+        stays in use and the rebuild is retried after REBUILD_RETRY_INTERVAL.
+        """
+        try:
+            self.index = TrigramIndex.load()
+        except Exception:
+            logger.exception("Failed to rebuild in-memory search index")
+            self.next_rebuild = time.time() + REBUILD_RETRY_INTERVAL
+        finally:
+            # This thread's database connection is not reused.
+            connection.close()
+            self.rebuilding = False
+
+    def warm_up(self):
+        self.get_index()
+
+    def rank(self, name, address, res_zip, limit=60, strategy=None,
+             after=None):
+        return self.get_index().rank(name, address, res_zip, limit=limit,
+                                     after=after)
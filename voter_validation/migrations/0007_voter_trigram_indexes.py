@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction. Building the
+    # indexes concurrently avoids locking the Voter table against writes.
+    atomic = False
+
+    dependencies = [
+        ('voter_validation', '0006_auto_20200314_2140'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+            "voter_validation_voter_full_name_trgm "
+            "ON voter_validation_voter USING gin (full_name gin_trgm_ops);",
+            reverse_sql="DROP INDEX IF EXISTS "
+                        "voter_validation_voter_full_name_trgm;"),
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+            "voter_validation_voter_res_addr_trgm "
+            "ON voter_validation_voter USING gin (res_addr gin_trgm_ops);",
+            reverse_sql="DROP INDEX IF EXISTS "
+                        "voter_validation_voter_res_addr_trgm;"),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Must match common.voter_content_hash at the time of this migration.
+BACKFILL_CONTENT_HASH_SQL = """
+UPDATE voter_validation_voter SET content_hash = md5(concat_ws(chr(31),
+    curr_reg_date, email, first_name, gender, language, last_name,
+    middle_name, orig_reg_date, party, phone, reg_status, reg_status_reason,
+    res_addr, res_addr_city, res_addr_house_num, res_addr_state,
+    res_addr_street_name, res_addr_street_suff, res_addr_unit_num,
+    res_addr_zip, suffix, voter_id));
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_validation', '0007_voter_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voter',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.RunSQL(BACKFILL_CONTENT_HASH_SQL,
+                          reverse_sql=migrations.RunSQL.noop),
+    ]
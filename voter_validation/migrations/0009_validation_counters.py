@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2020-03-22 18:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+# Backfill validated_at and the counters. Must match counters.py at the time of
+# this migration.
+BACKFILL_VALIDATED_AT_SQL = """
+UPDATE voter_validation_validationrecord SET validated_at = last_updated;
+"""
+BACKFILL_COUNTERS_SQL = """
+INSERT INTO voter_validation_campaigncounter (campaign_id, validation_count)
+SELECT c.id, count(v.voter_id)
+FROM voter_validation_campaign c
+LEFT JOIN voter_validation_validationrecord vr ON vr.campaign_id = c.id
+LEFT JOIN voter_validation_voter v
+    ON v.voter_id = vr.voter_id AND v.reg_status = 'A'
+GROUP BY c.id;
+
+INSERT INTO voter_validation_validatorhourlycounter
+    (validator_id, campaign_id, hour, validation_count)
+SELECT validator_id, campaign_id, date_trunc('hour', validated_at), count(*)
+FROM voter_validation_validationrecord
+WHERE validator_id IS NOT NULL AND campaign_id IS NOT NULL
+GROUP BY 1, 2, 3;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_validation', '0008_voter_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CampaignCounter',
+            fields=[
+                ('campaign', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='voter_validation.Campaign')),
+                ('validation_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ValidatorHourlyCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('validation_count', models.IntegerField(default=0)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='voter_validation.Campaign')),
+                ('validator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='voter_validation.UserProfile')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='validationrecord',
+            name='validated_at',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now),
+        ),
+        migrations.AlterUniqueTogether(
+            name='validatorhourlycounter',
+            unique_together=set([('validator', 'campaign', 'hour')]),
+        ),
+        migrations.RunSQL(BACKFILL_VALIDATED_AT_SQL,
+                          reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(BACKFILL_COUNTERS_SQL,
+                          reverse_sql=migrations.RunSQL.noop),
+    ]
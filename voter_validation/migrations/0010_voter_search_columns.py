@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2020-03-28 17:05
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+from psycopg2.extras import execute_values
+from unidecode import unidecode
+
+BATCH_SIZE = 10000
+NON_ALPHANUMERIC_REGEX = re.compile(r'\W+', re.UNICODE)
+
+
+def normalize_search_text(text):
+    # Must match common.normalize_search_text at the time of this migration.
+    words = NON_ALPHANUMERIC_REGEX.split(unidecode(text).lower())
+    return ' '.join(word for word in words if word)
+
+
+def backfill_search_columns(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.chunked_cursor() as voters, \
+            connection.cursor() as cursor:
+        voters.execute("SELECT voter_id, full_name, res_addr "
+                       "FROM voter_validation_voter")
+        while True:
+            rows = voters.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            execute_values(
+                cursor,
+                "UPDATE voter_validation_voter v "
+                "SET search_name = s.search_name, "
+                "search_addr = s.search_addr FROM (VALUES %s) "
+                "AS s (voter_id, search_name, search_addr) "
+                "WHERE v.voter_id = s.voter_id",
+                [(voter_id, normalize_search_text(full_name)[:160],
+                  normalize_search_text(res_addr)[:100])
+                 for voter_id, full_name, res_addr in rows],
+                page_size=len(rows))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_validation', '0009_validation_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voter',
+            name='search_addr',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='voter',
+            name='search_name',
+            field=models.CharField(blank=True, default='', max_length=160),
+        ),
+        migrations.RunPython(backfill_search_columns,
+                             reverse_code=migrations.RunPython.noop),
+    ]
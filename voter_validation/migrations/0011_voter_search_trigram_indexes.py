@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction. Building the
+    # indexes concurrently avoids locking the Voter table against writes.
+    # Searches now use the search columns, so the trigram indexes on
+    # full_name and res_addr are replaced.
+    atomic = False
+
+    dependencies = [
+        ('voter_validation', '0010_voter_search_columns'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+            "voter_validation_voter_search_name_trgm "
+            "ON voter_validation_voter USING gin (search_name gin_trgm_ops);",
+            reverse_sql="DROP INDEX IF EXISTS "
+                        "voter_validation_voter_search_name_trgm;"),
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+            "voter_validation_voter_search_addr_trgm "
+            "ON voter_validation_voter USING gin (search_addr gin_trgm_ops);",
+            reverse_sql="DROP INDEX IF EXISTS "
+                        "voter_validation_voter_search_addr_trgm;"),
+        migrations.RunSQL(
+            "DROP INDEX CONCURRENTLY IF EXISTS "
+            "voter_validation_voter_full_name_trgm;",
+            reverse_sql="CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+                        "voter_validation_voter_full_name_trgm "
+                        "ON voter_validation_voter "
+                        "USING gin (full_name gin_trgm_ops);"),
+        migrations.RunSQL(
+            "DROP INDEX CONCURRENTLY IF EXISTS "
+            "voter_validation_voter_res_addr_trgm;",
+            reverse_sql="CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+                        "voter_validation_voter_res_addr_trgm "
+                        "ON voter_validation_voter "
+                        "USING gin (res_addr gin_trgm_ops);"),
+    ]
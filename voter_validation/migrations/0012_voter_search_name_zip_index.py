@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction. This index
+    # serves the exact-match search fast path (see search.exact_match_search).
+    atomic = False
+
+    dependencies = [
+        ('voter_validation', '0011_voter_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+            "voter_validation_voter_search_name_zip "
+            "ON voter_validation_voter (search_name, res_addr_zip);",
+            reverse_sql="DROP INDEX IF EXISTS "
+                        "voter_validation_voter_search_name_zip;"),
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2020-04-04 15:42
+from __future__ import unicode_literals
+
+import re
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+from metaphone import doublemetaphone
+from psycopg2.extras import execute_values
+from unidecode import unidecode
+
+BATCH_SIZE = 10000
+NON_ALPHANUMERIC_REGEX = re.compile(r'\W+', re.UNICODE)
+
+
+def phonetic_keys(name):
+    # Must match common.phonetic_keys at the time of this migration.
+    words = [word for word in
+             NON_ALPHANUMERIC_REGEX.split(unidecode(name).lower()) if word]
+    if len(words) > 1:
+        words.append(''.join(words))
+    words = [word for word in words if len(word) > 1]
+    keys = set()
+    for word in words:
+        keys.update(key[:8] for key in doublemetaphone(word) if key)
+    return sorted(keys)
+
+
+def backfill_phonetic_keys(apps, schema_editor):
+    connection = schema_editor.connection
+    with connection.chunked_cursor() as voters, \
+            connection.cursor() as cursor:
+        voters.execute("SELECT voter_id, first_name, last_name "
+                       "FROM voter_validation_voter")
+        while True:
+            rows = voters.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            execute_values(
+                cursor,
+                "UPDATE voter_validation_voter v "
+                "SET first_name_phonetic = s.first_keys::varchar(8)[], "
+                "last_name_phonetic = s.last_keys::varchar(8)[] "
+                "FROM (VALUES %s) AS s (voter_id, first_keys, last_keys) "
+                "WHERE v.voter_id = s.voter_id",
+                [(voter_id, phonetic_keys(first_name),
+                  phonetic_keys(last_name))
+                 for voter_id, first_name, last_name in rows],
+                page_size=len(rows))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_validation', '0012_voter_search_name_zip_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voter',
+            name='first_name_phonetic',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=8), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='voter',
+            name='last_name_phonetic',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=8), blank=True, default=list, size=None),
+        ),
+        migrations.RunPython(backfill_phonetic_keys,
+                             reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction. These indexes
+    # serve the "&&" (overlap) lookups of phonetic candidate generation (see
+    # search.phonetic_filter).
+    atomic = False
+
+    dependencies = [
+        ('voter_validation', '0013_voter_phonetic_keys'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+            "voter_validation_voter_first_name_phonetic "
+            "ON voter_validation_voter USING gin (first_name_phonetic);",
+            reverse_sql="DROP INDEX IF EXISTS "
+                        "voter_validation_voter_first_name_phonetic;"),
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+            "voter_validation_voter_last_name_phonetic "
+            "ON voter_validation_voter USING gin (last_name_phonetic);",
+            reverse_sql="DROP INDEX IF EXISTS "
+                        "voter_validation_voter_last_name_phonetic;"),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction. This index
+    # finds the Voters at a parsed address query (see search.address_filter),
+    # whose street and unit are compared case-insensitively with iexact.
+    atomic = False
+
+    dependencies = [
+        ('voter_validation', '0014_voter_phonetic_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+            "voter_validation_voter_address_parts "
+            "ON voter_validation_voter (res_addr_house_num, "
+            "upper(res_addr_street_name::text), "
+            "upper(res_addr_unit_num::text));",
+            reverse_sql="DROP INDEX IF EXISTS "
+                        "voter_validation_voter_address_parts;"),
+    ]
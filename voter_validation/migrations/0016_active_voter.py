@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2020-04-11 14:03
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+ACTIVE_VOTER_COLUMNS = ', '.join([
+    'voter_id', 'full_name', 'res_addr', 'res_addr_zip', 'res_addr_house_num',
+    'res_addr_street_name', 'res_addr_unit_num', 'gender', 'party',
+    'language', 'curr_reg_date', 'orig_reg_date', 'reg_status',
+    'reg_status_reason', 'content_hash', 'search_name', 'search_addr',
+    'first_name_phonetic', 'last_name_phonetic'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_validation', '0015_voter_address_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActiveVoter',
+            fields=[
+                ('voter_id', models.CharField(default='', max_length=60, primary_key=True, serialize=False)),
+                ('full_name', models.CharField(blank=True, default='', max_length=128)),
+                ('res_addr', models.CharField(default='', max_length=70)),
+                ('res_addr_zip', models.CharField(db_index=True, default='', max_length=5)),
+                ('res_addr_house_num', models.CharField(blank=True, default='', max_length=10)),
+                ('res_addr_street_name', models.CharField(blank=True, default='', max_length=35)),
+                ('res_addr_unit_num', models.CharField(blank=True, default='', max_length=8)),
+                ('gender', models.CharField(blank=True, default='', max_length=1)),
+                ('party', models.CharField(blank=True, default='', max_length=50)),
+                ('language', models.CharField(blank=True, default='', max_length=16)),
+                ('curr_reg_date', models.CharField(blank=True, default='', max_length=10)),
+                ('orig_reg_date', models.CharField(blank=True, default='', max_length=10)),
+                ('reg_status', models.CharField(choices=[('A', 'Active'), ('C', 'Cancelled'), ('I', 'Inactive'), ('P', 'Local Pending'), ('', 'None')], default='A', max_length=1)),
+                ('reg_status_reason', models.CharField(blank=True, default='', max_length=50)),
+                ('content_hash', models.CharField(blank=True, default='', max_length=32)),
+                ('search_name', models.CharField(blank=True, default='', max_length=160)),
+                ('search_addr', models.CharField(blank=True, default='', max_length=100)),
+                ('first_name_phonetic', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=8), blank=True, default=list, size=None)),
+                ('last_name_phonetic', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=8), blank=True, default=list, size=None)),
+            ],
+        ),
+        migrations.RunSQL(
+            "INSERT INTO voter_validation_activevoter ({columns}) "
+            "SELECT {columns} FROM voter_validation_voter "
+            "WHERE reg_status = 'A'".format(columns=ACTIVE_VOTER_COLUMNS),
+            reverse_sql=migrations.RunSQL.noop),
+    ]
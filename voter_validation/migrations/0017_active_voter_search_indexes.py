@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# (index suffix, indexed columns) of the search indexes, which move from the
+# Voter table to the ActiveVoter search projection.
+SEARCH_INDEXES = [
+    ('search_name_trgm', 'USING gin (search_name gin_trgm_ops)'),
+    ('search_addr_trgm', 'USING gin (search_addr gin_trgm_ops)'),
+    ('first_name_phonetic', 'USING gin (first_name_phonetic)'),
+    ('last_name_phonetic', 'USING gin (last_name_phonetic)'),
+    ('search_name_zip', '(search_name, res_addr_zip)'),
+    ('address_parts', '(res_addr_house_num, '
+                      'upper(res_addr_street_name::text), '
+                      'upper(res_addr_unit_num::text))'),
+]
+
+
+def create_index(table, suffix, columns):
+    return migrations.RunSQL(
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS {table}_{suffix} "
+        "ON {table} {columns};".format(table=table, suffix=suffix,
+                                       columns=columns),
+        reverse_sql="DROP INDEX IF EXISTS {table}_{suffix};".format(
+            table=table, suffix=suffix))
+
+
+def drop_index(table, suffix, columns):
+    return migrations.RunSQL(
+        "DROP INDEX CONCURRENTLY IF EXISTS {table}_{suffix};".format(
+            table=table, suffix=suffix),
+        reverse_sql="CREATE INDEX CONCURRENTLY IF NOT EXISTS {table}_{suffix} "
+                    "ON {table} {columns};".format(table=table, suffix=suffix,
+                                                   columns=columns))
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction. Searches now
+    # read ActiveVoter, so the Voter table (and its shadow copies) no longer
+    # need the search indexes.
+    atomic = False
+
+    dependencies = [
+        ('voter_validation', '0016_active_voter'),
+    ]
+
+    operations = [
+        create_index('voter_validation_activevoter', suffix, columns)
+        for suffix, columns in SEARCH_INDEXES
+    ] + [
+        drop_index('voter_validation_voter', suffix, columns)
+        for suffix, columns in SEARCH_INDEXES
+    ]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2020-04-18 11:42
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+HOT_COLUMNS = [
+    'voter_id', 'res_addr_zip', 'res_addr_house_num', 'res_addr_street_name',
+    'res_addr_unit_num', 'content_hash', 'search_name', 'search_addr',
+    'first_name_phonetic', 'last_name_phonetic']
+COLD_COLUMNS = [
+    'full_name', 'res_addr', 'gender', 'party', 'language', 'curr_reg_date',
+    'orig_reg_date', 'reg_status', 'reg_status_reason']
+
+
+def repopulate(columns):
+    """
+    Rewrites the projection, since dropping columns doesn't shrink its rows.
+    """
+    columns = ', '.join(columns)
+    return "TRUNCATE voter_validation_activevoter; " \
+        "INSERT INTO voter_validation_activevoter ({columns}) " \
+        "SELECT {columns} FROM voter_validation_voter " \
+        "WHERE reg_status = 'A'".format(columns=columns)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_validation', '0017_active_voter_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(migrations.RunSQL.noop,
+                          reverse_sql=repopulate(HOT_COLUMNS + COLD_COLUMNS)),
+        migrations.RemoveField(
+            model_name='activevoter',
+            name='curr_reg_date',
+        ),
+        migrations.RemoveField(
+            model_name='activevoter',
+            name='full_name',
+        ),
+        migrations.RemoveField(
+            model_name='activevoter',
+            name='gender',
+        ),
+        migrations.RemoveField(
+            model_name='activevoter',
+            name='language',
+        ),
+        migrations.RemoveField(
+            model_name='activevoter',
+            name='orig_reg_date',
+        ),
+        migrations.RemoveField(
+            model_name='activevoter',
+            name='party',
+        ),
+        migrations.RemoveField(
+            model_name='activevoter',
+            name='reg_status',
+        ),
+        migrations.RemoveField(
+            model_name='activevoter',
+            name='reg_status_reason',
+        ),
+        migrations.RemoveField(
+            model_name='activevoter',
+            name='res_addr',
+        ),
+        migrations.RunSQL(repopulate(HOT_COLUMNS),
+                          reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2020-04-25 10:16
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations
+
+TABLE = 'voter_validation_activevoter'
+NEW_TABLE = TABLE + '_new'
+PARTITIONS = 8
+
+INDEX_DEF_REGEX = re.compile(
+    r'^(CREATE (?:UNIQUE )?INDEX) (\S+) ON (?:ONLY )?(\S+) ')
+
+
+def new_name(name):
+    return name[:63 - len('_new')] + '_new'
+
+
+def rebuild(schema_editor, partitions):
+    """
+    Frozen copy of active_voters.partition_active_voters, which rebuilds the
+    ActiveVoter table range-partitioned by ZIP (or not partitioned, if
+    partitions is 1).
+    """
+    cursor = schema_editor.connection.cursor()
+    cursor.execute("LOCK TABLE %s IN SHARE MODE" % TABLE)
+    cursor.execute(
+        "SELECT i.relname, pg_get_indexdef(i.oid), c.contype "
+        "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+        "LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid "
+        "AND c.conrelid = x.indrelid "
+        "WHERE x.indrelid = %s::regclass", [TABLE])
+    indexes = cursor.fetchall()
+
+    bounds = []
+    if partitions > 1:
+        cursor.execute(
+            "SELECT percentile_disc(%%s::float8[]) WITHIN GROUP "
+            "(ORDER BY res_addr_zip) FROM %s" % TABLE,
+            [[i / float(partitions) for i in range(partitions)]])
+        zips = cursor.fetchone()[0] or []
+        bounds = sorted(set(b for b in zips[1:] if b > zips[0]))
+    ranges = list(zip([None] + bounds, bounds + [None]))
+
+    if partitions > 1:
+        cursor.execute("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) "
+                       "PARTITION BY RANGE (res_addr_zip)" % (NEW_TABLE, TABLE))
+        for i, (zip_from, zip_to) in enumerate(ranges):
+            cursor.execute(
+                "CREATE TABLE %s_p%d PARTITION OF %s FOR VALUES FROM (%s) "
+                "TO (%s)" % (NEW_TABLE, i, NEW_TABLE,
+                             '%s' if zip_from else 'MINVALUE',
+                             '%s' if zip_to else 'MAXVALUE'),
+                [b for b in (zip_from, zip_to) if b])
+    else:
+        cursor.execute("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)" %
+                       (NEW_TABLE, TABLE))
+    cursor.execute("INSERT INTO %s SELECT * FROM %s" % (NEW_TABLE, TABLE))
+
+    for name, definition, contype in indexes:
+        if contype == 'p':
+            cursor.execute(
+                "ALTER TABLE %s ADD CONSTRAINT %s PRIMARY KEY (voter_id%s)" %
+                (NEW_TABLE, new_name(name),
+                 ', res_addr_zip' if partitions > 1 else ''))
+        else:
+            cursor.execute(INDEX_DEF_REGEX.sub(
+                r'\1 %s ON %s ' % (new_name(name), NEW_TABLE), definition))
+
+    cursor.execute("DROP TABLE %s" % TABLE)
+    cursor.execute("ALTER TABLE %s RENAME TO %s" % (NEW_TABLE, TABLE))
+    for name, _, _ in indexes:
+        cursor.execute("ALTER INDEX %s RENAME TO %s" % (new_name(name), name))
+    if partitions > 1:
+        for i in range(len(ranges)):
+            cursor.execute("ALTER TABLE %s_p%d RENAME TO %s_p%d" %
+                           (NEW_TABLE, i, TABLE, i))
+    cursor.execute("ANALYZE %s" % TABLE)
+
+
+def partition(apps, schema_editor):
+    rebuild(schema_editor, PARTITIONS)
+
+
+def unpartition(apps, schema_editor):
+    rebuild(schema_editor, 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter_validation', '0018_active_voter_cold_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # GiST trigram index for nearest-name searches (SearchStrategy.TRIGRAM_KNN)
+    # with the "<->" operator, which the GIN trigram indexes don't support.
+    # ActiveVoter is partitioned, so the index can't be built concurrently,
+    # but building it only blocks refreshes, not searches.
+
+    dependencies = [
+        ('voter_validation', '0019_partition_active_voters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE INDEX IF NOT EXISTS "
+            "voter_validation_activevoter_search_name_gist "
+            "ON voter_validation_activevoter "
+            "USING gist (search_name gist_trgm_ops);",
+            reverse_sql="DROP INDEX IF EXISTS "
+                        "voter_validation_activevoter_search_name_gist;"),
+    ]
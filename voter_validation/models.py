@@ -1,11 +1,14 @@
 from datetime import datetime
 
 from django.contrib.auth.models import User
+from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from django.utils import timezone
 
 from backend.settings import SERVER_TIME_ZONE
-from voter_validation.common import ChoiceEnum
+from voter_validation.common import ChoiceEnum, VOTER_HASH_FIELDS, \
+    voter_content_hash, voter_search_columns, SEARCH_NAME_LENGTH, \
+    SEARCH_ADDR_LENGTH, PHONETIC_KEY_LENGTH
 
 
 class RegStatus(ChoiceEnum):
@@ -71,18 +74,82 @@ class Voter(models.Model):
     party = models.CharField(max_length=50, default='', blank=True)
     language = models.CharField(max_length=16, default='', blank=True)
 
+    # Hash of the voter file fields above, to detect changed voters quickly
+    # when importing a voter file. Created on save.
+    content_hash = models.CharField(max_length=32, default='', blank=True)
+
+    # full_name and res_addr as searched, i.e. accent-folded, lower-cased and
+    # without punctuation (see common.normalize_search_text). Created on save.
+    search_name = models.CharField(max_length=SEARCH_NAME_LENGTH, default='',
+                                   blank=True)
+    search_addr = models.CharField(max_length=SEARCH_ADDR_LENGTH, default='',
+                                   blank=True)
+    # Phonetic keys of first_name and last_name, to find misspelled names
+    # (see common.phonetic_keys). Created on save.
+    first_name_phonetic = ArrayField(
+        models.CharField(max_length=PHONETIC_KEY_LENGTH), default=list,
+        blank=True)
+    last_name_phonetic = ArrayField(
+        models.CharField(max_length=PHONETIC_KEY_LENGTH), default=list,
+        blank=True)
+
     def __str__(self):
         return "%s (%s)" % (self.full_name, self.res_addr)
 
+    def compute_content_hash(self):
+        return voter_content_hash(
+            {f: getattr(self, f) for f in VOTER_HASH_FIELDS})
+
     def save(self, *args, **kwargs):
         """
-        Updates the full_name, then saves.
+        Updates the full_name, content_hash and search columns, then saves.
         """
         names = [self.first_name, self.middle_name, self.last_name, self.suffix]
         self.full_name = ' '.join(filter(lambda s: s != '', names))
+        self.content_hash = self.compute_content_hash()
+        self.search_name, self.search_addr, self.first_name_phonetic, \
+            self.last_name_phonetic = voter_search_columns(
+                self.first_name, self.last_name, self.full_name,
+                self.res_addr)
         super(Voter, self).save(*args, **kwargs)
 
 
+class ActiveVoter(models.Model):
+    """
+    Narrow copy of an Active Voter, with only the fields that searches filter
+    or rank on, so that searches don't read the wide Voter rows. The Voter
+    with the same voter_id holds the rest of its fields, which are only loaded
+    for the final top results of a search (see search.hydrate_hits). All
+    search indexes are on this table. Voter file imports refresh it (see
+    active_voters.py), so other changes to Voters only show up in searches
+    after the next refresh.
+    """
+    voter_id = models.CharField(max_length=60, default='', primary_key=True)
+    res_addr_zip = models.CharField(max_length=5, default='', db_index=True)
+    res_addr_house_num = models.CharField(max_length=10, default='', blank=True)
+    res_addr_street_name = models.CharField(
+        max_length=35, default='', blank=True)
+    res_addr_unit_num = models.CharField(
+        max_length=8, default='', blank=True)
+
+    # Voter.content_hash when this row was copied, to find changed Voters.
+    content_hash = models.CharField(max_length=32, default='', blank=True)
+
+    search_name = models.CharField(max_length=SEARCH_NAME_LENGTH, default='',
+                                   blank=True)
+    search_addr = models.CharField(max_length=SEARCH_ADDR_LENGTH, default='',
+                                   blank=True)
+    first_name_phonetic = ArrayField(
+        models.CharField(max_length=PHONETIC_KEY_LENGTH), default=list,
+        blank=True)
+    last_name_phonetic = ArrayField(
+        models.CharField(max_length=PHONETIC_KEY_LENGTH), default=list,
+        blank=True)
+
+    def __str__(self):
+        return "%s (%s)" % (self.search_name, self.search_addr)
+
+
 class Campaign(models.Model):
     """
     Represents an ongoing campaign that is doing voter validation. Note that
@@ -99,11 +166,13 @@ class Campaign(models.Model):
         """
         Count the number of ValidationRecords for this campaign that are for
         non-null Voters (i.e. still valid) with ACTIVE registration status.
+        This reads the CampaignCounter, so use select_related('counter') when
+        loading several Campaigns.
         """
-        return self.validationrecord_set.filter(
-            voter__reg_status=RegStatus.ACTIVE.value,
-            voter__isnull=False)\
-            .count()
+        try:
+            return self.counter.validation_count
+        except CampaignCounter.DoesNotExist:
+            return 0
 
 
 class UserProfile(models.Model):
@@ -143,6 +212,9 @@ class ValidationRecord(models.Model):
                                   on_delete=models.SET_NULL)
     last_updated = models.DateTimeField(default=timezone.now, blank=True,
                                         db_index=True)
+    # When the Voter was validated. Unlike last_updated, this isn't changed
+    # when the record is invalidated by a voter file update.
+    validated_at = models.DateTimeField(default=timezone.now, blank=True)
 
     # Campaign this Voter was validated for, and PK (for uniqueness constraint)
     campaign = models.ForeignKey(Campaign, null=True, on_delete=models.SET_NULL,
@@ -176,3 +248,36 @@ class ValidationRecord(models.Model):
         return "%s validated %s for %s" % \
                (self.validator.user.username, self.voter.full_name,
                 self.campaign.name)
+
+
+class CampaignCounter(models.Model):
+    """
+    Incrementally maintained Campaign.validation_count (see counters.py).
+    """
+    campaign = models.OneToOneField(Campaign, primary_key=True,
+                                    related_name='counter',
+                                    on_delete=models.CASCADE)
+    validation_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "%s: %d validations" % (self.campaign.name,
+                                       self.validation_count)
+
+
+class ValidatorHourlyCounter(models.Model):
+    """
+    Number of ValidationRecords a validator created for a Campaign in a given
+    hour (by validated_at), incrementally maintained (see counters.py).
+    """
+    validator = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE)
+    hour = models.DateTimeField()
+    validation_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (("validator", "campaign", "hour"),)
+
+    def __str__(self):
+        return "%s validated %d for %s at %s" % \
+               (self.validator.user.username, self.validation_count,
+                self.campaign.name, self.hour)
@@ -0,0 +1,246 @@
+"""
+Parallel, resumable parsing of a local voter file for bulk imports.
+
+The uncompressed TSV (see voter_file.VoterFileSource.plain_path) is split into
+byte-range chunks aligned to line boundaries, and the chunks are parsed and
+transformed into Voter fields in a process pool, reading lines through mmap.
+Each parsed chunk is COPYed into an unlogged table in its own transaction, and then
+recorded in a checkpoint file in the work directory. If the import is
+interrupted, re-running it with the same file and work directory skips the
+chunks that were already loaded.
+
+Once every chunk is loaded, build_new_voters creates the same new Voters table
+as bulk_import.py, so the usual merge (or shadow table swap) can be applied.
+"""
+import codecs
+import csv
+import json
+import logging
+import mmap
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.db import connection, transaction
+
+from voter_validation.bulk_import import qn, read_header, NEW_VOTERS_TABLE, \
+    VOTER_FILE_ENCODING
+from voter_validation.common import VOTER_HASH_FIELDS, voter_file_values, \
+    voter_content_hash
+
+logger = logging.getLogger(__name__)
+
+PARSED_TABLE = 'voter_validation_voter_parsed'
+CHECKPOINT_FILE = 'checkpoint.json'
+DEFAULT_CHUNK_SIZE = 32 * 1024 * 1024
+
+# Columns of the parsed table, after chunk_id and row_num.
+PARSED_FIELDS = VOTER_HASH_FIELDS + ['content_hash']
+
+# Escapes for COPY's text format.
+COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def chunk_ranges(path, chunk_size):
+    """
+    Splits a voter file into byte ranges of about chunk_size bytes. A chunk
+    contains every line that starts within its range.
+    :return: (header, list of (start, end) byte offsets)
+    """
+    with open(path, 'rb') as f:
+        header = read_header(f)
+        start = f.tell()
+    size = os.path.getsize(path)
+    ranges = []
+    while start < size:
+        end = min(start + chunk_size, size)
+        ranges.append((start, end))
+        start = end
+    return header, ranges
+
+
+def parse_chunk(path, header, chunk_id, start, end, out_path):
+    """
+    Parses the lines starting in [start, end) of the voter file and writes
+    them as Voter fields to out_path, in COPY text format. Run in a worker
+    process, so this must not use the database. Blank lines are skipped, like
+    csv.DictReader does.
+    :return: number of rows parsed
+    :raises ValueError: if a line has fewer columns than the header
+    """
+    def lines(m):
+        # Skip the partial line at the start of the range, which belongs to
+        # the previous chunk.
+        m.seek(start - 1)
+        m.readline()
+        while m.tell() < end:
+            line = m.readline()
+            if not line:
+                break
+            yield line
+
+    rows = 0
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, \
+            open(out_path, 'w', encoding='utf-8') as out:
+        reader = csv.reader(
+            codecs.iterdecode(lines(m), VOTER_FILE_ENCODING), delimiter='\t')
+        for row in reader:
+            if not row:
+                continue
+            if len(row) < len(header):
+                raise ValueError(
+                    "Malformed voter file line %d of chunk %d: expected %d "
+                    "columns, found %d" %
+                    (reader.line_num, chunk_id, len(header), len(row)))
+            values = voter_file_values(dict(zip(header, row)))
+            values['content_hash'] = voter_content_hash(values)
+            out.write('%d\t%d\t%s\n' % (
+                chunk_id, rows, '\t'.join(
+                    values[f].translate(COPY_ESCAPES) for f in PARSED_FIELDS)))
+            rows += 1
+    return rows
+
+
+class ChunkedImport(object):
+    """
+    Stages a local voter file into PARSED_TABLE using a process pool, with
+    per-chunk checkpoints in work_dir.
+    """
+    def __init__(self, path, work_dir, chunk_size=DEFAULT_CHUNK_SIZE,
+                 processes=None, progress=None):
+        """
+        :param path: local path of the voter file TSV
+        :param work_dir: directory for parsed chunks and the checkpoint
+        :param chunk_size: approximate size of each chunk, in bytes
+        :param processes: size of the process pool (default: CPU count)
+        :param progress: optional function called with (rows, rows per second,
+        chunks done, number of chunks) after each chunk is loaded.
+        """
+        self.path = path
+        self.work_dir = work_dir
+        self.chunk_size = chunk_size
+        self.processes = processes
+        self.progress = progress
+        self.checkpoint_path = os.path.join(work_dir, CHECKPOINT_FILE)
+
+    def source_info(self):
+        stat = os.stat(self.path)
+        return {
+            'path': os.path.abspath(self.path),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'chunk_size': self.chunk_size,
+        }
+
+    def load_checkpoint(self):
+        """
+        Returns the checkpoint for this voter file, or None if there isn't one
+        (or it was for a different file).
+        """
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if checkpoint.get('source') != self.source_info():
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [PARSED_TABLE])
+            if cursor.fetchone()[0] is None:
+                return None
+        return checkpoint
+
+    def save_checkpoint(self, checkpoint):
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def create_parsed_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS %s" % qn(PARSED_TABLE))
+            cursor.execute(
+                "CREATE UNLOGGED TABLE %s (chunk_id integer, row_num integer, "
+                "%s)" % (qn(PARSED_TABLE),
+                         ', '.join('%s text' % qn(f) for f in PARSED_FIELDS)))
+
+    def copy_chunk(self, chunk_id, out_path):
+        """
+        Loads a parsed chunk. Any rows from an earlier, interrupted attempt at
+        the same chunk are replaced.
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("DELETE FROM %s WHERE chunk_id = %%s" %
+                           qn(PARSED_TABLE), [chunk_id])
+            with open(out_path, 'rb') as f:
+                cursor.copy_expert(
+                    "COPY %s FROM STDIN WITH (FORMAT text, ENCODING 'UTF8')" %
+                    qn(PARSED_TABLE), f)
+        os.remove(out_path)
+
+    def stage(self):
+        """
+        Parses and loads every chunk that hasn't been loaded yet. Must not be
+        called inside a transaction, since each chunk is committed separately.
+        :return: number of rows loaded in this run
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        header, ranges = chunk_ranges(self.path, self.chunk_size)
+        checkpoint = self.load_checkpoint()
+        if checkpoint is None:
+            checkpoint = {'source': self.source_info(), 'done': []}
+            self.create_parsed_table()
+            self.save_checkpoint(checkpoint)
+        else:
+            logger.info("Resuming import: %d of %d chunks already loaded",
+                        len(checkpoint['done']), len(ranges))
+
+        rows = 0
+        start_time = time.time()
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            futures = {}
+            for chunk_id, (start, end) in enumerate(ranges):
+                if chunk_id in checkpoint['done']:
+                    continue
+                out_path = os.path.join(self.work_dir, 'chunk_%d.tsv' % chunk_id)
+                future = executor.submit(parse_chunk, self.path, header,
+                                         chunk_id, start, end, out_path)
+                futures[future] = (chunk_id, out_path)
+
+            for future in as_completed(futures):
+                chunk_id, out_path = futures[future]
+                rows += future.result()
+                self.copy_chunk(chunk_id, out_path)
+                checkpoint['done'].append(chunk_id)
+                self.save_checkpoint(checkpoint)
+                if self.progress:
+                    elapsed = max(time.time() - start_time, 1e-6)
+                    self.progress(rows, rows / elapsed,
+                                  len(checkpoint['done']), len(ranges))
+        return rows
+
+    def build_new_voters(self, cursor):
+        """
+        Creates the new Voters table (see bulk_import.build_new_voters) from
+        the parsed table. If a voter ID appears more than once, the last row
+        in the file wins.
+        :return: list of Voter fields set by the voter file
+        """
+        cursor.execute("DROP TABLE IF EXISTS %s" % qn(NEW_VOTERS_TABLE))
+        cursor.execute(
+            "CREATE TEMPORARY TABLE %s AS SELECT DISTINCT ON (voter_id) %s "
+            "FROM %s ORDER BY voter_id, chunk_id DESC, row_num DESC" %
+            (qn(NEW_VOTERS_TABLE), ', '.join(qn(f) for f in PARSED_FIELDS),
+             qn(PARSED_TABLE)))
+        return list(VOTER_HASH_FIELDS)
+
+    def cleanup(self):
+        """
+        Removes the parsed table and checkpoint after a successful import.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS %s" % qn(PARSED_TABLE))
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
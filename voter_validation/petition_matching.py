@@ -0,0 +1,176 @@
+"""
+Batch matching of digitized petition rows against the voter file.
+
+Each (name, address, ZIP) row of a petition CSV is searched like a volunteer
+would in the validation UI (see search.voter_search), in parallel across a
+process pool. Every worker keeps its own database connection open for all of
+the rows it matches, so the pool of connections is sized by the number of
+processes. Rows are sent to workers in batches to keep the IPC overhead down.
+
+The top candidates for each row are written to an output CSV. A row's best
+candidate is flagged when it is a high-confidence match: its score is high
+enough and clearly ahead of the runner-up. After reviewing the flags, all
+flagged matches can be validated at once (see the validate_matches command).
+"""
+import csv
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django import db
+from django.db import transaction
+
+from voter_validation.search import voter_search, get_search_backend
+from voter_validation.validation_queue import apply_validations
+
+logger = logging.getLogger(__name__)
+
+# Rows sent to a worker process at a time.
+BATCH_SIZE = 50
+# Number of candidates written for each petition row.
+DEFAULT_TOP_CANDIDATES = 3
+# A best candidate is flagged if its score is at least MIN_FLAG_SCORE, and at
+# least MIN_FLAG_MARGIN ahead of the next candidate. A perfect name and
+# address match scores 3.1 (see search.py).
+MIN_FLAG_SCORE = 2.2
+MIN_FLAG_MARGIN = 0.4
+
+# Columns of the petition CSV. Missing columns are treated as empty.
+PETITION_FIELDS = ['name', 'address', 'zip']
+MATCH_FIELDS = ['row'] + PETITION_FIELDS + [
+    'rank', 'voter_id', 'voter_name', 'voter_address', 'voter_zip',
+    'search_score', 'already_validated', 'flagged']
+FLAGGED = 'yes'
+
+
+def read_petition_rows(path):
+    """
+    Reads a petition CSV with a header row. Column names are matched
+    case-insensitively.
+    :return: list of dicts with the PETITION_FIELDS
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        header = [column.strip().lower() for column in next(reader, [])]
+        rows = []
+        for values in reader:
+            row = dict(zip(header, values))
+            rows.append(dict((field, row.get(field, '').strip())
+                             for field in PETITION_FIELDS))
+    return rows
+
+
+def is_confident(candidates, min_score, min_margin):
+    """
+    :param candidates: search results for a row, ranked in order
+    :return: True if the best candidate is a high-confidence match
+    """
+    if not candidates:
+        return False
+    # Scores of 0 are left out of the results (see serialize_voter_values).
+    best = candidates[0].get('search_score', 0.0)
+    runner_up = candidates[1].get('search_score', 0.0) \
+        if len(candidates) > 1 else 0.0
+    return best >= min_score and best - runner_up >= min_margin
+
+
+def match_rows(first_row, rows, campaign_id, top, min_score, min_margin):
+    """
+    Matches a batch of petition rows. Run in a worker process.
+    :param first_row: 1-based number of the first row in the batch
+    :return: list of dicts with the MATCH_FIELDS
+    """
+    matches = []
+    for row_num, row in enumerate(rows, start=first_row):
+        # Only the best two candidates matter for flagging.
+        candidates = voter_search(
+            row['name'], row['address'], row['zip'], campaign_id=campaign_id,
+            debug=True, limit=max(top, 2), use_cache=False)
+        # A search that ran out of time may have missed the runner-up.
+        flagged = not candidates.partial and \
+            is_confident(candidates, min_score, min_margin)
+        if not candidates:
+            matches.append(dict(row, row=row_num, rank='', voter_id='',
+                                voter_name='', voter_address='',
+                                voter_zip='', search_score='',
+                                already_validated='', flagged=''))
+        for rank, candidate in enumerate(candidates[:top], start=1):
+            matches.append(dict(
+                row, row=row_num, rank=rank,
+                voter_id=candidate['id'],
+                voter_name=candidate['name'],
+                voter_address=candidate['address'],
+                voter_zip=candidate['res_zip'],
+                search_score='%.4f' % candidate.get('search_score', 0.0),
+                already_validated=candidate['is_validated'],
+                flagged=FLAGGED if flagged and rank == 1 else ''))
+    return matches
+
+
+def match_petition(in_path, out_path, campaign_id=None, processes=None,
+                   top=DEFAULT_TOP_CANDIDATES, min_score=MIN_FLAG_SCORE,
+                   min_margin=MIN_FLAG_MARGIN, progress=None):
+    """
+    Matches every row of a petition CSV and writes the candidates to out_path,
+    in the petition's row order.
+    :param campaign_id: optional Campaign, to mark already validated Voters
+    :param processes: number of worker processes (defaults to the CPU count)
+    :param top: number of candidates written per row
+    :param progress: optional function called with (rows done, rows per sec,
+    total rows) after each batch
+    :return: dict with the number of "rows" matched and "flagged"
+    """
+    rows = read_petition_rows(in_path)
+    # Load any search backend state (e.g. the in-memory index) before
+    # forking, so workers share it. Workers must open their own database
+    # connections.
+    get_search_backend().warm_up()
+    db.connections.close_all()
+
+    start_time = time.time()
+    done = flagged = 0
+    with ProcessPoolExecutor(max_workers=processes) as executor, \
+            open(out_path, 'w', newline='', encoding='utf-8') as out:
+        writer = csv.DictWriter(out, fieldnames=MATCH_FIELDS)
+        writer.writeheader()
+        batches = [(i + 1, rows[i:i + BATCH_SIZE])
+                   for i in range(0, len(rows), BATCH_SIZE)]
+        futures = [executor.submit(match_rows, first_row, batch, campaign_id,
+                                   top, min_score, min_margin)
+                   for first_row, batch in batches]
+        for future, (_, batch) in zip(futures, batches):
+            matches = future.result()
+            writer.writerows(matches)
+            flagged += sum(1 for m in matches if m['flagged'] == FLAGGED)
+            done += len(batch)
+            if progress:
+                elapsed = max(time.time() - start_time, 1e-6)
+                progress(done, done / elapsed, len(rows))
+
+    logger.info("Matched %d petition rows in %.1f s, %d flagged", done,
+                time.time() - start_time, flagged)
+    return {'rows': done, 'flagged': flagged}
+
+
+def read_flagged_matches(path):
+    """
+    :param path: CSV written by match_petition, possibly with flags edited
+    :return: list of voter IDs of the flagged matches
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return [m['voter_id'] for m in csv.DictReader(f)
+                if m['flagged'].strip().lower() == FLAGGED and m['voter_id']]
+
+
+def validate_flagged_matches(path, campaign_id, validator_username):
+    """
+    Validates every flagged match in a match CSV for the Campaign, in one
+    transaction (see validation_queue.apply_validations).
+    :return: dict with the number of ValidationRecords "created" and
+    "deleted"
+    """
+    validations = [dict(voter_id=voter_id, campaign_id=campaign_id, val=True,
+                        validator_username=validator_username)
+                   for voter_id in read_flagged_matches(path)]
+    with transaction.atomic():
+        return apply_validations(validations)
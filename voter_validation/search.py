@@ -1,33 +1,178 @@
 """
 Search-related functions and variables
 """
+import abc
+import heapq
+import logging
 import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from enum import Enum
+from itertools import islice
 
-from django.contrib.postgres.search import TrigramSimilarity
-from django.db.models import F, Case, When, FloatField
+import psycopg2.errorcodes
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity, \
+    TrigramDistance
+from django.db import connection, transaction, OperationalError
+from django.db.models import F, Q, Case, When, FloatField, BooleanField, \
+    Exists, OuterRef, Value
+from django.utils.module_loading import import_string
 
-from .models import Voter, RegStatus
-from .serializers import VoterSerializer
+from .active_voters import active_voter_partitions
+from .common import normalize_search_text, phonetic_keys
+from .models import ActiveVoter, Voter, ValidationRecord, RegStatus
+from .search_cache import get_search_cache, cache_key
+from .search_stats import record_search
+from .serializers import serialize_voter_values, VOTER_FIELDS
 
-ALPHANUMERIC_REGEX = re.compile(r'\W+', re.UNICODE)
+logger = logging.getLogger(__name__)
 
-# Fields used in computing trigram similarity for Voter searches (fuzzy search)
-FULL_NAME_TRIGRAM_SIM_FIELDS = ['full_name']  # is a combination of all names
-RES_ADDR_TRIGRAM_SIM_FIELDS = ['res_addr']
+# Fields used in computing trigram similarity for Voter searches (fuzzy
+# search). These are normalized like queries (see normalize_query).
+FULL_NAME_TRIGRAM_SIM_FIELDS = ['search_name']  # all names, combined
+RES_ADDR_TRIGRAM_SIM_FIELDS = ['search_addr']
 FULL_NAME_WEIGHT = 1.5
 RES_ADDR_WEIGHT = 1.25
 EXACT_ADDR_WEIGHT = 0.35  # extra weight if voter address contains input address
 
+# Search score of a Voter found by voter ID, i.e. of a perfect match.
+VOTER_ID_SCORE = FULL_NAME_WEIGHT + RES_ADDR_WEIGHT + EXACT_ADDR_WEIGHT
+# Name queries that are looked up as a voter ID: one word with a digit in it.
+VOTER_ID_REGEX = re.compile(r'^\S*\d\S*$')
+
+# Minimum trigram similarity for a Voter to be ranked at all.
+MIN_SIMILARITY = 0.05
+
+# Similarity threshold used by the pg_trgm "%" operator for index-accelerated
+# candidate generation. This is much higher than MIN_SIMILARITY, which is what
+# lets the trigram GIN indexes prune most of the table. Misspelled names that
+# fall below it are still found by their phonetic keys (see phonetic_filter).
+CANDIDATE_SIMILARITY_THRESHOLD = 0.3
+
+# Tighter "%" threshold for searches retried after running out of time (see
+# search_budget), which finds fewer candidates to rank.
+DEGRADED_SIMILARITY_THRESHOLD = 0.5
+
+# Words at the end of a name query that aren't the last name.
+NAME_SUFFIXES = {'jr', 'sr', 'ii', 'iii', 'iv'}
+
+# Words of an address query that end the street name (see parse_address).
+STREET_SUFFIXES = {
+    'st', 'street', 'ave', 'av', 'avenue', 'blvd', 'boulevard', 'rd', 'road',
+    'dr', 'drive', 'ln', 'lane', 'way', 'ct', 'court', 'pl', 'place', 'ter',
+    'terrace', 'cir', 'circle', 'hwy', 'highway', 'pkwy', 'parkway', 'aly',
+    'alley', 'sq', 'square'}
+UNIT_PREFIXES = {'apt', 'unit', 'ste', 'suite', 'no', 'rm', 'room', 'fl'}
+HOUSE_NUM_REGEX = re.compile(r'^\d+[a-z]?$')
+
+
+# A ranked search result that has not been loaded from the database yet.
+SearchHit = namedtuple('SearchHit', [
+    'voter_id', 'search_score', 'name_similarity', 'addr_similarity',
+    'addr_exact_match'])
+
+
+class SearchResults(list):
+    """
+    List of search results. "partial" is True if the search ran out of time
+    and was retried with fewer candidates (see PostgresSearchBackend.rank),
+    so some matches may be missing. "hits" are the ranked SearchHits that the
+    results were loaded from, which also include Voters that are no longer
+    Active (see hydrate_hits), e.g. for paging with make_cursor.
+    """
+    def __init__(self, results=(), partial=False, hits=()):
+        super(SearchResults, self).__init__(results)
+        self.partial = partial
+        self.hits = list(hits)
+
+
+class SearchTimeout(Exception):
+    """
+    Raised when a search query is cancelled for running out of time.
+    """
+    pass
+
+
+# Components of an address query. Missing components are empty.
+ParsedAddress = namedtuple('ParsedAddress', ['house_num', 'street', 'unit'])
+
+
+class SearchStrategy(Enum):
+    """
+    How candidate Voters are generated before being ranked.
+    - FULL_SCAN computes similarity for every Active Voter (in the ZIP, if
+      given). Slow on large voter files, but has the best recall.
+    - TRIGRAM_INDEX uses the indexable pg_trgm "%" operator on the trigram
+      indexes to find candidates, and only ranks those.
+    - TRIGRAM_KNN is like TRIGRAM_INDEX, but name-only searches read the
+      nearest names from the trigram GiST index in order of similarity, and
+      stop after "limit" of them, so common names are as fast as rare ones.
+      The results are the same as with TRIGRAM_INDEX.
+    """
+    FULL_SCAN = 'full_scan'
+    TRIGRAM_INDEX = 'trigram_index'
+    TRIGRAM_KNN = 'trigram_knn'
+
+    def uses_index(self):
+        return self != SearchStrategy.FULL_SCAN
+
+
+def set_similarity_threshold(connection,
+                             threshold=CANDIDATE_SIMILARITY_THRESHOLD):
+    """
+    Sets the pg_trgm similarity threshold used by the "%" operator for the
+    given DB connection. This lasts for the lifetime of the connection.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT set_config('pg_trgm.similarity_threshold', %s, false)",
+            [str(threshold)])
+
+
+@contextmanager
+def search_budget(degraded=False):
+    """
+    Runs the queries of one search attempt in a transaction that Postgres
+    cancels after settings.SEARCH_TIMEOUT_MS, so one slow search can't hold a
+    DB connection and web worker for long. The timeout (and threshold) only
+    last until the transaction ends.
+    :param degraded: if True, also use DEGRADED_SIMILARITY_THRESHOLD for the
+    "%" operator
+    :raises SearchTimeout: if a query ran out of time
+    """
+    settings_sql = []
+    params = []
+    if settings.SEARCH_TIMEOUT_MS > 0:
+        settings_sql.append("set_config('statement_timeout', %s, true)")
+        params.append('%dms' % settings.SEARCH_TIMEOUT_MS)
+    if degraded:
+        settings_sql.append(
+            "set_config('pg_trgm.similarity_threshold', %s, true)")
+        params.append(str(DEGRADED_SIMILARITY_THRESHOLD))
+    if not settings_sql:
+        yield
+        return
+
+    try:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT " + ", ".join(settings_sql), params)
+            yield
+    except OperationalError as e:
+        if getattr(e.__cause__, 'pgcode', None) != \
+                psycopg2.errorcodes.QUERY_CANCELED:
+            raise
+        raise SearchTimeout(str(e))
+
 
 def normalize_query(query):
     """
-    Make the query lower-case and remove non-alphanumeric characters.
+    Make the query lower-case, fold accents and remove non-alphanumeric
+    characters, the same way as the Voter search columns.
     """
-    if query is None:
-        return query
-    query = query.lower()
-    query = ' '.join(ALPHANUMERIC_REGEX.split(query))
-    return query
+    return normalize_search_text(query)
 
 
 def construct_similarity_metric(fields, query):
@@ -47,33 +192,117 @@ def construct_similarity_metric(fields, query):
     return similarity
 
 
-def voter_search(name, address, res_zip, campaign_id=None,
-                 debug=False, normalize=True, limit=60):
+def phonetic_filter(name):
     """
-    Searches for the given Voter and returns a list of matching Active results.
-    :param name: string full name of Voter
-    :param address: string full residential address of Voter (or part thereof)
-    :param res_zip: string ZIP of Voter
-    :param campaign_id: if set, this is used to determine if a Voter has already
-    been validated.
-    :param debug: if True, add debug information to JSON about search.
-    :param normalize: if True, normalize the query parameters
-    :param limit: if > 0, return the top "limit" results.
-    :return: list of JSON-serialized Voters ranked in order
+    Constructs a filter that selects Voters whose first and last names sound
+    like the first and last words of the name query, in either order, using
+    the GIN indexes on the phonetic keys (see common.phonetic_keys). This
+    finds misspellings that trigrams miss, like "Cathryn" for "Katherine".
+    :param name: normalized full name query
+    :return: Q object, or None if the query doesn't have two names
     """
-    if normalize:
-        name = normalize_query(name)
-        address = normalize_query(address)
-        res_zip = normalize_query(res_zip)
+    words = [word for word in (name or '').split() if len(word) > 1]
+    while words and words[-1] in NAME_SUFFIXES:
+        words.pop()
+    if len(words) < 2:
+        return None
+    first_keys = phonetic_keys(words[0])
+    last_keys = phonetic_keys(words[-1])
+    if not first_keys or not last_keys:
+        return None
+    return Q(first_name_phonetic__overlap=first_keys,
+             last_name_phonetic__overlap=last_keys) | \
+        Q(first_name_phonetic__overlap=last_keys,
+          last_name_phonetic__overlap=first_keys)
+
 
-    # Filter by ZIP exactly, if present
-    corpus = Voter.objects
-    if res_zip is not None and res_zip != "":
-        corpus = corpus.filter(res_addr_zip=res_zip)
+def candidate_filter(name, address, phonetic=True):
+    """
+    Constructs a filter that selects candidate Voters using the pg_trgm "%"
+    operator, which can use the trigram indexes on search_name and
+    search_addr, unioned with phonetic name matches (see phonetic_filter).
+    :param name: normalized full name query
+    :param address: normalized address query
+    :param phonetic: if False, leave out the phonetic name matches
+    :return: Q object, or None if there is nothing to filter on
+    """
+    candidates = None
+    if name is not None and name != "":
+        candidates = Q(search_name__trigram_similar=name)
+        phonetic_candidates = phonetic_filter(name) if phonetic else None
+        if phonetic_candidates is not None:
+            candidates |= phonetic_candidates
+    if address is not None and address != "":
+        addr_candidates = Q(search_addr__trigram_similar=address)
+        if candidates is None:
+            candidates = addr_candidates
+        else:
+            candidates |= addr_candidates
+    return candidates
+
+
+def parse_address(address):
+    """
+    Splits an address query into its house number, street name and unit,
+    e.g. "551 mission ave apt 4" into ("551", "mission", "4"). The street
+    name is everything between the house number and the street suffix or
+    unit. A unit is only found after a unit prefix like "apt", as a word with
+    a digit after the street suffix, or as a number ending the street name.
+    :param address: normalized address query
+    :return: ParsedAddress
+    """
+    words = (address or '').split()
+    if not words or not HOUSE_NUM_REGEX.match(words[0]):
+        return ParsedAddress('', '', '')
+    house_num = words.pop(0)
 
-    # Ignore non-Active registration status
-    corpus = corpus.filter(reg_status=RegStatus.ACTIVE.value)
+    street = []
+    unit = ''
+    while words:
+        word = words.pop(0)
+        if word in UNIT_PREFIXES:
+            unit = words[0] if words else ''
+            break
+        if word in STREET_SUFFIXES and street:
+            if words and any(c.isdigit() for c in words[-1]):
+                unit = words[-1]
+            break
+        street.append(word)
+    # A number after the street name without a suffix, e.g. "551 mission 4"
+    if not unit and len(street) > 1 and street[-1].isdigit():
+        unit = street.pop()
+    return ParsedAddress(house_num, ' '.join(street), unit)
 
+
+def address_filter(address):
+    """
+    Constructs a filter that selects the Voters at an address query's house
+    number and street (and unit, if given), using the composite index on the
+    stored address components.
+    :param address: normalized address query
+    :return: Q object, or None if the query has no house number and street
+    """
+    parsed = parse_address(address)
+    if not parsed.house_num or not parsed.street:
+        return None
+    at_address = Q(res_addr_house_num=parsed.house_num.upper(),
+                   res_addr_street_name__iexact=parsed.street)
+    if parsed.unit:
+        at_address &= Q(res_addr_unit_num__iexact=parsed.unit)
+    return at_address
+
+
+def score_voters(voters, name, address, after=None):
+    """
+    Scores and ranks Voters by the weighted trigram similarity of their
+    search columns to the query.
+    :param voters: QuerySet of candidate Voters
+    :param name: normalized full name query
+    :param address: normalized address query
+    :param after: see voter_search
+    :return: QuerySet of Voters ranked in order, annotated with their
+    search_score and its components
+    """
     # Use full name and address for trigram similarity computation.
     addr_similarity = construct_similarity_metric(
         RES_ADDR_TRIGRAM_SIM_FIELDS, address)
@@ -81,31 +310,482 @@ def voter_search(name, address, res_zip, campaign_id=None,
         FULL_NAME_TRIGRAM_SIM_FIELDS, name)
 
     # Use weighted sum of trigram similarity for match.
-    voters = corpus.annotate(
-            name_similarity=name_similarity,
-            addr_similarity=addr_similarity,
-            addr_exact_match=Case(
-                When(res_addr__icontains=address, then=1.0),
-                default=0.0,
-                output_field=FloatField()
-            ))
+    voters = voters.annotate(
+        name_similarity=name_similarity,
+        addr_similarity=addr_similarity,
+        addr_exact_match=Case(
+            When(search_addr__contains=address, then=1.0),
+            default=0.0,
+            output_field=FloatField()
+        ))
 
     if name is not None and name != "":
-        voters = voters.filter(name_similarity__gte=0.005)
+        voters = voters.filter(name_similarity__gte=MIN_SIMILARITY)
 
     if address is not None and address != "":
-        voters = voters.filter(addr_similarity__gte=0.005)
+        voters = voters.filter(addr_similarity__gte=MIN_SIMILARITY)
 
     voters = voters.annotate(
         search_score=FULL_NAME_WEIGHT * F('name_similarity')
         + RES_ADDR_WEIGHT * F('addr_similarity')
-        + EXACT_ADDR_WEIGHT * F('addr_exact_match'))\
-        .order_by('-search_score')
+        + EXACT_ADDR_WEIGHT * F('addr_exact_match'))
+
+    # Keyset pagination: only Voters ranked after the given one.
+    if after is not None:
+        after_score, after_id = after
+        voters = voters.filter(
+            Q(search_score__lt=after_score) |
+            Q(search_score=after_score, voter_id__gt=after_id))
+
+    # Break ties by voter_id, so that the order is stable across queries.
+    return voters.order_by('-search_score', 'voter_id')
+
+
+def voter_values(voters, campaign_id=None, fields=()):
+    """
+    Selects only the serialized Voter fields, plus whether each Voter was
+    validated for the campaign (as an EXISTS subquery), so that Voters can be
+    serialized with serialize_voter_values straight from one query.
+    :param voters: Voter QuerySet
+    :param campaign_id: see voter_search
+    :param fields: extra fields or annotations to select
+    :return: ValuesQuerySet
+    """
+    if campaign_id:
+        is_validated = Exists(ValidationRecord.objects.filter(
+            voter=OuterRef('pk'), campaign_pk=campaign_id))
+    else:
+        is_validated = Value(False, output_field=BooleanField())
+    return voters.annotate(is_validated=is_validated).values(
+        'is_validated', *([field for _, field in VOTER_FIELDS] + list(fields)))
+
+
+class SearchBackend(object):
+    """
+    Base class for Voter search backends. Backends receive already-normalized
+    queries and rank Voters from the narrow ActiveVoter table, and only the
+    top results are then loaded from the Voter table by hydrate_hits. Only the
+    ranking is cached (see search_cache.py).
+    """
+    __metaclass__ = abc.ABCMeta
 
+    @abc.abstractmethod
+    def rank(self, name, address, res_zip, limit=60, strategy=None,
+             after=None):
+        """
+        Should return a list of SearchHits for Active Voters ranked in order
+        of descending search_score, then ascending voter_id. See voter_search
+        for a description of the parameters.
+        """
+        raise NotImplementedError
+
+    def search(self, name, address, res_zip, campaign_id=None, debug=False,
+               limit=60, strategy=None, after=None):
+        """
+        Ranks Voters without the search cache, and loads them.
+        :return: SearchResults of JSON-serialized Voters ranked in order
+        """
+        hits = self.rank(name, address, res_zip, limit=limit,
+                         strategy=strategy, after=after)
+        return hydrate_hits(hits, campaign_id=campaign_id, debug=debug)
+
+    def warm_up(self):
+        """
+        Called once when a web worker starts, so backends can load any state
+        they need before serving searches.
+        """
+        pass
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+    Ranks Voters inside Postgres using pg_trgm similarity. ActiveVoter is
+    partitioned by ZIP (see active_voters.py), so a search with a ZIP only
+    reads one partition. Searches without a ZIP rank each partition's ZIPs in
+    parallel on a pool of settings.SEARCH_FANOUT_WORKERS threads, each with its
+    own DB connection, and merge the results.
+    """
+    def __init__(self):
+        self.zip_ranges = None
+        self.executor = None
+
+    def partition_zip_ranges(self):
+        """
+        Loads the ZIP ranges of the ActiveVoter partitions once per process.
+        They always cover every ZIP, so if the table is partitioned again, the
+        old ranges still find every Voter until the process restarts.
+        :return: list of (first ZIP, ZIP after the last), with None for no
+        bound. Empty if ActiveVoter isn't partitioned.
+        """
+        if self.zip_ranges is None:
+            with connection.cursor() as cursor:
+                self.zip_ranges = [zip_range for _, zip_range in
+                                   active_voter_partitions(cursor)]
+        return self.zip_ranges
+
+    def warm_up(self):
+        self.partition_zip_ranges()
+
+    def ranked_voters(self, name, address, res_zip, strategy=None,
+                      after=None, at_address=None, zip_range=None,
+                      knn=False, degraded=False):
+        """
+        :param at_address: optional filter from address_filter, which replaces
+        trigram candidate generation
+        :param zip_range: optional (first ZIP, ZIP after the last) to search
+        within, with None for no bound
+        :param knn: if True, only rank Voters with similar names, ordered by
+        name distance alone, so the GiST index returns them in order and the
+        scan stops at the limit. Ties aren't ordered (see rank). For name-only
+        searches, this is the same order as by search_score.
+        :param degraded: if True, this search already ran out of time once,
+        so only rank the "%" trigram candidates (even with FULL_SCAN), without
+        phonetic name matches. Run it in search_budget(degraded=True), which
+        also tightens the "%" threshold.
+        :return: QuerySet of Voters ranked in order, annotated with their
+        search_score and its components
+        """
+        if strategy is None:
+            strategy = SearchStrategy(settings.VOTER_SEARCH_STRATEGY)
+
+        # Filter by ZIP exactly, if present. Only Active Voters are in the
+        # ActiveVoter search projection.
+        corpus = ActiveVoter.objects
+        if res_zip is not None and res_zip != "":
+            corpus = corpus.filter(res_addr_zip=res_zip)
+        if zip_range is not None:
+            zip_from, zip_to = zip_range
+            if zip_from is not None:
+                corpus = corpus.filter(res_addr_zip__gte=zip_from)
+            if zip_to is not None:
+                corpus = corpus.filter(res_addr_zip__lt=zip_to)
+
+        # Only rank Voters that are similar enough to be found via the trigram
+        # indexes, so latency scales with the number of matches.
+        if at_address is not None:
+            corpus = corpus.filter(at_address)
+        elif knn:
+            corpus = corpus.filter(search_name__trigram_similar=name)
+            voters = score_voters(corpus, name, address, after=after)
+            return voters.annotate(
+                name_distance=TrigramDistance('search_name', name),
+            ).order_by('name_distance')
+        elif strategy.uses_index() or degraded:
+            candidates = candidate_filter(name, address,
+                                          phonetic=not degraded)
+            if candidates is not None:
+                corpus = corpus.filter(candidates)
+
+        return score_voters(corpus, name, address, after=after)
+
+    def rank(self, name, address, res_zip, limit=60, strategy=None,
+             after=None):
+        """
+        If the address query has a house number and street, only the Voters at
+        that address are ranked at first, which only touches a handful of
+        rows. If none of them match the name (e.g. the Voter moved), all
+        candidates are ranked instead.
+
+        With TRIGRAM_KNN, name-only searches first read the "limit" nearest
+        names. If fewer names are similar enough to be found that way, there
+        are only a few candidates, so all of them are ranked as usual, which
+        also finds names by their phonetic keys. Ordering by voter_id as well
+        would make Postgres sort all of the candidates (before Postgres 13's
+        incremental sort), so names at the same distance are ordered here
+        instead, after reading every name tied with the last one.
+
+        Each ranking runs within settings.SEARCH_TIMEOUT_MS (see
+        search_budget). If it runs out of time, it is retried once with fewer
+        candidates (see ranked_voters), and the results are marked partial. If
+        that runs out of time too, nothing is returned for it.
+        :return: SearchResults of SearchHits
+        """
+        def fetch(voters):
+            if limit > 0:
+                voters = voters[:limit]
+            return [SearchHit(**row) for row in voters.values(
+                *SearchHit._fields)]
+
+        def fetch_nearest(voters):
+            size = limit
+            while True:
+                rows = list(voters[:size].values('name_distance',
+                                                 *SearchHit._fields))
+                if len(rows) < size or rows[-1]['name_distance'] != \
+                        rows[limit - 1]['name_distance']:
+                    break
+                # The last names read may be tied with names not read yet.
+                size *= 2
+            rows.sort(key=lambda row: (row['name_distance'], row['voter_id']))
+            return [SearchHit(*(row[field] for field in SearchHit._fields))
+                    for row in rows[:limit]]
+
+        if strategy is None:
+            strategy = SearchStrategy(settings.VOTER_SEARCH_STRATEGY)
+        knn = strategy == SearchStrategy.TRIGRAM_KNN and limit > 0 and \
+            bool(name) and not address
+        partial = False
+
+        def fetch_ranked(zip_range=None):
+            nonlocal partial
+            for degraded in (False, True):
+                try:
+                    with search_budget(degraded=degraded):
+                        if knn:
+                            hits = fetch_nearest(self.ranked_voters(
+                                name, address, res_zip, strategy=strategy,
+                                after=after, zip_range=zip_range, knn=True,
+                                degraded=degraded))
+                            if len(hits) == limit:
+                                return hits
+                        return fetch(self.ranked_voters(
+                            name, address, res_zip, strategy=strategy,
+                            after=after, zip_range=zip_range,
+                            degraded=degraded))
+                except SearchTimeout:
+                    partial = True
+                    logger.warning(
+                        "Search ran out of time (%d ms, degraded: %s, ZIPs: "
+                        "%s)", settings.SEARCH_TIMEOUT_MS, degraded,
+                        zip_range)
+            return []
+
+        if strategy.uses_index():
+            at_address = address_filter(address)
+            if at_address is not None:
+                try:
+                    with search_budget():
+                        hits = fetch(self.ranked_voters(
+                            name, address, res_zip, strategy=strategy,
+                            after=after, at_address=at_address))
+                except SearchTimeout:
+                    hits = []
+                if hits and (not name or any(
+                        hit.name_similarity >= CANDIDATE_SIMILARITY_THRESHOLD
+                        for hit in hits)):
+                    return SearchResults(hits)
+
+        zip_ranges = self.partition_zip_ranges()
+        if res_zip or len(zip_ranges) < 2 or \
+                settings.SEARCH_FANOUT_WORKERS < 2:
+            hits = fetch_ranked()
+            return SearchResults(hits, partial=partial)
+
+        def fetch_partition(zip_range):
+            # Pool threads outlive requests, so nothing else would close the
+            # DB connection this thread opens.
+            try:
+                return fetch_ranked(zip_range)
+            finally:
+                connection.close()
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=settings.SEARCH_FANOUT_WORKERS,
+                thread_name_prefix='search-fanout')
+        hits = heapq.merge(
+            *self.executor.map(fetch_partition, zip_ranges),
+            key=lambda hit: (-hit.search_score, hit.voter_id))
+        hits = list(islice(hits, limit) if limit > 0 else hits)
+        return SearchResults(hits, partial=partial)
+
+
+def exact_match_voters(query_name, name, address, res_zip):
+    """
+    Finds Voters for a search that was typed exactly: a voter ID in the name
+    field (via the primary key), or a full name and ZIP (via the
+    (search_name, res_addr_zip) index).
+    :param query_name: the name field as typed, for voter IDs
+    :param name: normalized full name query
+    :param address: normalized address query
+    :param res_zip: normalized ZIP
+    :return: QuerySet of Active Voters ranked in order, annotated like
+    score_voters, or None if the query can't be an exact match
+    """
+    active = ActiveVoter.objects.all()
+    voter_id = (query_name or '').strip()
+    if VOTER_ID_REGEX.match(voter_id):
+        return active.filter(voter_id=voter_id).annotate(
+            search_score=Value(VOTER_ID_SCORE, output_field=FloatField()),
+            name_similarity=Value(1.0, output_field=FloatField()),
+            addr_similarity=Value(1.0, output_field=FloatField()),
+            addr_exact_match=Value(1.0, output_field=FloatField()))
+    if not name or not res_zip:
+        return None
+    return score_voters(active.filter(search_name=name, res_addr_zip=res_zip),
+                        name, address)
+
+
+def exact_match_search(query_name, name, address, res_zip, campaign_id=None,
+                       debug=False, limit=60, after=None):
+    """
+    Fast path for searches that were typed exactly, which skips the fuzzy
+    ranking. A voter ID match is always confident. Name and ZIP matches are
+    confident unless an address was typed and none of them contain it.
+    See voter_search for a description of the parameters.
+    :return: SearchResults of JSON-serialized Voters ranked in order, or None
+    if there is no confident exact match
+    """
+    voters = exact_match_voters(query_name, name, address, res_zip)
+    if voters is None:
+        return None
+    # Exact matches are few, so confidence is decided over all of them and
+    # the page is taken in Python.
+    hits = [SearchHit(**row) for row in voters.values(*SearchHit._fields)]
+    if not hits:
+        return None
+    if address and not any(hit.addr_exact_match for hit in hits):
+        return None
+
+    if after is not None:
+        after_score, after_id = after
+        hits = [hit for hit in hits if hit.search_score < after_score or (
+            hit.search_score == after_score and hit.voter_id > after_id)]
     if limit > 0:
-        voters = voters[:limit]
+        hits = hits[:limit]
+    return hydrate_hits(hits, campaign_id=campaign_id, debug=debug)
+
+
+def hydrate_hits(hits, campaign_id=None, debug=False):
+    """
+    Loads and serializes the Voters for the given ranked SearchHits in one
+    query by primary key, keeping the rank order. Only these Voters' full rows
+    are read. Voters that are no longer Active are dropped.
+    :param hits: list of SearchHits
+    :param campaign_id: see voter_search
+    :param debug: see voter_search
+    :return: SearchResults of JSON-serialized Voters ranked in order, which
+    are partial if the hits are partial
+    """
+    partial = getattr(hits, 'partial', False)
+    if not hits:
+        return SearchResults(partial=partial, hits=hits)
+    voters = voter_values(
+        Voter.objects.filter(voter_id__in=[hit.voter_id for hit in hits],
+                             reg_status=RegStatus.ACTIVE.value),
+        campaign_id=campaign_id)
+    voters = dict((v['voter_id'], v) for v in voters)
+
+    results = []
+    for hit in hits:
+        values = voters.get(hit.voter_id)
+        if values is None:
+            continue
+        values.update(hit._asdict())
+        results.append(serialize_voter_values(values, debug=debug))
+    return SearchResults(results, partial=partial, hits=hits)
+
 
-    voters = voters.prefetch_related('validationrecord_set')
-    results = [VoterSerializer(v).serialize(
-        debug=debug, campaign_id=campaign_id) for v in voters]
-    return results
+_search_backends = {}
+
+
+def get_search_backend(path=None):
+    """
+    Returns the (cached) search backend instance for the given dotted path.
+    :param path: dotted path to a SearchBackend subclass. Defaults to
+    settings.VOTER_SEARCH_BACKEND.
+    :return: SearchBackend
+    """
+    if path is None:
+        path = settings.VOTER_SEARCH_BACKEND
+    if path not in _search_backends:
+        _search_backends[path] = import_string(path)()
+    return _search_backends[path]
+
+
+def warm_up_search_backend():
+    """
+    Loads the default search backend's state. Called when a web worker starts.
+    Failures (e.g. an unreachable or unmigrated database) are logged rather
+    than raised, so the worker still starts and loads the state on the first
+    search instead.
+    """
+    try:
+        get_search_backend().warm_up()
+    except Exception:
+        logger.exception("Failed to warm up search backend")
+
+
+def voter_search(name, address, res_zip, campaign_id=None,
+                 debug=False, normalize=True, limit=60, strategy=None,
+                 backend=None, use_cache=True, after=None, exact_match=None):
+    """
+    Searches for the given Voter and returns a list of matching Active results.
+    :param name: string full name of Voter
+    :param address: string full residential address of Voter (or part thereof)
+    :param res_zip: string ZIP of Voter
+    :param campaign_id: if set, this is used to determine if a Voter has already
+    been validated.
+    :param debug: if True, add debug information to JSON about search.
+    :param normalize: if True, normalize the query parameters
+    :param limit: if > 0, return the top "limit" results.
+    :param strategy: SearchStrategy used for candidate generation by the
+    Postgres backend. Defaults to settings.VOTER_SEARCH_STRATEGY.
+    :param backend: dotted path of the SearchBackend to use. Defaults to
+    settings.VOTER_SEARCH_BACKEND.
+    :param use_cache: if True, use the search cache (if enabled in
+    settings.SEARCH_CACHE)
+    :param after: optional (search_score, voter_id) of the last result of the
+    previous page. Only results ranked after it are returned (see
+    parse_cursor).
+    :param exact_match: if True, try the exact-match fast path first (see
+    exact_match_search). Defaults to settings.SEARCH_EXACT_MATCH.
+    :return: SearchResults of JSON-serialized Voters ranked in order. If
+    "partial" is set, the search ran out of time, and some matches may be
+    missing.
+    """
+    query_name = name
+    if normalize:
+        name = normalize_query(name)
+        address = normalize_query(address)
+        res_zip = normalize_query(res_zip)
+
+    if exact_match is None:
+        exact_match = settings.SEARCH_EXACT_MATCH
+    if exact_match:
+        results = exact_match_search(
+            query_name, name, address, res_zip, campaign_id=campaign_id,
+            debug=debug, limit=limit, after=after)
+        record_search(exact_match=results is not None)
+        if results is not None:
+            return results
+    else:
+        record_search(exact_match=False)
+
+    search_backend = get_search_backend(backend)
+    search_cache = get_search_cache() if use_cache else None
+    if search_cache is None:
+        return search_backend.search(
+            name, address, res_zip, campaign_id=campaign_id, debug=debug,
+            limit=limit, strategy=strategy, after=after)
+
+    if strategy is None:
+        strategy = SearchStrategy(settings.VOTER_SEARCH_STRATEGY)
+    key = cache_key(name, address, res_zip, limit=limit,
+                    strategy=strategy.value, after=after,
+                    backend=backend or settings.VOTER_SEARCH_BACKEND)
+    hits = search_cache.get_or_rank(key, lambda: search_backend.rank(
+        name, address, res_zip, limit=limit, strategy=strategy, after=after))
+    # Voters (and whether they are validated) are always loaded fresh.
+    return hydrate_hits(
+        SearchResults((SearchHit(*hit) for hit in hits),
+                      partial=getattr(hits, 'partial', False)),
+        campaign_id=campaign_id, debug=debug)
+
+
+def make_cursor(hit):
+    """
+    :param hit: a ranked SearchHit (see SearchResults.hits)
+    :return: opaque string cursor for the results ranked after this one
+    """
+    return '%r,%s' % (hit.search_score or 0.0, hit.voter_id)
+
+
+def parse_cursor(cursor):
+    """
+    :param cursor: string from make_cursor
+    :return: (search_score, voter_id) for voter_search's "after" parameter
+    :raises ValueError: if the cursor is malformed
+    """
+    score, voter_id = cursor.split(',', 1)
+    return float(score), voter_id
@@ -0,0 +1,201 @@
+"""
+Cache of ranked search results (see settings.SEARCH_CACHE). Volunteers re-run
+the same searches a lot, so the ranked SearchHits for a normalized (name,
+address, ZIP) query are cached with a TTL and LRU eviction, either in each web
+worker's memory ('locmem') or in Redis ('redis').
+
+Only the ranking is cached. Voters are loaded fresh for every search (see
+search.hydrate_hits), so validations always show up right away. The cache is
+invalidated after a voter file import by bumping a generation number in Redis,
+which is part of every cache key. If Redis is down, searches skip the cache.
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+
+from voter_validation.validation_queue import get_redis
+
+KEY_PREFIX = 'voter_validation:search_cache'
+GENERATION_KEY = KEY_PREFIX + ':generation'
+# Sorted set of Redis cache keys, scored by last access time.
+LRU_KEY = KEY_PREFIX + ':lru'
+# Seconds a process reuses the generation before reading it from Redis again.
+# Other web workers see an invalidation after up to this long.
+GENERATION_MAX_AGE = 5
+
+logger = logging.getLogger(__name__)
+
+# (time read, generation) of this process's last read of GENERATION_KEY
+_generation = (0, None)
+
+
+def cache_key(name, address, res_zip, **options):
+    """
+    :param options: anything else that changes the ranking, e.g. the backend,
+    strategy and limit
+    :return: string key for a normalized query
+    """
+    query = json.dumps([name, address, res_zip, sorted(options.items())])
+    return hashlib.md5(query.encode('utf-8')).hexdigest()
+
+
+def current_generation():
+    """
+    :return: the cache generation, read from Redis at most every
+    GENERATION_MAX_AGE seconds. If reading it fails, the last one read is used
+    until the next read.
+    :raises redis.RedisError: if no generation could be read yet
+    """
+    global _generation
+    read_at, generation = _generation
+    if time.time() - read_at > GENERATION_MAX_AGE:
+        # Don't retry a failing Redis on every search.
+        _generation = (time.time(), generation)
+        generation = int(get_redis().get(GENERATION_KEY) or 0)
+        _generation = (time.time(), generation)
+    if generation is None:
+        raise redis.ConnectionError("Search cache generation not read yet")
+    return generation
+
+
+def invalidate_search_cache():
+    """
+    Invalidates all cached search results, in every web worker (within
+    GENERATION_MAX_AGE seconds). Called after the Voter table changes, so a
+    Redis failure is logged rather than raised. In that case only this
+    process's generation is bumped, and other workers may serve stale results
+    until they expire.
+    """
+    global _generation
+    generation = _generation[1]
+    try:
+        generation = get_redis().incr(GENERATION_KEY)
+    except redis.RedisError:
+        logger.exception("Failed to invalidate search cache")
+        if generation is not None:
+            generation += 1
+    _generation = (time.time(), generation)
+
+
+class LocalSearchCache(object):
+    """
+    LRU cache in this process's memory.
+    """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (expiry time, list of SearchHits), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, hits):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, hits)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class RedisSearchCache(object):
+    """
+    LRU cache in Redis, shared by all web workers. Entries expire on their
+    own after the TTL, and LRU_KEY tracks access times so that the least
+    recently used entries are deleted once there are too many.
+    """
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key):
+        redis_key = '%s:%s' % (KEY_PREFIX, key)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.get(redis_key)
+        pipe.zadd(LRU_KEY, {redis_key: time.time()}, xx=True)
+        value, _ = pipe.execute()
+        if value is None:
+            return None
+        return json.loads(value.decode('utf-8'))
+
+    def set(self, key, hits):
+        redis_key = '%s:%s' % (KEY_PREFIX, key)
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.set(redis_key, json.dumps(hits), ex=self.ttl)
+        pipe.zadd(LRU_KEY, {redis_key: time.time()})
+        pipe.zcard(LRU_KEY)
+        size = pipe.execute()[-1]
+        if size > self.max_entries:
+            evicted = get_redis().zpopmin(LRU_KEY, size - self.max_entries)
+            if evicted:
+                get_redis().delete(*[k for k, _ in evicted])
+
+
+class SearchCache(object):
+    """
+    Cache of ranked search hits, which can be shared by search backends.
+    Hits are cached as tuples (see search.SearchHit).
+    """
+    BACKENDS = {
+        'locmem': LocalSearchCache,
+        'redis': RedisSearchCache,
+    }
+
+    def __init__(self, backend, max_entries, ttl):
+        self.backend = self.BACKENDS[backend](max_entries, ttl)
+
+    def get_or_rank(self, key, rank):
+        """
+        :param key: see cache_key
+        :param rank: function that ranks the query, if it isn't cached
+        :return: list of hit tuples
+        """
+        try:
+            key = '%d:%s' % (current_generation(), key)
+            hits = self.backend.get(key)
+        except redis.RedisError:
+            logger.warning("Search cache unavailable", exc_info=True)
+            return rank()
+        if hits is None:
+            hits = rank()
+            # Partial results of a search that ran out of time aren't cached,
+            # so the search is tried again in full next time.
+            if not getattr(hits, 'partial', False):
+                try:
+                    self.backend.set(key, hits)
+                except redis.RedisError:
+                    logger.warning("Search cache unavailable", exc_info=True)
+        return hits
+
+
+_search_cache = None
+
+
+def get_search_cache():
+    """
+    :return: the SearchCache configured by settings.SEARCH_CACHE, or None if
+    search results aren't cached
+    """
+    global _search_cache
+    if not settings.SEARCH_CACHE:
+        return None
+    if _search_cache is None:
+        _search_cache = SearchCache(settings.SEARCH_CACHE,
+                                    settings.SEARCH_CACHE_MAX_ENTRIES,
+                                    settings.SEARCH_CACHE_TTL)
+    return _search_cache
@@ -0,0 +1,97 @@
+"""
+Search counters shared by all web workers, kept in a Redis hash. These show
+how often searches are answered by the exact-match fast path (see
+search.exact_match_search) instead of the fuzzy ranking. See the search_stats
+command.
+
+Each process counts its searches in memory, and a background thread adds
+them to Redis every FLUSH_INTERVAL seconds, so searches don't wait on Redis,
+or fail if it is down.
+"""
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+import redis
+
+from voter_validation.validation_queue import get_redis
+
+STATS_KEY = 'voter_validation:search_stats'
+# Seconds between adding a process's counts to Redis.
+FLUSH_INTERVAL = 10
+
+logger = logging.getLogger(__name__)
+
+_counts = Counter()
+_counts_lock = threading.Lock()
+# ID of the process whose flush thread is running. Threads don't survive a
+# fork, so each worker process starts its own.
+_flusher_pid = None
+
+
+def record_search(exact_match):
+    """
+    Counts a voter_search.
+    :param exact_match: True if it was answered by the exact-match fast path
+    """
+    global _flusher_pid
+    with _counts_lock:
+        _counts['searches'] += 1
+        if exact_match:
+            _counts['exact_matches'] += 1
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=flush_periodically, daemon=True,
+                     name='search-stats-flush').start()
+
+
+def flush_periodically():
+    """
+    Adds this process's counts to Redis every FLUSH_INTERVAL seconds.
+    """
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        with _counts_lock:
+            counts = dict(_counts)
+            _counts.clear()
+        if counts:
+            flush_counts(counts)
+
+
+def flush_counts(counts):
+    """
+    Adds a process's counts to Redis. If that fails, they are kept for the
+    next flush.
+    """
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for field, count in counts.items():
+            pipe.hincrby(STATS_KEY, field, count)
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning("Couldn't save search stats", exc_info=True)
+        with _counts_lock:
+            _counts.update(counts)
+
+
+def search_stats():
+    """
+    :return: dict with the number of "searches", "exact_matches" and the
+    "exact_match_rate" since the counters were last reset. The last
+    FLUSH_INTERVAL seconds of searches may not be counted yet.
+    """
+    stats = get_redis().hgetall(STATS_KEY)
+    searches = int(stats.get(b'searches', 0))
+    exact_matches = int(stats.get(b'exact_matches', 0))
+    return {
+        'searches': searches,
+        'exact_matches': exact_matches,
+        'exact_match_rate': exact_matches / searches if searches else 0.0,
+    }
+
+
+def reset_search_stats():
+    get_redis().delete(STATS_KEY)
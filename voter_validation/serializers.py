@@ -36,10 +36,51 @@ class CampaignSerializer(Serializer):
         }
 
 
+# Serialized name of each Voter field visible to logged-in users.
+VOTER_FIELDS = [
+    ('id', 'voter_id'),
+    ('name', 'full_name'),
+    ('address', 'res_addr'),
+    ('res_zip', 'res_addr_zip'),
+    ('gender', 'gender'),
+    ('party', 'party'),
+    ('language', 'language'),
+    ('curr_reg_date', 'curr_reg_date'),
+    ('orig_reg_date', 'orig_reg_date'),
+    ('reg_status', 'reg_status'),
+    ('reg_status_reason', 'reg_status_reason'),
+]
+
+# Search debug info, added to serialized Voters if set.
+SEARCH_DEBUG_FIELDS = ['search_score', 'name_similarity', 'addr_similarity',
+                       'addr_exact_match']
+
+
+def serialize_voter_values(values, debug=False):
+    """
+    Serializes a dict of Voter fields (e.g. from QuerySet.values) without
+    creating a Voter.
+    :param values: dict with the fields in VOTER_FIELDS, is_validated and
+    optionally SEARCH_DEBUG_FIELDS
+    :param debug: if True, include search debug info
+    """
+    base_dict = dict((name, values[field]) for name, field in VOTER_FIELDS)
+    is_validated = bool(values['is_validated']) \
+        and values['reg_status'] == RegStatus.ACTIVE.value
+    base_dict['is_validated'] = str(is_validated).lower()
+    base_dict['type'] = 'Voter'
+    if debug:
+        for field in SEARCH_DEBUG_FIELDS:
+            if values.get(field):
+                base_dict[field] = values[field]
+    return base_dict
+
+
 class VoterSerializer(Serializer):
     """
     Used to create a serialized dict of a voter. The details here will be
-    visible to logged-in users.
+    visible to logged-in users. Searches serialize Voters with
+    serialize_voter_values instead, which doesn't need a query per Voter.
     """
     def __init__(self, voter, *args, **kwargs):
         super(VoterSerializer, self).__init__(*args, **kwargs)
@@ -48,33 +89,11 @@ class VoterSerializer(Serializer):
     def serialize(self, debug=False, campaign_id=None):
         # If campaign_id is specified, check if the ValidationRecord set for
         # this Voter contains that ID, to see if they're validated.
-        is_validated = False
-        if campaign_id:
-            is_validated = self.voter.validationrecord_set.filter(
-                campaign_pk=campaign_id).count() != 0 \
-                and self.voter.reg_status == RegStatus.ACTIVE.value
-        base_dict = {
-            'id': self.voter.voter_id,
-            'name': self.voter.full_name,
-            'address': self.voter.res_addr,
-            'res_zip': self.voter.res_addr_zip,
-            'gender': self.voter.gender,
-            'party': self.voter.party,
-            'language': self.voter.language,
-            'curr_reg_date': self.voter.curr_reg_date,
-            'orig_reg_date': self.voter.orig_reg_date,
-            'reg_status': self.voter.reg_status,
-            'reg_status_reason': self.voter.reg_status_reason,
-            'is_validated': str(is_validated).lower(),
-            'type': 'Voter',
-        }
-        if debug:
-            if getattr(self.voter, 'search_score', None):
-                base_dict['search_score'] = self.voter.search_score
-            if getattr(self.voter, 'name_similarity', None):
-                base_dict['name_similarity'] = self.voter.name_similarity
-            if getattr(self.voter, 'addr_similarity', None):
-                base_dict['addr_similarity'] = self.voter.addr_similarity
-            if getattr(self.voter, 'addr_exact_match', None):
-                base_dict['addr_exact_match'] = self.voter.addr_exact_match
-        return base_dict
+        values = dict((field, getattr(self.voter, field))
+                      for _, field in VOTER_FIELDS)
+        values['is_validated'] = bool(campaign_id) and \
+            self.voter.validationrecord_set.filter(
+                campaign_pk=campaign_id).count() != 0
+        for field in SEARCH_DEBUG_FIELDS:
+            values[field] = getattr(self.voter, field, None)
+        return serialize_voter_values(values, debug=debug)
@@ -0,0 +1,259 @@
+"""
+Zero-downtime voter file import. Instead of updating the live Voter table in
+place, the new voter file is loaded into a shadow copy of the table, which
+gets all of the live table's indexes. The shadow table is then swapped in with
+a few renames in one short transaction, so the site keeps running against the
+live table during the import. Voters added or edited in the live table after
+the shadow table was built are copied over at swap time. Searches read the
+ActiveVoter projection, which is refreshed after the swap (see
+active_voters.py).
+
+Usage (see the update_voters command):
+ - build_shadow_table(load) in one transaction
+ - swap_shadow_table() in a second transaction, or drop_shadow_table() to
+   cancel
+ - validate_foreign_keys() after the swap has committed
+"""
+import logging
+
+from django.db import connection
+
+from voter_validation.bulk_import import drop_new_voters, full_name_sql, \
+    invalidate_validation_records, missing_voters, not_in_new_voters_sql, qn, \
+    add_search_columns, NEW_VOTERS_TABLE
+from voter_validation.counters import create_status_changes_table, \
+    add_status_change_counts, STATUS_CHANGES_TABLE
+from voter_validation.ddl import suffixed_name, table_indexes, \
+    INDEX_DEF_REGEX
+from voter_validation.models import Voter, ValidationRecord, RegStatus
+
+logger = logging.getLogger(__name__)
+
+SHADOW_TABLE = 'voter_validation_voter_shadow'
+# (voter_id, content_hash) of the live Voters when the shadow table was built,
+# to find the Voters changed before the swap.
+SNAPSHOT_TABLE = 'voter_validation_voter_snapshot'
+OLD_TABLE = 'voter_validation_voter_old'
+SHADOW_SUFFIX = '_shadow'
+OLD_SUFFIX = '_old'
+
+
+def copy_indexes(cursor, source_table, dest_table):
+    """
+    Creates each index (and primary key/unique constraint) of the source table
+    on the destination table, with SHADOW_SUFFIX appended to its name.
+    """
+    for name, definition, contype in table_indexes(cursor, source_table):
+        shadow_name = suffixed_name(name, SHADOW_SUFFIX)
+        definition = INDEX_DEF_REGEX.sub(
+            r'\1 %s ON %s ' % (qn(shadow_name), qn(dest_table)), definition)
+        cursor.execute(definition)
+        if contype == 'p':
+            cursor.execute("ALTER TABLE %s ADD PRIMARY KEY USING INDEX %s" %
+                           (qn(dest_table), qn(shadow_name)))
+        elif contype == 'u':
+            cursor.execute("ALTER TABLE %s ADD UNIQUE USING INDEX %s" %
+                           (qn(dest_table), qn(shadow_name)))
+
+
+def build_shadow_table(load, inactivate_missing=False):
+    """
+    Loads the voter file into a fully indexed shadow Voter table. Voters that
+    are in the live table but not in the voter file are carried over, and
+    marked Inactive if inactivate_missing is set.
+    :param load: function taking a cursor, which creates the new Voters table
+    and returns the Voter fields set by the voter file (see
+    bulk_import.load_new_voters).
+    :return: dict of counts (see bulk_import.merge_new_voters).
+    vrs_invalidated is the number of ValidationRecords that will be
+    invalidated by the swap.
+    """
+    voter_table = qn(Voter._meta.db_table)
+    vr_table = qn(ValidationRecord._meta.db_table)
+    shadow_table = qn(SHADOW_TABLE)
+    snapshot_table = qn(SNAPSHOT_TABLE)
+    new_table = qn(NEW_VOTERS_TABLE)
+
+    with connection.cursor() as cursor:
+        # Taken first, so that Voters changed while the shadow table is built
+        # are also copied again at swap time (see reconcile_shadow_table).
+        cursor.execute("DROP TABLE IF EXISTS %s" % snapshot_table)
+        cursor.execute("CREATE UNLOGGED TABLE %s AS SELECT voter_id, "
+                       "content_hash FROM %s" % (snapshot_table, voter_table))
+        fields = load(cursor)
+        fields += add_search_columns(cursor)
+
+        cursor.execute("DROP TABLE IF EXISTS %s" % shadow_table)
+        cursor.execute("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)" %
+                       (shadow_table, voter_table))
+        columns = [qn(f) for f in fields] + ['full_name', 'content_hash']
+        cursor.execute(
+            "INSERT INTO %s (%s) SELECT %s FROM %s n" %
+            (shadow_table, ', '.join(columns),
+             ', '.join(['n.%s' % qn(f) for f in fields] +
+                       [full_name_sql('n'), 'n.content_hash']),
+             new_table))
+        cursor.execute(
+            "INSERT INTO %s SELECT v.* FROM %s v WHERE NOT EXISTS "
+            "(SELECT 1 FROM %s n WHERE n.voter_id = v.voter_id)" %
+            (shadow_table, voter_table, new_table))
+        voters_missing = missing_voters(
+            cursor, not_in_new_voters_sql(), voter_table=SHADOW_TABLE,
+            inactivate=inactivate_missing)
+
+        # Indexes are faster to build after loading the data.
+        copy_indexes(cursor, Voter._meta.db_table, SHADOW_TABLE)
+        cursor.execute("ANALYZE %s" % shadow_table)
+
+        cursor.execute(
+            "SELECT count(*), count(*) FILTER (WHERE v.content_hash IS "
+            "DISTINCT FROM n.content_hash) FROM %s n JOIN %s v "
+            "USING (voter_id)" % (new_table, voter_table))
+        voters_existing, voters_mod = cursor.fetchone()
+        cursor.execute("SELECT count(*) FROM %s" % new_table)
+        voters_add = cursor.fetchone()[0] - voters_existing
+        cursor.execute(
+            "SELECT count(*) FROM %s vr JOIN %s v USING (voter_id) "
+            "WHERE v.reg_status = %%s" % (vr_table, shadow_table),
+            [RegStatus.INACTIVE.value])
+        vrs_invalidated = cursor.fetchone()[0]
+
+    return {
+        'voters_add': voters_add,
+        'voters_unmod': voters_existing - voters_mod,
+        'voters_mod': voters_mod,
+        'voters_missing': voters_missing,
+        'vrs_invalidated': vrs_invalidated,
+    }
+
+
+def reconcile_shadow_table(cursor):
+    """
+    Copies the live Voters that were added or edited since the shadow table
+    was built into it, replacing the voter file's version, and removes the
+    Voters deleted since. Writes to the live table must be locked out.
+    """
+    voter_table = qn(Voter._meta.db_table)
+    shadow_table = qn(SHADOW_TABLE)
+    snapshot_table = qn(SNAPSHOT_TABLE)
+
+    cursor.execute(
+        "CREATE TEMPORARY TABLE voter_changes AS SELECT v.voter_id FROM %s v "
+        "WHERE NOT EXISTS (SELECT 1 FROM %s s WHERE s.voter_id = v.voter_id "
+        "AND s.content_hash = v.content_hash)" % (voter_table, snapshot_table))
+    cursor.execute("DELETE FROM %s n USING voter_changes c "
+                   "WHERE n.voter_id = c.voter_id" % shadow_table)
+    cursor.execute(
+        "INSERT INTO %s SELECT v.* FROM %s v JOIN voter_changes c "
+        "USING (voter_id)" % (shadow_table, voter_table))
+    voters_changed = cursor.rowcount
+    cursor.execute("DROP TABLE voter_changes")
+    cursor.execute(
+        "DELETE FROM %s n USING %s s WHERE n.voter_id = s.voter_id AND "
+        "NOT EXISTS (SELECT 1 FROM %s v WHERE v.voter_id = n.voter_id)" %
+        (shadow_table, snapshot_table, voter_table))
+    logger.info("Copied %d voters added or edited during the import to the "
+                "shadow table, and removed %d deleted ones", voters_changed,
+                cursor.rowcount)
+
+
+def swap_shadow_table():
+    """
+    Atomically replaces the live Voter table with the shadow table. Must be
+    called inside a transaction, in the same DB session as
+    build_shadow_table. Voters changed in the live table since then are
+    copied over first. The campaign counters are updated for voters whose
+    Active status changed, then ValidationRecords for voters that are
+    Inactive in the shadow table are invalidated, and their foreign keys are
+    moved to the new table. The foreign keys are re-created NOT VALID, so existing rows aren't
+    checked while the Voter table is locked; run validate_foreign_keys once
+    the transaction has committed.
+    :return: number of ValidationRecords invalidated
+    """
+    voter_table = Voter._meta.db_table
+    vr_table = qn(ValidationRecord._meta.db_table)
+
+    with connection.cursor() as cursor:
+        # Block new ValidationRecords and Voter changes (but not searches)
+        # while catching up and invalidating, then take the Voter table for
+        # the (fast) renames.
+        cursor.execute("LOCK TABLE %s IN SHARE ROW EXCLUSIVE MODE" % vr_table)
+        cursor.execute("LOCK TABLE %s IN EXCLUSIVE MODE" % qn(voter_table))
+        reconcile_shadow_table(cursor)
+        # Adjust the campaign counters for validated voters whose Active
+        # status differs in the shadow table.
+        create_status_changes_table(cursor)
+        cursor.execute(
+            "INSERT INTO %s (voter_id, active) SELECT DISTINCT s.voter_id, "
+            "s.reg_status = %%s FROM %s vr JOIN %s v USING (voter_id) "
+            "JOIN %s s USING (voter_id) "
+            "WHERE (v.reg_status = %%s) <> (s.reg_status = %%s)" %
+            (qn(STATUS_CHANGES_TABLE), vr_table, qn(voter_table),
+             qn(SHADOW_TABLE)), [RegStatus.ACTIVE.value] * 3)
+        add_status_change_counts(cursor)
+        vrs_invalidated = invalidate_validation_records(
+            cursor, voter_table=SHADOW_TABLE)
+        cursor.execute("LOCK TABLE %s IN ACCESS EXCLUSIVE MODE" %
+                       qn(voter_table))
+
+        # Foreign keys point at the table itself rather than its name, so
+        # they're dropped and re-created against the new table.
+        cursor.execute(
+            "SELECT conname, conrelid::regclass::text, "
+            "pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE confrelid = %s::regclass AND contype = 'f'", [voter_table])
+        foreign_keys = cursor.fetchall()
+        for name, table, _ in foreign_keys:
+            cursor.execute("ALTER TABLE %s DROP CONSTRAINT %s" %
+                           (table, qn(name)))
+
+        live_indexes = [i[0] for i in table_indexes(cursor, voter_table)]
+        shadow_indexes = set(i[0] for i in table_indexes(cursor, SHADOW_TABLE))
+        cursor.execute("ALTER TABLE %s RENAME TO %s" %
+                       (qn(voter_table), qn(OLD_TABLE)))
+        cursor.execute("ALTER TABLE %s RENAME TO %s" %
+                       (qn(SHADOW_TABLE), qn(voter_table)))
+        for name in live_indexes:
+            cursor.execute("ALTER INDEX %s RENAME TO %s" %
+                           (qn(name), qn(suffixed_name(name, OLD_SUFFIX))))
+            shadow_name = suffixed_name(name, SHADOW_SUFFIX)
+            if shadow_name in shadow_indexes:
+                cursor.execute("ALTER INDEX %s RENAME TO %s" %
+                               (qn(shadow_name), qn(name)))
+
+        for name, table, definition in foreign_keys:
+            cursor.execute("ALTER TABLE %s ADD CONSTRAINT %s %s NOT VALID" %
+                           (table, qn(name), definition))
+        cursor.execute("DROP TABLE %s" % qn(OLD_TABLE))
+        cursor.execute("DROP TABLE %s" % qn(SNAPSHOT_TABLE))
+        drop_new_voters(cursor)
+
+    logger.info("Swapped in new voter table. Invalidated %d validation "
+                "records.", vrs_invalidated)
+    return vrs_invalidated
+
+
+def validate_foreign_keys():
+    """
+    Validates the foreign keys to the Voter table that swap_shadow_table left
+    NOT VALID. This checks every existing row, but unlike adding a valid
+    foreign key, it doesn't block writes to either table.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT conname, conrelid::regclass::text FROM pg_constraint "
+            "WHERE confrelid = %s::regclass AND contype = 'f' "
+            "AND NOT convalidated", [Voter._meta.db_table])
+        for name, table in cursor.fetchall():
+            cursor.execute("ALTER TABLE %s VALIDATE CONSTRAINT %s" %
+                           (table, qn(name)))
+
+
+def drop_shadow_table():
+    """
+    Cancels a shadow table import.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS %s" % qn(SHADOW_TABLE))
+        cursor.execute("DROP TABLE IF EXISTS %s" % qn(SNAPSHOT_TABLE))
+        drop_new_voters(cursor)
@@ -0,0 +1,74 @@
+/**
+ * Polls the progress of a background voter file import.
+ */
+
+var IMPORT_POLL_INTERVAL_MS = 2000;
+
+// Defer until JQuery and the task ID are present.
+function deferImports(method) {
+  if (window.jQuery && window.importTaskId !== undefined) {
+    method();
+  } else {
+    setTimeout(function() { deferImports(method); }, 50);
+  }
+}
+deferImports(pollImportStatus);
+
+function pollImportStatus() {
+  if (!importTaskId) {
+    return;
+  }
+  $.ajax({
+    url: window.location.origin + "/api/private/import_status/" +
+        importTaskId + "/",
+    type: "GET",
+
+    success: function(status) {
+      $("#import-status").html(generateImportStatusHtml(status));
+      // Keep polling until the task has finished.
+      if (status["state"] === "PENDING" || status["state"] === "PROGRESS") {
+        setTimeout(pollImportStatus, IMPORT_POLL_INTERVAL_MS);
+      }
+    },
+
+    error: function(xhr, error_msg, err) {
+      console.log(error_msg);
+      setTimeout(pollImportStatus, IMPORT_POLL_INTERVAL_MS);
+    }
+  });
+}
+
+function generateImportStatusHtml(status) {
+  if (status["state"] === "FAILURE") {
+    return "Import failed: " + $("<div>").text(status["error"]).html();
+  }
+  if (status["stage"] === undefined) {
+    return "Import is " + status["state"].toLowerCase() + ".";
+  }
+
+  var rows = [
+    ["State", status["state"]],
+    ["Stage", status["stage"]],
+    ["Rows processed", Number(status["rows"]).toLocaleString("en")],
+    ["Rows/sec", Number(status["rows_per_sec"]).toFixed(0)],
+    ["Voters added", status["voters_add"]],
+    ["Voters unmodified", status["voters_unmod"]],
+    ["Voters modified", status["voters_mod"]],
+    ["Voters missing from voter file", status["voters_missing"]],
+    ["Validation records invalidated", status["vrs_invalidated"]]
+  ];
+  if (status["num_chunks"] !== undefined) {
+    rows.splice(2, 0, ["Chunks loaded",
+        status["chunks_done"] + "/" + status["num_chunks"]]);
+  }
+  if (status["message"] !== undefined) {
+    rows.push(["Message", status["message"]]);
+  }
+
+  var htmlToReturn = "<table id='voter-search-table' class='w100'>";
+  for (var i = 0; i < rows.length; i++) {
+    htmlToReturn += "<tr><th>" + rows[i][0] + "</th><td>" +
+        $("<div>").text(rows[i][1]).html() + "</td></tr>";
+  }
+  return htmlToReturn + "</table>";
+}
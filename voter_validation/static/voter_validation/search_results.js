@@ -4,6 +4,13 @@
 
 var VOTER_RESULTS_PER_PAGE = 30;
 
+// Searches go to the JSON search API, which returns a small first page. More
+// pages are fetched lazily with the cursor from the previous page.
+var SEARCH_API_URL = "/api/private/search/";
+var SEARCH_PAGE_SIZE = 5;
+var searchParams = null;
+var nextSearchCursor = null;
+
 // Defer until JQuery, pagination, required data are present.
 function deferSearchResults(method) {
   if (window.jQuery && window.addPagination
@@ -16,6 +23,16 @@ function deferSearchResults(method) {
 deferSearchResults(onLoadHandlerSearchResults);
 
 function onLoadHandlerSearchResults() {
+  bindResultActions("#voter-search-table");
+  $("#voter-search-form").submit(function(e) {
+    e.preventDefault();
+    searchVoters($(this));
+  });
+  $("#voter-search-more").click(function() {
+    fetchSearchPage(true);
+  });
+
+  // Results rendered by the server, e.g. if a search was posted directly.
   if (voterResults && voterResults.length !== 0) {
     generateResultsTable(voterResults, "#voter-search-table");
     addPagination("#voter-search-table", VOTER_RESULTS_PER_PAGE,
@@ -23,37 +40,143 @@ function onLoadHandlerSearchResults() {
   }
 }
 
-function submitValidationToApi(voterId, validate, elementToUpdate) {
-    $.ajax({
-        url: window.location.origin + "/api/private/validate_voter/",
-        type: "POST",
-        data: {
-            voter_id: voterId,
-            campaign_id: campaignId,  // global variable for page
-            val: validate
-        },
-
-        success: function(jsonResponse) {
-            // Update the text of the appropriate element.
-            if (jsonResponse["result"] === "success") {
-                if (validate) {
-                    elementToUpdate.text("Validated!");
-                } else {
-                    elementToUpdate.text("Invalidated!");
-                }
-            } else {
-                // Some kind of error occurred.
-                elementToUpdate.text("Error; see logs");
-                console.log(jsonResponse["error"]);
-            }
-        },
-
-        error: function(xhr, error_msg, err) {
-            console.log(error_msg);
+// Starts a new search with the fields in the given form.
+function searchVoters(form) {
+  searchParams = {
+    campaign_id: campaignId,  // global variable for page
+    name: form.find("input[name='name']").val(),
+    address: form.find("input[name='address']").val(),
+    zip: form.find("input[name='zip']").val()
+  };
+  nextSearchCursor = null;
+  fetchSearchPage(false);
+}
+
+// Fetches the first page of search results, or the next page if append is
+// true, and shows it.
+function fetchSearchPage(append) {
+  var params = $.extend({page_size: SEARCH_PAGE_SIZE}, searchParams);
+  if (append) {
+    params.cursor = nextSearchCursor;
+  }
+
+  $.ajax({
+    url: window.location.origin + SEARCH_API_URL,
+    type: "POST",
+    contentType: "application/json",
+    // Sent as a JSON body, not a query string, to keep the search fields out
+    // of request logs.
+    data: JSON.stringify(params),
+
+    success: function(jsonResponse) {
+      var results = jsonResponse["results"];
+      nextSearchCursor = jsonResponse["next_cursor"];
+      if (append) {
+        $("#voter-search-table tbody").append(resultRowsHtml(results));
+      } else {
+        $("#pagination-voter").remove();
+        generateResultsTable(results, "#voter-search-table");
+      }
+      // A page can be empty if its Voters are no longer Active, but there may
+      // still be more pages.
+      $(".voter-results-panel").toggle(
+          $("#voter-search-table tbody tr").length !== 0 ||
+          nextSearchCursor !== null);
+      $("#voter-search-more").toggle(nextSearchCursor !== null);
+      // The search ran out of time, so some matches may be missing. Keep the
+      // notice for later pages of a partial search.
+      if (!append || jsonResponse["partial"]) {
+        $("#voter-search-partial").toggle(jsonResponse["partial"] === true);
+      }
+    },
+
+    error: function(xhr, error_msg, err) {
+      console.log(error_msg);
+    }
+  });
+}
+
+// Validation clicks are queued and sent to the bulk validation API in
+// batches, after a short delay or once enough have been queued.
+var VALIDATION_FLUSH_DELAY_MS = 1000;
+var VALIDATION_MAX_BATCH = 50;
+var VALIDATION_API_URL = "/api/private/validate_voters/";
+var pendingValidations = [];
+var validationFlushTimer = null;
+
+// Queues a validation (validate = true) or invalidation of a Voter.
+function queueValidation(voterId, validate, elementToUpdate) {
+  pendingValidations.push({
+    voterId: voterId,
+    validate: validate,
+    element: elementToUpdate
+  });
+  if (pendingValidations.length >= VALIDATION_MAX_BATCH) {
+    flushValidations();
+  } else if (validationFlushTimer === null) {
+    validationFlushTimer = setTimeout(flushValidations,
+        VALIDATION_FLUSH_DELAY_MS);
+  }
+}
+
+function validationRequestBody(batch) {
+  return JSON.stringify({
+    campaign_id: campaignId,  // global variable for page
+    validations: batch.map(function(v) { return [v.voterId, v.validate]; })
+  });
+}
+
+// Sends all queued validations in one request.
+function flushValidations() {
+  clearTimeout(validationFlushTimer);
+  validationFlushTimer = null;
+  if (pendingValidations.length === 0) {
+    return;
+  }
+  var batch = pendingValidations;
+  pendingValidations = [];
+
+  $.ajax({
+    url: window.location.origin + VALIDATION_API_URL,
+    type: "POST",
+    contentType: "application/json",
+    data: validationRequestBody(batch),
+
+    success: function(jsonResponse) {
+      // Update the text of the appropriate elements.
+      var invalidIds = jsonResponse["invalid_voter_ids"] || [];
+      for (var i = 0; i < batch.length; i++) {
+        var v = batch[i];
+        if (jsonResponse["result"] !== "success" ||
+            invalidIds.indexOf(v.voterId) !== -1) {
+          v.element.text("Error; see logs");
+        } else if (v.validate) {
+          v.element.text("Validated!");
+        } else {
+          v.element.text("Invalidated!");
         }
-    });
+      }
+    },
+
+    error: function(xhr, error_msg, err) {
+      for (var i = 0; i < batch.length; i++) {
+        batch[i].element.text("Error; see logs");
+      }
+      console.log(error_msg);
+    }
+  });
 }
 
+// Don't lose queued validations when leaving the page.
+window.addEventListener("beforeunload", function() {
+  if (pendingValidations.length !== 0 && navigator.sendBeacon) {
+    navigator.sendBeacon(window.location.origin + VALIDATION_API_URL,
+        new Blob([validationRequestBody(pendingValidations)],
+            {type: "application/json"}));
+    pendingValidations = [];
+  }
+});
+
 /**
  * Add search result Voters to the given table.
  *
@@ -68,6 +191,16 @@ function generateResultsTable(resultList, tableSelector) {
   html += "<th class='action'>Action</th>";
 
   html += "</tr></thead><tbody>";
+  html += resultRowsHtml(resultList);
+  html += "</tbody>";
+  $(tableSelector).html(html);
+}
+
+/**
+ * Returns the HTML table rows for the given search result Voters.
+ */
+function resultRowsHtml(resultList) {
+  var html = "";
   for (var i = 0; i < resultList.length; i++) {
     var result = resultList[i];
     // Voter ID is row ID
@@ -106,30 +239,35 @@ function generateResultsTable(resultList, tableSelector) {
     }
     html += "</td></tr>";
   }
+  return html;
+}
 
-  html += "</tbody>";
-  $(tableSelector).html(html);
-
+/**
+ * Handles validation and invalidation clicks in the given results table,
+ * including rows added later.
+ */
+function bindResultActions(tableSelector) {
+  var table = $(tableSelector);
   // Invalidation link clicks
-  $(".invalidation-action a").click(function (e) {
+  table.on("click", ".invalidation-action a:not(.confirm)", function (e) {
     var voterId = $($(this).closest("tr")).attr('id');
     var tdToUpdate = $($(this).closest("td"));
     // Confirm first
     tdToUpdate.html("<a href='javascript:void(null);' class='confirm'>Confirm?</a>");
     tdToUpdate.find('.confirm').click(function(e) {
         tdToUpdate.text("Invalidating...");
-        submitValidationToApi(voterId, false, tdToUpdate);
+        queueValidation(voterId, false, tdToUpdate);
     });
   });
   // Validation link clicks
-  $(".validation-action a").click(function (e) {
+  table.on("click", ".validation-action a:not(.confirm)", function (e) {
     var voterId = $($(this).closest("tr")).attr('id');
     var tdToUpdate = $($(this).closest("td"));
     // Confirm first
     tdToUpdate.html("<a href='javascript:void(null);' class='confirm'>Confirm?</a>");
     tdToUpdate.find('.confirm').click(function(e) {
         tdToUpdate.text("Validating...");
-        submitValidationToApi(voterId, true, tdToUpdate);
+        queueValidation(voterId, true, tdToUpdate);
     });
   });
 }
@@ -1,18 +1,26 @@
 """
 Asynchronous and periodic tasks run by Celery on one worker node. Note that
 this uses redis. The tasks in this module are just supposed to run and interact
-with the database, and not return results.
+with the database, and not return results. The exception is import_voter_file,
+which stores its progress in the result backend so it can be polled.
 
-To run celery, see the command in the Procfile.
+Voter imports run on their own queue (see backend/celery.py), so a long import
+never holds up validate_voter. To run celery, see the commands in the Procfile.
 """
 from __future__ import absolute_import  # So we use the right celery
 
 import logging
 
 from celery import shared_task
+from celery.result import AsyncResult
+from django.db import transaction
 
-from voter_validation.models import ValidationRecord, Voter, Campaign, \
-    UserProfile
+from voter_validation.validation_queue import drain_queue, \
+    apply_validations
+from voter_validation.voter_import import VoterFileImport, ImportAborted
+
+# Celery state for a running import_voter_file task.
+IMPORT_PROGRESS_STATE = 'PROGRESS'
 
 logger = logging.getLogger(__name__)
 
@@ -26,31 +34,72 @@ def validate_voter(voter_id, campaign_id, val, validator_username):
     :param val: boolean value indicating whether to validate (True) or
     invalidate (False).
     :param validator_username: username of User that validated this campaign.
-    :return saved ValidationRecord, or None in the case of invalidation
-    """
-    # Look up objects based on given IDs.
-    voter = Voter.objects.get(voter_id=voter_id)
-    campaign = Campaign.objects.get(pk=campaign_id)
-    validator = UserProfile.objects.get(user__username=validator_username)
-
-    # Check if validation record already exists.
-    prev_vr = ValidationRecord.objects.filter(voter=voter, campaign=campaign)
-    if prev_vr.count() != 0:
-        vr = prev_vr.get()
-        if val:
-            # Already validated, so this is a no-op
-            return vr
-        else:
-            # Remove ValidationRecord entirely
-            vr.delete()
-            return None
-    else:
-        if val:
-            vr = ValidationRecord(voter=voter,
-                                  campaign=campaign,
-                                  validator=validator)
-            vr.save()
-            return vr
-        else:
-            # No-op since there is no existing ValidationRecord
-            return None
+    :return: dict with the number of ValidationRecords "created" and
+    "deleted" (see validation_queue.apply_validations)
+    """
+    # Same write path as batched validations, so the validation counters are
+    # updated in the same transaction.
+    with transaction.atomic():
+        return apply_validations([{
+            'voter_id': voter_id, 'campaign_id': campaign_id, 'val': val,
+            'validator_username': validator_username}])
+
+
+@shared_task
+def validate_voters(validations):
+    """
+    Validates/invalidates a batch of voters in one transaction, with bulk
+    queries (see validation_queue.apply_validations).
+    :param validations: list of dicts with voter_id, campaign_id, val and
+    validator_username (see validate_voter).
+    """
+    with transaction.atomic():
+        apply_validations(validations)
+
+
+@shared_task
+def drain_validations():
+    """
+    Applies validations queued by the validation API in batches, when
+    settings.VALIDATION_BATCHING is enabled. Runs periodically (see
+    backend/celery.py).
+    """
+    drain_queue()
+
+
+@shared_task(bind=True)
+def import_voter_file(self, source, options=None):
+    """
+    Imports a voter file without asking for confirmation (see the
+    update_voters command). Progress is stored in the result backend as the
+    task's state, and can be read with import_progress.
+    :param source: local path or URL of the voter file
+    :param options: dict of import options (see voter_import.DEFAULT_OPTIONS)
+    :return: final progress dict. For a dry run, stage is 'aborted'.
+    """
+    def update_progress(progress):
+        self.update_state(state=IMPORT_PROGRESS_STATE, meta=progress)
+
+    voter_import = VoterFileImport(source, options, progress=update_progress)
+    try:
+        return voter_import.run()
+    except ImportAborted as e:
+        progress = dict(voter_import.progress, stage='aborted')
+        progress['message'] = str(e)
+        return progress
+
+
+def import_progress(task_id):
+    """
+    Gets the progress of an import_voter_file task.
+    :return: dict with the Celery state (e.g. PENDING, PROGRESS, SUCCESS or
+    FAILURE) and, once the import has started, the progress dict (see
+    voter_import.VoterFileImport). Failed imports have an error message.
+    """
+    result = AsyncResult(task_id)
+    status = {'task_id': task_id, 'state': result.state}
+    if result.state == 'FAILURE':
+        status['error'] = str(result.info)
+    elif isinstance(result.info, dict):
+        status.update(result.info)
+    return status
@@ -15,5 +15,13 @@ urlpatterns = [
     # Validation links
     url(r'^api/private/validate_voter/$',
         apis_private.validation_api, name='validate_voter'),
+    url(r'^api/private/validate_voters/$',
+        apis_private.bulk_validation_api, name='validate_voters'),
     url(r'^validate/(?P<campaign_id>[\w]+)/$', views.validate, name='validate'),
+    url(r'^api/private/search/$', apis_private.search_api, name='search'),
+
+    # Voter file imports (staff only)
+    url(r'^imports/$', views.imports, name='imports'),
+    url(r'^api/private/import_status/(?P<task_id>[\w-]+)/$',
+        apis_private.import_status_api, name='import_status'),
 ]
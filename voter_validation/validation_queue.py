@@ -0,0 +1,296 @@
+"""
+Batched validation pipeline. Instead of one validate_voter task per click,
+validations can be pushed onto a Redis list (see settings.VALIDATION_BATCHING)
+and drained in batches by the periodic drain_validations task.
+
+Each batch is coalesced so that repeated toggles of the same (voter, campaign)
+pair only apply the last one, then applied with one bulk INSERT ... ON
+CONFLICT DO NOTHING and one bulk DELETE, keyed on ValidationRecord's
+(campaign_pk, voter_uid) uniqueness constraint. The rows these return adjust
+the validation counters in the same transaction (see counters.py).
+
+Each batch is moved to a processing list before it is applied, and only
+removed from it once its transaction commits. A batch left there by a worker
+that died (or failed) is applied again before anything queued after it.
+Applying a batch twice leaves the same records and counters.
+
+A batch that keeps failing is applied one validation at a time, and the
+validations that still fail are moved to a dead-letter list, so that they
+don't hold up the rest of the queue.
+"""
+import json
+import logging
+import os
+from collections import OrderedDict, Counter
+from datetime import datetime
+
+import redis
+from redis.exceptions import LockNotOwnedError
+from django.conf import settings
+from django.db import connection, transaction
+from psycopg2.extras import execute_values
+
+from backend.settings import SERVER_TIME_ZONE
+from voter_validation.counters import add_counts, hour_of
+from voter_validation.models import ValidationRecord, Voter, Campaign, \
+    UserProfile, RegStatus
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'voter_validation:validation_queue'
+DRAIN_LOCK_KEY = 'voter_validation:validation_queue:drain'
+# The batch being applied, until its transaction commits.
+PROCESSING_KEY = 'voter_validation:validation_queue:processing'
+# Validations that failed on their own, for inspection and manual retry.
+DEAD_LETTER_KEY = 'voter_validation:validation_queue:dead'
+# Number of consecutive failed attempts at the batch at the front of the queue.
+FAILURES_KEY = 'voter_validation:validation_queue:failures'
+# Failed attempts at a batch before its validations are applied one at a time.
+MAX_BATCH_ATTEMPTS = 3
+# Seconds before a Redis command (or connecting) fails, so that searches that
+# use Redis (see search_cache.py) don't hang if it does.
+REDIS_TIMEOUT = 2
+# Seconds before the drain lock expires, in case a worker dies holding it.
+# It is renewed after each batch.
+DRAIN_LOCK_TIMEOUT = 300
+
+# Atomically moves up to ARGV[1] items from the front of the queue (KEYS[1])
+# to the processing list (KEYS[2]). Like LMOVE, but for a whole batch.
+MOVE_BATCH_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    -- unpack() is limited by Lua's stack size, so push in chunks.
+    for i = 1, #items, 1000 do
+        redis.call('RPUSH', KEYS[2],
+                   unpack(items, i, math.min(i + 999, #items)))
+    end
+end
+return items
+"""
+
+_redis = None
+
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.StrictRedis.from_url(
+            os.environ['REDIS_URL'], socket_timeout=REDIS_TIMEOUT,
+            socket_connect_timeout=REDIS_TIMEOUT)
+    return _redis
+
+
+def enqueue_validations(validations):
+    """
+    Queues validations to be applied by drain_validations.
+    :param validations: list of dicts with voter_id, campaign_id, val and
+    validator_username (the arguments of tasks.validate_voter).
+    """
+    if validations:
+        get_redis().rpush(QUEUE_KEY,
+                          *[json.dumps(v) for v in validations])
+
+
+def pop_validations(max_items):
+    """
+    Moves up to max_items validations from the front of the queue to the
+    processing list. If the processing list still holds a batch that wasn't
+    applied, that batch is returned instead.
+    :return: list of validation dicts, in the order they were queued
+    """
+    r = get_redis()
+    items = r.lrange(PROCESSING_KEY, 0, -1)
+    if not items:
+        move_batch = r.register_script(MOVE_BATCH_SCRIPT)
+        items = move_batch(keys=[QUEUE_KEY, PROCESSING_KEY],
+                           args=[max_items])
+    return [json.loads(item.decode('utf-8')) for item in items]
+
+
+def coalesce(validations):
+    """
+    Collapses validations of the same (voter, campaign) pair to the last one.
+    :return: list of validation dicts
+    """
+    latest = OrderedDict()
+    for validation in validations:
+        key = (validation['voter_id'], int(validation['campaign_id']))
+        # Re-insert so the pair is ordered by its last validation.
+        latest.pop(key, None)
+        latest[key] = validation
+    return list(latest.values())
+
+
+def apply_validations(validations):
+    """
+    Applies validations in bulk: one INSERT for validations and one DELETE
+    for invalidations, then updates the validation counters for the records
+    actually created and deleted. Validations with an unknown voter, campaign
+    or validator are skipped. Must be called inside a transaction.
+    :param validations: list of validation dicts (see enqueue_validations)
+    :return: dict with the number of ValidationRecords "created" and
+    "deleted"
+    """
+    validations = coalesce(validations)
+    voters = dict(
+        (v['voter_id'], v) for v in Voter.objects.filter(
+            voter_id__in=set(v['voter_id'] for v in validations))
+        .values('voter_id', 'full_name', 'res_addr', 'reg_status'))
+    campaign_ids = set(Campaign.objects.filter(
+        pk__in=set(int(v['campaign_id']) for v in validations))
+        .values_list('pk', flat=True))
+    validators = dict(UserProfile.objects.filter(
+        user__username__in=set(v['validator_username'] for v in validations))
+        .values_list('user__username', 'pk'))
+
+    name_length = ValidationRecord._meta.get_field(
+        'voter_full_name').max_length
+    addr_length = ValidationRecord._meta.get_field(
+        'voter_res_address').max_length
+    now = datetime.now(SERVER_TIME_ZONE)
+    inserts = []
+    deletes = []
+    for validation in validations:
+        voter = voters.get(validation['voter_id'])
+        campaign_id = int(validation['campaign_id'])
+        validator_id = validators.get(validation['validator_username'])
+        if voter is None or campaign_id not in campaign_ids or \
+                validator_id is None:
+            logger.warning("Skipping invalid validation: %s", validation)
+            continue
+        if validation['val']:
+            # Same fields as ValidationRecord.save
+            inserts.append((validator_id, now, now, campaign_id, campaign_id,
+                            voter['voter_id'],
+                            voter['full_name'][:name_length],
+                            voter['res_addr'][:addr_length],
+                            voter['voter_id']))
+        else:
+            deletes.append((campaign_id, voter['voter_id']))
+
+    vr_table = connection.ops.quote_name(ValidationRecord._meta.db_table)
+    returning = " RETURNING validator_id, campaign_id, validated_at, voter_id"
+    created = deleted = []
+    with connection.cursor() as cursor:
+        if inserts:
+            created = execute_values(
+                cursor,
+                "INSERT INTO %s (validator_id, last_updated, validated_at, "
+                "campaign_id, campaign_pk, voter_id, voter_full_name, "
+                "voter_res_address, voter_uid) VALUES %%s "
+                "ON CONFLICT (campaign_pk, voter_uid) DO NOTHING" % vr_table +
+                returning, inserts, page_size=len(inserts), fetch=True)
+        if deletes:
+            deleted = execute_values(
+                cursor,
+                "DELETE FROM %s WHERE (campaign_pk, voter_uid) IN "
+                "(VALUES %%s)" % vr_table + returning,
+                deletes, page_size=len(deletes), fetch=True)
+
+        campaign_deltas = Counter()
+        validator_deltas = Counter()
+        for rows, delta in [(created, 1), (deleted, -1)]:
+            for validator_id, campaign_id, validated_at, voter_id in rows:
+                voter = voters.get(voter_id)
+                if voter is not None and \
+                        voter['reg_status'] == RegStatus.ACTIVE.value:
+                    campaign_deltas[campaign_id] += delta
+                if validator_id is not None:
+                    validator_deltas[(validator_id, campaign_id,
+                                      hour_of(validated_at))] += delta
+        add_counts(cursor, campaign_deltas, validator_deltas)
+    return {'created': len(created), 'deleted': len(deleted)}
+
+
+def apply_individually(validations):
+    """
+    Applies validations one at a time, each in its own transaction, and moves
+    the ones that fail to the dead-letter list.
+    :param validations: list of validation dicts, in the order they were
+    queued
+    :return: dict with the number of ValidationRecords "created" and
+    "deleted", and the number of validations "dead_lettered"
+    """
+    counts = Counter(created=0, deleted=0, dead_lettered=0)
+    for validation in validations:
+        try:
+            with transaction.atomic():
+                counts.update(apply_validations([validation]))
+        except Exception:
+            logger.exception("Moving failed validation to the dead-letter "
+                             "list: %s", validation)
+            get_redis().rpush(DEAD_LETTER_KEY, json.dumps(validation))
+            counts['dead_lettered'] += 1
+    return dict(counts)
+
+
+def apply_batch(validations, lock):
+    """
+    Applies a batch from the processing list in one transaction, renewing the
+    drain lock just before it commits. If the batch fails for the
+    MAX_BATCH_ATTEMPTS time in a row, it is applied one validation at a time
+    instead (see apply_individually).
+    :param lock: the drain lock held by this worker
+    :return: dict of counts from apply_validations or apply_individually
+    :raises LockNotOwnedError: if the lock expired, in which case the batch
+    is left in the processing list for the next drain
+    """
+    try:
+        with transaction.atomic():
+            counts = apply_validations(validations)
+            # If the lock expired, this rolls back the batch, so that it
+            # isn't applied twice at once.
+            lock.reacquire()
+        return counts
+    except LockNotOwnedError:
+        raise
+    except Exception:
+        attempts = get_redis().incr(FAILURES_KEY)
+        if attempts < MAX_BATCH_ATTEMPTS:
+            raise
+        logger.exception("Validation batch failed %d times, so applying it "
+                         "one validation at a time", attempts)
+    counts = apply_individually(validations)
+    lock.reacquire()
+    return counts
+
+
+def drain_queue(batch_size=None, max_batches=None):
+    """
+    Applies queued validations in batches until the queue is empty. Only one
+    worker drains the queue at a time, so that validations of the same pair
+    are applied in order. A batch that fails stays in the processing list and
+    is retried first by the next drain (see apply_batch).
+    :param max_batches: optional limit on the number of batches applied
+    :return: number of validations drained
+    """
+    batch_size = batch_size or settings.VALIDATION_BATCH_SIZE
+    lock = get_redis().lock(DRAIN_LOCK_KEY, timeout=DRAIN_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+
+    drained = batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            validations = pop_validations(batch_size)
+            if not validations:
+                break
+            try:
+                counts = apply_batch(validations, lock)
+            except LockNotOwnedError:
+                logger.warning("Validation queue drain lock expired, so "
+                               "leaving the batch for the next drain")
+                break
+            get_redis().delete(PROCESSING_KEY, FAILURES_KEY)
+            logger.info("Applied %d queued validations: %s",
+                        len(validations), counts)
+            drained += len(validations)
+            batches += 1
+    finally:
+        try:
+            lock.release()
+        except LockNotOwnedError:
+            # It expired while applying a batch (logged above).
+            pass
+    return drained
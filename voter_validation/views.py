@@ -1,6 +1,6 @@
 import logging
-from datetime import datetime, timedelta
 
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import logout as auth_logout
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
@@ -8,10 +8,14 @@ from django.http import HttpResponseRedirect
 from django.shortcuts import render, get_object_or_404
 from django.views.decorators.http import require_http_methods
 
-from backend.settings import SERVER_TIME_ZONE
-from voter_validation.models import Campaign, ValidationRecord
+from voter_validation.counters import validator_counts
+from voter_validation.models import Campaign
 from voter_validation.search import voter_search
 from voter_validation.serializers import CampaignSerializer
+from voter_validation.tasks import import_voter_file
+
+# Checkbox options on the imports page (see voter_import.DEFAULT_OPTIONS).
+IMPORT_FLAGS = ['dry_run', 'bulk', 'swap', 'parallel', 'inactivate_missing']
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +29,8 @@ def index(request):
     if request.user.is_authenticated():
         context['campaigns'] = [
             CampaignSerializer(c).serialize() for c in
-            request.user.userprofile.campaigns.order_by('pk')]
+            request.user.userprofile.campaigns.select_related('counter')
+            .order_by('pk')]
     return render(request, 'voter_validation/index.html', context)
 
 
@@ -65,16 +70,14 @@ def validate(request, campaign_id):
 
     # Get the number of signatures validated by the current user for this
     # campaign, and also for the past 24 hours.
-    val_sigs_set = ValidationRecord.objects.filter(
-        validator=request.user.userprofile, campaign=campaign)
-    val_sigs_24h = val_sigs_set.filter(
-        last_updated__gte=datetime.now(SERVER_TIME_ZONE) - timedelta(hours=24))
+    val_sigs, val_sigs_24h = validator_counts(request.user.userprofile,
+                                              campaign)
 
     context = {
         "campaign_name": campaign.name,
         "campaign_id": campaign_id,
-        "val_sigs": val_sigs_set.count(),
-        "val_sigs_24h": val_sigs_24h.count(),
+        "val_sigs": val_sigs,
+        "val_sigs_24h": val_sigs_24h,
     }
 
     # Search if specified in POST
@@ -90,6 +93,35 @@ def validate(request, campaign_id):
             "address": address,
             "zip": res_zip,
             "results": voters,
+            "partial": voters.partial,
         })
 
     return render(request, "voter_validation/validation.html", context)
+
+
+@staff_member_required
+@require_http_methods(["GET", "POST"])
+def imports(request):
+    """
+    Staff page to start a background voter file import, and follow the
+    progress of an import.
+    :param request: for a POST, contains the "source" URL or path of the voter
+    file and checkboxes for IMPORT_FLAGS. For a GET, may contain the
+    "task_id" of an import to follow.
+    """
+    if request.method == "POST":
+        source = request.POST.get("source", "").strip()
+        if source:
+            options = dict((flag, request.POST.get(flag) == "on")
+                           for flag in IMPORT_FLAGS)
+            task = import_voter_file.delay(source, options)
+            logger.info("%s queued voter import %s of %s with %s",
+                        request.user.username, task.id, source, options)
+            return HttpResponseRedirect(
+                reverse("voter_validation:imports") + "?task_id=" + task.id)
+
+    context = {
+        "task_id": request.GET.get("task_id", ""),
+        "import_flags": IMPORT_FLAGS,
+    }
+    return render(request, "voter_validation/imports.html", context)
@@ -0,0 +1,200 @@
+"""
+Voter file sources for the update_voters command. A voter file can be a local
+path or an HTTP(S) URL, and can be plain, gzip or zstd compressed (detected
+from the file's first bytes).
+
+Remote files are downloaded into a work directory first. Downloads resume with
+an HTTP Range request if an earlier download was interrupted, guarded by
+If-Range so that a changed file is downloaded again from the start. Plain
+local files are read through mmap, so lines are split straight out of the page
+cache instead of through a chain of Python buffers.
+"""
+import gzip
+import hashlib
+import io
+import logging
+import mmap
+import os
+from contextlib import closing, contextmanager
+
+import requests
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Suffix of the file storing a download's ETag or Last-Modified header.
+VALIDATOR_SUFFIX = '.validator'
+
+
+def is_url(source):
+    return source.startswith(('http://', 'https://'))
+
+
+def compression(path):
+    """
+    :return: 'gzip', 'zstd' or None for a plain file
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def download(url, path):
+    """
+    Downloads url to path. If path already holds part of the file from an
+    earlier attempt, only the rest of the file is requested.
+    :return: path
+    """
+    validator_path = path + VALIDATOR_SUFFIX
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    validator = None
+    if size and os.path.exists(validator_path):
+        with open(validator_path) as f:
+            validator = f.read()
+
+    # Compressed transfer encodings would break byte offsets.
+    headers = {'Accept-Encoding': 'identity'}
+    if validator:
+        headers['Range'] = 'bytes=%d-' % size
+        headers['If-Range'] = validator
+
+    with closing(requests.get(url, headers=headers, stream=True)) as r:
+        if validator and r.status_code == 416:
+            # Nothing left to download.
+            return path
+        r.raise_for_status()
+        if r.status_code == 206:
+            logger.info("Resuming download of %s at byte %d", url, size)
+            mode = 'ab'
+        else:
+            mode = 'wb'
+            validator = r.headers.get('ETag') or \
+                r.headers.get('Last-Modified')
+            if validator:
+                with open(validator_path, 'w') as f:
+                    f.write(validator)
+            elif os.path.exists(validator_path):
+                os.remove(validator_path)
+        with open(path, mode) as f:
+            for data in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(data)
+            received = f.tell()
+
+        # A dropped connection can end the body early without an error, so
+        # check the size. The next run resumes from here.
+        length = r.headers.get('Content-Length')
+        if length is not None:
+            expected = int(length) + (size if mode == 'ab' else 0)
+            if received != expected:
+                raise IOError("Download of %s stopped after %d of %d bytes. "
+                              "Run again to resume." %
+                              (url, received, expected))
+    return path
+
+
+class VoterFileSource(object):
+    """
+    A voter file given to update_voters, which may need to be downloaded or
+    decompressed into the work directory before it is read.
+    """
+    def __init__(self, source, work_dir):
+        """
+        :param source: local path or HTTP(S) URL of the voter file
+        :param work_dir: directory for downloaded and decompressed files
+        """
+        self.source = source
+        self.work_dir = work_dir
+        # Files created in work_dir, which are removed by cleanup().
+        self.work_files = []
+        # Local path of the voter file, once it has been downloaded.
+        self.path = None
+
+    def work_path(self, suffix):
+        """
+        Returns a path in the work directory that is specific to this source,
+        so that different voter files don't resume from each other's files.
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+        source_hash = hashlib.md5(self.source.encode('utf-8')).hexdigest()
+        path = os.path.join(self.work_dir, 'voter_file_%s%s' %
+                            (source_hash[:12], suffix))
+        if path not in self.work_files:
+            self.work_files.append(path)
+        return path
+
+    def local_path(self):
+        """
+        Returns a local path for the voter file, downloading it if needed.
+        The download is only checked (and resumed) by the first call.
+        """
+        if not is_url(self.source):
+            return self.source
+        if self.path is None:
+            path = self.work_path('.download')
+            self.work_files.append(path + VALIDATOR_SUFFIX)
+            self.path = download(self.source, path)
+        return self.path
+
+    def plain_path(self):
+        """
+        Returns a local path for the uncompressed voter file, which can be
+        seeked (e.g. to split it into chunks). Compressed files are
+        decompressed into the work directory, unless an earlier run already
+        did so.
+        """
+        path = self.local_path()
+        if compression(path) is None:
+            return path
+        plain_path = self.work_path('.tsv')
+        if not os.path.exists(plain_path):
+            tmp_path = plain_path + '.part'
+            with self.open() as f, open(tmp_path, 'wb') as out:
+                for data in iter(lambda: f.read(DECOMPRESS_CHUNK_SIZE), b''):
+                    out.write(data)
+            os.replace(tmp_path, plain_path)
+        return plain_path
+
+    @contextmanager
+    def open(self):
+        """
+        Opens the uncompressed voter file for reading.
+        :return: binary file-like object
+        """
+        path = self.local_path()
+        kind = compression(path)
+        if kind == 'gzip':
+            with gzip.open(path, 'rb') as f:
+                yield f
+        elif kind == 'zstd':
+            with open(path, 'rb') as raw, \
+                    zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+                yield io.BufferedReader(reader)
+        elif os.path.getsize(path) == 0:
+            # Empty files can't be mmapped.
+            with open(path, 'rb') as f:
+                yield f
+        else:
+            with open(path, 'rb') as raw, \
+                    mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as f:
+                yield f
+
+    def cleanup(self):
+        """
+        Removes downloaded and decompressed copies of the voter file. A local
+        voter file is never removed.
+        """
+        for path in self.work_files:
+            if os.path.exists(path):
+                os.remove(path)
+        self.work_files = []
+        self.path = None
@@ -0,0 +1,337 @@
+"""
+Runs a voter file import. This is shared by the update_voters command, which
+asks for confirmation before committing, and the import_voter_file Celery task,
+which runs non-interactively and stores its progress for polling.
+
+See the update_voters command for a description of the import options.
+"""
+import codecs
+import csv
+import logging
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from django.db import connection, transaction
+from psycopg2.extras import execute_values
+
+from voter_validation.active_voters import refresh_active_voters
+from voter_validation.bulk_import import bulk_merge, load_new_voters, \
+    invalidate_validation_records, missing_voters, qn
+from voter_validation.common import voter_file_values, voter_content_hash
+from voter_validation.counters import record_status_changes, \
+    add_status_change_counts
+from voter_validation.models import Voter, RegStatus
+from voter_validation.parallel_import import ChunkedImport
+from voter_validation.search_cache import invalidate_search_cache
+from voter_validation.shadow_import import build_shadow_table, \
+    swap_shadow_table, drop_shadow_table, validate_foreign_keys
+from voter_validation.voter_file import VoterFileSource
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'dry_run': False,
+    'bulk': False,
+    'swap': False,
+    'parallel': False,
+    'processes': None,
+    'chunk_size': 32,  # MB
+    'work_dir': os.path.join(tempfile.gettempdir(), 'update_voters'),
+    'inactivate_missing': False,
+}
+
+# Counts of voters added or modified, and number of validation records
+# invalidated.
+COUNTERS = ['voters_add', 'voters_unmod', 'voters_mod', 'voters_missing',
+            'vrs_invalidated']
+
+# How often the row-by-row import reports progress.
+PROGRESS_ROWS = 1000
+# Number of voter file rows whose stored content hashes are fetched at a time
+# by the row-by-row import.
+ROW_BATCH_SIZE = 1000
+# Temporary table of the voter IDs seen by the row-by-row import.
+SEEN_VOTERS_TABLE = 'voter_validation_seen_voters'
+
+
+class ImportAborted(Exception):
+    """
+    Raised to roll back an import, for a dry run or if it isn't confirmed.
+    """
+    pass
+
+
+class VoterFileImport(object):
+    """
+    Imports a voter file into the Voter table. Progress is kept in
+    self.progress, a JSON-serializable dict with:
+     - stage: 'loading', 'parsing' (with --parallel), 'confirming',
+       'swapping' (with --swap) or 'done'
+     - rows: voter file rows processed so far, and rows_per_sec
+     - chunks_done and num_chunks, with --parallel
+     - the COUNTERS
+    """
+    def __init__(self, source, options=None, progress=None, confirm=None):
+        """
+        :param source: local path or URL of the voter file
+        :param options: dict of options overriding DEFAULT_OPTIONS
+        :param progress: optional function called with a copy of
+        self.progress whenever it changes
+        :param confirm: optional function called with a copy of self.progress
+        before changes are committed. The import is rolled back unless it
+        returns True. Without it, imports are committed without confirmation.
+        """
+        self.options = dict(DEFAULT_OPTIONS, **(options or {}))
+        self.source = VoterFileSource(source, self.options['work_dir'])
+        self.on_progress = progress
+        self.confirm = confirm
+        self.start_time = time.time()
+        self.progress = {'stage': 'loading', 'rows': 0, 'rows_per_sec': 0.0}
+        self.progress.update((counter, 0) for counter in COUNTERS)
+
+    def report(self, **updates):
+        """
+        Updates self.progress and passes it to the progress function.
+        """
+        self.progress.update(updates)
+        if 'rows' in updates:
+            elapsed = max(time.time() - self.start_time, 1e-6)
+            self.progress['rows_per_sec'] = self.progress['rows'] / elapsed
+        if self.on_progress is not None:
+            self.on_progress(dict(self.progress))
+
+    def count_new_voters(self, counts):
+        """
+        Reports counts from a bulk import (see bulk_import.merge_new_voters).
+        Unless rows were already counted while parsing, every voter in the
+        file counts as one row.
+        """
+        rows = self.progress['rows'] or sum(
+            counts[c] for c in ['voters_add', 'voters_unmod', 'voters_mod'])
+        self.report(rows=rows, **counts)
+
+    def check_confirmed(self, dry_run_message, cancel_message):
+        """
+        Raises ImportAborted for a dry run, or if the import isn't confirmed.
+        """
+        self.report(stage='confirming')
+        if self.options['dry_run']:
+            raise ImportAborted(dry_run_message)
+        if self.confirm is not None and not self.confirm(dict(self.progress)):
+            raise ImportAborted(cancel_message)
+
+    def import_rows(self, tsv_reader):
+        """
+        Imports voter file rows one at a time, updating the counts. Rows are
+        read in batches, and each batch's stored content hashes are fetched
+        with one query. Rows whose hash matches the stored Voter's
+        content_hash don't touch the database. The voter IDs seen are staged
+        in a temporary table, to find the missing voters with an anti-join.
+        :param tsv_reader: csv.DictReader over the voter file
+        """
+        seen_table = qn(SEEN_VOTERS_TABLE)
+        # Voter ID -> whether the voter is Active now, for voters whose
+        # Active status changed.
+        status_changes = {}
+        counts = dict((counter, 0) for counter in COUNTERS)
+
+        count = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE %s (voter_id varchar(60) PRIMARY KEY) "
+                "ON COMMIT DROP" % seen_table)
+            while True:
+                batch = [voter_file_values(row)
+                         for row in islice(tsv_reader, ROW_BATCH_SIZE)]
+                if not batch:
+                    break
+                voter_ids = [values['voter_id'] for values in batch]
+                content_hashes = dict(
+                    Voter.objects.filter(voter_id__in=voter_ids)
+                    .values_list('voter_id', 'content_hash'))
+                execute_values(
+                    cursor, "INSERT INTO %s (voter_id) VALUES %%s "
+                    "ON CONFLICT DO NOTHING" % seen_table,
+                    [(voter_id,) for voter_id in voter_ids],
+                    page_size=len(voter_ids))
+
+                for values in batch:
+                    self.import_row(values, content_hashes, status_changes,
+                                    counts)
+                    count += 1
+                    if count % PROGRESS_ROWS == 0:
+                        self.report(rows=count, **counts)
+
+            # Handle voters missing from the voter file, then invalidate
+            # validation records of all Inactive voters in bulk.
+            record_status_changes(cursor, list(status_changes.items()))
+            counts['voters_missing'] = missing_voters(
+                cursor, "NOT EXISTS (SELECT 1 FROM %s s "
+                "WHERE s.voter_id = v.voter_id)" % seen_table,
+                inactivate=self.options['inactivate_missing'])
+            add_status_change_counts(cursor)
+            counts['vrs_invalidated'] = invalidate_validation_records(cursor)
+            cursor.execute("DROP TABLE %s" % seen_table)
+        self.report(rows=count, **counts)
+
+    def import_row(self, values, content_hashes, status_changes, counts):
+        """
+        Adds or updates the Voter for one voter file row, unless its content
+        hash is unchanged.
+        :param values: Voter fields from voter_file_values
+        :param content_hashes: dict of voter ID -> stored content_hash for
+        the row's batch, which is updated with the row's hash
+        :param status_changes: dict of voter ID -> whether the voter is
+        Active now, for voters whose Active status changed
+        :param counts: dict of COUNTERS, which is updated
+        """
+        content_hash = voter_content_hash(values)
+        voter_id = values['voter_id']
+
+        # Check if voter exists and has changed.
+        existing_hash = content_hashes.get(voter_id)
+        if existing_hash == content_hash:
+            # Voter is unchanged.
+            counts['voters_unmod'] += 1
+        elif existing_hash is not None:
+            # Voter already exists in voter file.
+            existing_voter = Voter.objects.get(voter_id=voter_id)
+            was_active = existing_voter.reg_status == RegStatus.ACTIVE.value
+            is_modified = False
+
+            # Check and change modified fields.
+            for field_name, value in values.items():
+                if getattr(existing_voter, field_name) == value:
+                    continue
+                setattr(existing_voter, field_name, value)
+                is_modified = True
+
+            if is_modified:
+                counts['voters_mod'] += 1
+                existing_voter.save()
+                is_active = existing_voter.reg_status == \
+                    RegStatus.ACTIVE.value
+                # A second change (e.g. from a duplicate row) undoes the
+                # first.
+                if is_active != was_active and \
+                        status_changes.pop(voter_id, None) is None:
+                    status_changes[voter_id] = is_active
+            else:
+                # Only the stored hash was out of date.
+                counts['voters_unmod'] += 1
+                Voter.objects.filter(voter_id=voter_id)\
+                    .update(content_hash=content_hash)
+        else:
+            # New voter
+            Voter(**values).save()
+            counts['voters_add'] += 1
+        content_hashes[voter_id] = content_hash
+
+    def report_chunk(self, rows, rows_per_sec, chunks_done, num_chunks):
+        self.report(rows=rows, chunks_done=chunks_done, num_chunks=num_chunks)
+
+    def stage_parallel(self):
+        """
+        Parses the voter file in parallel into a staging table, resuming from
+        the last checkpoint in the work directory if there is one.
+        :return: ChunkedImport
+        """
+        self.report(stage='parsing')
+        chunked = ChunkedImport(
+            self.source.plain_path(), self.options['work_dir'],
+            chunk_size=self.options['chunk_size'] * 1024 * 1024,
+            processes=self.options['processes'], progress=self.report_chunk)
+        chunked.stage()
+        self.report(stage='loading')
+        return chunked
+
+    @contextmanager
+    def open_new_voters(self, chunked):
+        """
+        Yields a function that loads the voter file into the new Voters table
+        used by bulk imports (see bulk_import.py).
+        :param chunked: ChunkedImport, if the file was staged in parallel
+        """
+        if chunked is not None:
+            yield chunked.build_new_voters
+            return
+        with self.source.open() as f:
+            yield lambda cursor: load_new_voters(cursor, f)
+
+    def merge_import(self, chunked):
+        """
+        Updates the live Voter table in one transaction.
+        """
+        inactivate_missing = self.options['inactivate_missing']
+        with transaction.atomic():
+            if self.options['bulk'] or chunked is not None:
+                with self.open_new_voters(chunked) as load:
+                    self.count_new_voters(
+                        bulk_merge(load, inactivate_missing))
+            else:
+                with self.source.open() as f:
+                    tsv_reader = csv.DictReader(
+                        codecs.iterdecode(iter(f.readline, b''), 'latin1'),
+                        delimiter='\t')
+                    self.import_rows(tsv_reader)
+
+            self.check_confirmed("Not saving because this is a dry run",
+                                 "You cancelled the transaction")
+
+    def swap_import(self, chunked):
+        """
+        Loads the voter file into a shadow Voter table while the live table
+        keeps serving searches, then swaps it in.
+        """
+        with transaction.atomic():
+            with self.open_new_voters(chunked) as load:
+                self.count_new_voters(build_shadow_table(
+                    load, self.options['inactivate_missing']))
+
+        try:
+            self.check_confirmed("Not swapping because this is a dry run",
+                                 "You cancelled the swap")
+        except ImportAborted:
+            drop_shadow_table()
+            raise
+
+        self.report(stage='swapping')
+        with transaction.atomic():
+            self.report(vrs_invalidated=swap_shadow_table())
+        # Checks the existing ValidationRecords without holding the swap's
+        # locks.
+        validate_foreign_keys()
+
+    def run(self):
+        """
+        Runs the import.
+        :return: final progress dict
+        :raises ImportAborted: for a dry run, or if the import is cancelled.
+        """
+        # Parallel staging commits each chunk, so it happens before the import
+        # transaction. A dry run or cancellation keeps the staged chunks (and
+        # any download), so the next run can resume from them.
+        chunked = None
+        if self.options['parallel']:
+            chunked = self.stage_parallel()
+
+        if self.options['swap']:
+            self.swap_import(chunked)
+        else:
+            self.merge_import(chunked)
+        # Searches read the ActiveVoter projection, so refresh it, then drop
+        # cached rankings, which may include changed or inactive Voters.
+        with transaction.atomic(), connection.cursor() as cursor:
+            refresh_active_voters(cursor)
+        invalidate_search_cache()
+
+        if chunked is not None:
+            chunked.cleanup()
+        self.source.cleanup()
+        self.report(stage='done')
+        logger.info("Imported voter file %s: %s", self.source.source,
+                    self.progress)
+        return dict(self.progress)